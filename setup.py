@@ -8,6 +8,7 @@ setup(
         "langgraph>=0.0.15",
         "langchain>=0.0.267",
         "langchain-openai>=0.0.2",
+        "openai>=1.0.0",
         "pydantic>=2.0.0",
         "python-dotenv>=1.0.0",
     ],
@@ -4,15 +4,51 @@ LangGraph workflow for the Zork AI agent.
 This module provides a LangGraph-based workflow for the agent, implementing
 an observe-think-act loop with more sophisticated reasoning capabilities.
 """
-from typing import Dict, List, Any, Optional, TypedDict
+from typing import Annotated, Dict, List, Literal, Any, Optional, Tuple, Type, TypedDict
+import functools
+import json
+import logging
 import os
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
+from pydantic import BaseModel, BeforeValidator, Field, create_model
+from src.agent.llm import make_llm
+
+# Use orjson for faster JSON serialization if available
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Maximum number of history items kept in the state
+_MAX_HISTORY = 32
+# Number of recent history items shown in the thought prompt
+_PROMPT_HISTORY = 3
+
+
+def _add_history(
+    history: List[Dict[str, Any]],
+    items: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Append new history items, keeping only the most recent ones.
+    
+    Args:
+        history: The existing history
+        items: The history items to append
+        
+    Returns:
+        The combined history, truncated to _MAX_HISTORY items
+    """
+    return (history + items)[-_MAX_HISTORY:]
+
+
 # Define the state schema
 class AgentState(TypedDict):
     """State for the agent workflow."""
@@ -22,15 +58,291 @@ class AgentState(TypedDict):
     location: str
     thought: Optional[str]
     action: Optional[str]
-    history: List[Dict[str, Any]]
+    history: Annotated[List[Dict[str, Any]], _add_history]
     score: int
     moves: int
     done: bool
 
 
+def _format_history(history: List[Dict[str, Any]]) -> str:
+    """
+    Serialize history items as compact JSON for a prompt.
+    
+    An observation repeated within the items is replaced by a reference to
+    the first of them with the same text, so a reference never points at a
+    move that is not shown.
+    
+    Args:
+        history: The history items to serialize
+        
+    Returns:
+        The history as a JSON string, with non-ASCII text left unescaped
+    """
+    first_moves: Dict[str, Any] = {}
+    items = []
+    for item in history:
+        observation = item.get("observation")
+        if observation in first_moves:
+            item = {**item, "observation": f"<same as move {first_moves[observation]}>"}
+        else:
+            first_moves[observation] = item.get("moves")
+        items.append(item)
+    history = items
+    
+    if HAS_ORJSON:
+        return orjson.dumps(history, default=str).decode()
+    return json.dumps(history, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+# Prompt templates; only the game state fields are substituted each step
+_THOUGHT_PROMPT_TEMPLATE = """\
+You are an expert text adventure game player. You are playing Zork.
+
+Current Observation:
+{observation}
+
+Current Location:
+{location}
+
+Inventory:
+{inventory}
+
+Valid Actions:
+{valid_actions}
+
+Score: {score}
+Moves: {moves}
+
+Recent History:
+{history}
+
+Think about the current situation. What should you do next and why?
+Consider your goals, the environment, and the available actions.
+"""
+
+_ACTION_PROMPT_TEMPLATE = """\
+You are an expert text adventure game player. You are playing Zork.
+
+Current Observation:
+{observation}
+
+Current Location:
+{location}
+
+Inventory:
+{inventory}
+
+Valid Actions:
+{valid_actions}
+
+Your Thought:
+{thought}
+
+Based on your thought, choose the single next action you will take.
+The action must be one of the valid actions provided.
+"""
+
+
+def _create_thought_prompt(state: AgentState) -> str:
+    """
+    Create the prompt used to generate a thought about the current state.
+    
+    Args:
+        state: The current state
+        
+    Returns:
+        The prompt string
+    """
+    return _THOUGHT_PROMPT_TEMPLATE.format_map({
+        "observation": state["observation"],
+        "location": state["location"],
+        "inventory": state["inventory"],
+        "valid_actions": ", ".join(state["valid_actions"][:20]),
+        "score": state["score"],
+        "moves": state["moves"],
+        "history": _format_history(state["history"][-_PROMPT_HISTORY:])
+    })
+
+
+def _create_action_prompt(state: AgentState) -> str:
+    """
+    Create the prompt used to turn a thought into a single action.
+    
+    Args:
+        state: The current state
+        
+    Returns:
+        The prompt string
+    """
+    return _ACTION_PROMPT_TEMPLATE.format_map({
+        "observation": state["observation"],
+        "location": state["location"],
+        "inventory": state["inventory"],
+        "valid_actions": ", ".join(state["valid_actions"][:20]),
+        "thought": state["thought"]
+    })
+
+
+@functools.lru_cache(maxsize=64)
+def _create_action_schema(valid_actions: Tuple[str, ...]) -> Type[BaseModel]:
+    """
+    Create a structured output schema that only accepts valid actions.
+    
+    Args:
+        valid_actions: The valid actions in the current state
+        
+    Returns:
+        A pydantic model whose action field is restricted to the valid actions
+    """
+    # Map differently cased or padded actions to the valid action with one
+    # dict lookup; the mapping is built once per set of valid actions
+    canonical = {action.lower(): action for action in valid_actions}
+    
+    def normalize(value: Any) -> Any:
+        if isinstance(value, str):
+            return canonical.get(value.strip().lower(), value)
+        return value
+    
+    return create_model(
+        "ActionChoice",
+        action=(
+            Annotated[Literal[valid_actions], BeforeValidator(normalize)],
+            Field(description="The single next action to take")
+        )
+    )
+
+
+def _choose_actions(
+    llm: Any,
+    states: List[AgentState],
+    config: Optional[Dict[str, Any]] = None
+) -> List[str]:
+    """
+    Choose an action for each state with decoding constrained to the valid actions.
+    
+    Args:
+        llm: The LLM to use
+        states: The states to choose actions for, all with the same valid actions
+        config: The runnable config for the batch
+        
+    Returns:
+        The chosen actions, "look" for any state where the LLM call failed
+    """
+    valid_actions = tuple(states[0]["valid_actions"])
+    if not valid_actions:
+        return ["look"] * len(states)
+    
+    chooser = llm.with_structured_output(
+        _create_action_schema(valid_actions), method="function_calling")
+    choices = chooser.batch(
+        [_create_action_prompt(state) for state in states],
+        config=config,
+        return_exceptions=True
+    )
+    
+    actions = []
+    for choice in choices:
+        if isinstance(choice, Exception) or choice is None:
+            logger.warning("Error choosing action: %s", choice)
+            actions.append("look")  # Default to looking around
+        else:
+            actions.append(choice.action)
+    return actions
+
+
+def _observe(state: AgentState) -> Dict[str, Any]:
+    """
+    Process the current observation.
+    
+    Args:
+        state: The current state
+        
+    Returns:
+        The changed keys; the history item is appended by the history reducer
+    """
+    # Clear the previous thought and action
+    update: Dict[str, Any] = {"thought": None, "action": None}
+    
+    # Add the current observation to history
+    if state["observation"]:
+        history_item = {
+            "observation": state["observation"],
+            "location": state["location"],
+            "inventory": state["inventory"],
+            "score": state["score"],
+            "moves": state["moves"]
+        }
+        
+        # Add the previous action if it exists
+        if state["action"]:
+            history_item["action"] = state["action"]
+            
+        update["history"] = [history_item]
+    
+    return update
+
+
+def _update_from_env(agent_state: AgentState, state: Dict[str, Any]) -> None:
+    """
+    Copy the environment state into the agent state.
+    
+    Args:
+        agent_state: The agent state to update
+        state: The state returned by the environment
+    """
+    agent_state["observation"] = state["observation"]
+    agent_state["valid_actions"] = state["valid_actions"]
+    agent_state["inventory"] = state["inventory"]
+    agent_state["location"] = state["location"]
+    agent_state["score"] = state["score"]
+    agent_state["moves"] = state["moves"]
+    agent_state["done"] = state["done"]
+
+
+def think_many(
+    llm: Any,
+    states: List[AgentState],
+    max_concurrency: int = 8
+) -> List[AgentState]:
+    """
+    Generate thoughts and actions for several states with batched LLM calls.
+    
+    Args:
+        llm: The LLM to use
+        states: The states to generate thoughts and actions for
+        max_concurrency: Maximum number of concurrent LLM requests
+        
+    Returns:
+        The updated states with a thought and an action
+    """
+    config = {"max_concurrency": max_concurrency}
+    
+    # Generate all thoughts in one batch; a failed request only affects its own state
+    responses = llm.batch(
+        [_create_thought_prompt(s) for s in states], config=config, return_exceptions=True)
+    for state, response in zip(states, responses):
+        if isinstance(response, Exception):
+            logger.warning("Error generating thought: %s", response)
+            state["thought"] = ""
+        else:
+            state["thought"] = response.content
+    
+    # Then all actions, one batch per distinct set of valid actions
+    groups: Dict[Tuple[str, ...], List[AgentState]] = {}
+    for state in states:
+        groups.setdefault(tuple(state["valid_actions"]), []).append(state)
+    for group in groups.values():
+        for state, action in zip(group, _choose_actions(llm, group, config)):
+            state["action"] = action
+    
+    return states
+
+
 def create_agent_workflow(
     model_name: str = "gpt-3.5-turbo",
-    api_key: Optional[str] = None
+    api_key: Optional[str] = None,
+    temperature: float = 0.7,
+    base_url: Optional[str] = None
 ) -> StateGraph:
     """
     Create a LangGraph workflow for the Zork AI agent.
@@ -38,52 +350,19 @@ def create_agent_workflow(
     Args:
         model_name: The name of the LLM model to use
         api_key: The API key for the LLM provider (defaults to environment variable)
+        temperature: The sampling temperature (use 0 for cacheable, deterministic responses)
+        base_url: The base URL of an OpenAI-compatible server (defaults to
+            the LLM_BASE_URL environment variable)
         
     Returns:
         A LangGraph StateGraph
     """
     # Initialize the LLM
-    llm = ChatOpenAI(
-        model=model_name,
-        api_key=api_key or os.environ.get("OPENAI_API_KEY"),
-        temperature=0.7
-    )
+    llm = make_llm(model_name, api_key, temperature,
+                   base_url=base_url or os.environ.get("LLM_BASE_URL"))
     
     # Define the nodes
-    def observe(state: AgentState) -> AgentState:
-        """
-        Process the current observation and update the state.
-        
-        Args:
-            state: The current state
-            
-        Returns:
-            The updated state
-        """
-        # Add the current observation to history
-        if state["observation"]:
-            history_item = {
-                "observation": state["observation"],
-                "location": state["location"],
-                "inventory": state["inventory"],
-                "score": state["score"],
-                "moves": state["moves"]
-            }
-            
-            # Add the previous action if it exists
-            if state["action"]:
-                history_item["action"] = state["action"]
-                
-            # Add to history
-            state["history"] = state["history"] + [history_item]
-        
-        # Clear the previous thought and action
-        state["thought"] = None
-        state["action"] = None
-        
-        return state
-    
-    def think(state: AgentState) -> AgentState:
+    def think(state: AgentState) -> Dict[str, Any]:
         """
         Generate a thought about the current state.
         
@@ -91,44 +370,14 @@ def create_agent_workflow(
             state: The current state
             
         Returns:
-            The updated state with a thought
-        """
-        # Create a prompt for the LLM
-        prompt = f"""
-        You are an expert text adventure game player. You are playing Zork.
-        
-        Current Observation:
-        {state["observation"]}
-        
-        Current Location:
-        {state["location"]}
-        
-        Inventory:
-        {state["inventory"]}
-        
-        Valid Actions:
-        {', '.join(state["valid_actions"][:20])}
-        
-        Score: {state["score"]}
-        Moves: {state["moves"]}
-        
-        Recent History:
-        {state["history"][-3:]}
-        
-        Think about the current situation. What should you do next and why?
-        Consider your goals, the environment, and the available actions.
+            The changed keys, with the thought
         """
-        
         # Generate a thought using the LLM
-        response = llm.invoke(prompt)
-        thought = response.content
-        
-        # Update the state with the thought
-        state["thought"] = thought
+        response = llm.invoke(_create_thought_prompt(state))
         
-        return state
+        return {"thought": response.content}
     
-    def act(state: AgentState) -> AgentState:
+    def act(state: AgentState) -> Dict[str, Any]:
         """
         Generate an action based on the thought.
         
@@ -136,52 +385,10 @@ def create_agent_workflow(
             state: The current state
             
         Returns:
-            The updated state with an action
-        """
-        # Create a prompt for the LLM
-        prompt = f"""
-        You are an expert text adventure game player. You are playing Zork.
-        
-        Current Observation:
-        {state["observation"]}
-        
-        Current Location:
-        {state["location"]}
-        
-        Inventory:
-        {state["inventory"]}
-        
-        Valid Actions:
-        {', '.join(state["valid_actions"][:20])}
-        
-        Your Thought:
-        {state["thought"]}
-        
-        Based on your thought, what is the single next action you will take?
-        Return ONLY the action, with no additional explanation or commentary.
-        The action must be one of the valid actions provided.
+            The changed keys, with the chosen action
         """
-        
-        # Generate an action using the LLM
-        response = llm.invoke(prompt)
-        action = response.content.strip()
-        
-        # Validate the action against valid actions
-        if action not in state["valid_actions"]:
-            # Try to find a similar action
-            for valid_action in state["valid_actions"]:
-                if action.lower() in valid_action.lower():
-                    action = valid_action
-                    break
-            
-            # If still not valid, use a default action
-            if action not in state["valid_actions"]:
-                action = "look"  # Default to looking around
-        
-        # Update the state with the action
-        state["action"] = action
-        
-        return state
+        # Generate an action using the LLM, constrained to the valid actions
+        return {"action": _choose_actions(llm, [state])[0]}
     
     def should_continue(state: AgentState) -> str:
         """
@@ -204,7 +411,7 @@ def create_agent_workflow(
     workflow = StateGraph(AgentState)
     
     # Add the nodes
-    workflow.add_node("observe", observe)
+    workflow.add_node("observe", _observe)
     workflow.add_node("think", think)
     workflow.add_node("act", act)
     
@@ -228,13 +435,40 @@ def create_agent_workflow(
     return workflow
 
 
+@functools.lru_cache(maxsize=8)
+def _get_app(
+    model_name: str,
+    api_key: Optional[str],
+    temperature: float,
+    base_url: Optional[str]
+) -> Any:
+    """
+    Get the compiled workflow for the given LLM settings.
+    
+    The workflow does not depend on the environment, so one compiled app is
+    shared by every episode run with the same settings.
+    
+    Args:
+        model_name: The name of the LLM model to use
+        api_key: The API key for the LLM provider
+        temperature: The sampling temperature
+        base_url: The base URL of an OpenAI-compatible server, or None
+        
+    Returns:
+        The compiled LangGraph workflow
+    """
+    return create_agent_workflow(model_name, api_key, temperature, base_url).compile()
+
+
 def run_agent_workflow(
     environment: Any,
     model_name: str = "gpt-3.5-turbo",
     api_key: Optional[str] = None,
     max_steps: int = 100,
     enable_langsmith: bool = False,
-    langsmith_project: Optional[str] = None
+    langsmith_project: Optional[str] = None,
+    temperature: float = 0.7,
+    llm_cache_path: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Run the agent workflow with the given environment.
@@ -246,12 +480,27 @@ def run_agent_workflow(
         max_steps: The maximum number of steps to run
         enable_langsmith: Whether to enable LangSmith tracing
         langsmith_project: LangSmith project name
+        temperature: The sampling temperature (use 0 for cacheable, deterministic responses)
+        llm_cache_path: Path of a SQLite file used to cache LLM responses
+            across runs (e.g. ".zork_llm_cache.db"), or None to disable
         
     Returns:
         The final state
     """
-    # Create the workflow
-    workflow = create_agent_workflow(model_name, api_key)
+    # Set up the persistent LLM response cache if enabled
+    if llm_cache_path:
+        try:
+            from langchain_core.globals import set_llm_cache
+            from langchain_community.cache import SQLiteCache
+            
+            set_llm_cache(SQLiteCache(database_path=llm_cache_path))
+            logger.info("LLM response cache enabled: %s", llm_cache_path)
+        except ImportError:
+            logger.warning("LLM cache requested but langchain-community package not installed. "
+                           "Install with: pip install langchain-community")
+    
+    # Get the compiled workflow, shared across episodes
+    app = _get_app(model_name, api_key, temperature, os.environ.get("LLM_BASE_URL"))
     
     # Set up LangSmith tracing if enabled
     callbacks = []
@@ -263,8 +512,8 @@ def run_agent_workflow(
             # Get the LangSmith API key from environment variables
             langsmith_api_key = os.environ.get("LANGSMITH_API_KEY")
             if not langsmith_api_key:
-                print("Warning: LANGSMITH_API_KEY not found in environment variables.")
-                print("LangSmith tracing may not work correctly.")
+                logger.warning("LANGSMITH_API_KEY not found in environment variables; "
+                               "LangSmith tracing may not work correctly.")
             
             # Set up the LangSmith client and tracer
             Client(
@@ -276,19 +525,18 @@ def run_agent_workflow(
             # Ensure LANGSMITH_TRACING is set
             os.environ["LANGSMITH_TRACING"] = "true"
             
-            print(f"LangSmith tracing enabled. Project: {langsmith_project or 'default'}")
+            logger.info("LangSmith tracing enabled. Project: %s", langsmith_project or "default")
         except ImportError:
-            print("Warning: LangSmith tracing requested but langsmith package not installed.")
-            print("Install with: pip install langsmith")
+            logger.warning("LangSmith tracing requested but langsmith package not installed. "
+                           "Install with: pip install langsmith")
         except Exception as e:
-            print(f"Warning: Failed to initialize LangSmith tracing: {e}")
-            print("Make sure LANGSMITH_API_KEY is set in your environment.")
+            logger.warning("Failed to initialize LangSmith tracing: %s. "
+                           "Make sure LANGSMITH_API_KEY is set in your environment.", e)
     
-    # Compile the workflow with callbacks
+    # Run the workflow with callbacks
     config = {
         "callbacks": callbacks if callbacks else None
     }
-    app = workflow.compile()
     
     # Initialize the environment
     state = environment.reset()
@@ -309,10 +557,8 @@ def run_agent_workflow(
     
     # Run the workflow
     for step in range(max_steps):
-        # Print the step
-        print(f"\n{'='*60}")
-        print(f"STEP {step + 1}")
-        print(f"{'='*60}")
+        # Log the step
+        logger.info("\n%s\nSTEP %d\n%s", "="*60, step + 1, "="*60)
         
         # Run one step of the workflow with callbacks
         result = app.invoke(agent_state, config=config)
@@ -324,38 +570,101 @@ def run_agent_workflow(
         # Update the agent state
         agent_state = result
         
-        # Print the thought and action
+        # Log the thought and action
         if agent_state["thought"]:
-            print(f"Thought: {agent_state['thought']}")
+            logger.info("Thought: %s", agent_state["thought"])
         
         if agent_state["action"]:
-            print(f"Action: {agent_state['action']}")
+            logger.info("Action: %s", agent_state["action"])
             
             # Execute the action in the environment
             state = environment.step(agent_state["action"])
             
             # Update the agent state with the new observation
-            agent_state["observation"] = state["observation"]
-            agent_state["valid_actions"] = state["valid_actions"]
-            agent_state["inventory"] = state["inventory"]
-            agent_state["location"] = state["location"]
-            agent_state["score"] = state["score"]
-            agent_state["moves"] = state["moves"]
-            agent_state["done"] = state["done"]
+            _update_from_env(agent_state, state)
             
-            # Print the result
-            print(f"Observation: {state['observation']}")
-            print(f"Location: {state['location']}")
-            print(f"Score: {state['score']}")
-            print(f"Moves: {state['moves']}")
-            print(f"Inventory: {state['inventory']}")
-    
-    # Print final stats
-    print(f"\n{'='*60}")
-    print("FINAL STATS")
-    print(f"{'='*60}")
-    print(f"Steps: {agent_state['moves']}")
-    print(f"Score: {agent_state['score']}")
-    print(f"Inventory: {agent_state['inventory']}")
+            # Log the result
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "Observation: %s\nLocation: %s\nScore: %s\nMoves: %s\nInventory: %s",
+                    state["observation"], state["location"], state["score"],
+                    state["moves"], state["inventory"]
+                )
+    
+    # Log final stats
+    logger.info(
+        "\n%s\nFINAL STATS\n%s\nSteps: %s\nScore: %s\nInventory: %s",
+        "="*60, "="*60, agent_state["moves"], agent_state["score"], agent_state["inventory"]
+    )
     
     return agent_state
+
+
+def run_agent_workflows_batched(
+    environments: List[Any],
+    model_name: str = "gpt-3.5-turbo",
+    api_key: Optional[str] = None,
+    max_steps: int = 100,
+    max_concurrency: int = 8,
+    temperature: float = 0.7
+) -> List[Dict[str, Any]]:
+    """
+    Run the agent in several environments in lockstep, batching LLM calls.
+    
+    Each step gathers one prompt per active environment, sends them in a
+    single llm.batch call, then steps every environment with its action.
+    
+    Args:
+        environments: The environments to run the agent in
+        model_name: The name of the LLM model to use
+        api_key: The API key for the LLM provider
+        max_steps: The maximum number of steps to run
+        max_concurrency: Maximum number of concurrent LLM requests per batch
+        temperature: The sampling temperature
+        
+    Returns:
+        The final state of each environment, in the same order
+    """
+    llm = make_llm(model_name, api_key, temperature, base_url=os.environ.get("LLM_BASE_URL"))
+    
+    # Initialize the environments
+    agent_states = []
+    for environment in environments:
+        state = environment.reset()
+        agent_states.append(AgentState(
+            observation=state["observation"],
+            valid_actions=state["valid_actions"],
+            inventory=state["inventory"],
+            location=state["location"],
+            thought=None,
+            action=None,
+            history=[],
+            score=state["score"],
+            moves=state["moves"],
+            done=state["done"]
+        ))
+    
+    for step in range(max_steps):
+        # Only step the environments that are still running
+        active = [i for i, s in enumerate(agent_states) if not s["done"]]
+        if not active:
+            break
+        
+        logger.info("STEP %d: %d active environments", step + 1, len(active))
+        
+        states = []
+        for i in active:
+            agent_state = agent_states[i]
+            update = _observe(agent_state)
+            agent_state["history"] = _add_history(
+                agent_state["history"], update.pop("history", []))
+            agent_state.update(update)
+            states.append(agent_state)
+        think_many(llm, states, max_concurrency=max_concurrency)
+        
+        # Execute the actions in the environments
+        for i, agent_state in zip(active, states):
+            state = environments[i].step(agent_state["action"])
+            _update_from_env(agent_state, state)
+    
+    return agent_states
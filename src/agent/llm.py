@@ -0,0 +1,73 @@
+"""
+Chat model factory shared by the LangGraph workflows.
+"""
+from typing import Optional
+import functools
+import logging
+from langchain_core.language_models import BaseChatModel
+from langchain_openai import ChatOpenAI
+
+logger = logging.getLogger(__name__)
+
+# Per-request timeout in seconds and number of retries for transient LLM errors
+_LLM_TIMEOUT = 30
+_LLM_MAX_RETRIES = 5
+
+
+@functools.lru_cache(maxsize=8)
+def make_llm(
+    model_name: str,
+    api_key: Optional[str],
+    temperature: Optional[float],
+    base_url: Optional[str] = None,
+    max_tokens: Optional[int] = None
+) -> BaseChatModel:
+    """
+    Create the chat model used by a workflow.
+    
+    Requests time out after _LLM_TIMEOUT seconds, and rate limits, timeouts
+    and server errors are retried with exponential backoff and jitter. The
+    model is cached, so episodes with the same settings share one client
+    and its connection pool.
+    
+    With a base URL the model is served by an OpenAI-compatible endpoint such
+    as vLLM (e.g. LLM_BASE_URL=http://localhost:8000/v1). Without one, model
+    names in LiteLLM's "provider/model" form are routed through ChatLiteLLM
+    and everything else goes to OpenAI.
+    
+    Args:
+        model_name: The name of the LLM model to use
+        api_key: The API key for the LLM provider (defaults to the
+            OPENAI_API_KEY environment variable)
+        temperature: The sampling temperature
+        base_url: The base URL of an OpenAI-compatible server
+        max_tokens: The maximum number of tokens in a response, or None for
+            the model's limit
+        
+    Returns:
+        A chat model
+    """
+    if not base_url and "/" in model_name:
+        try:
+            from langchain_litellm import ChatLiteLLM
+            
+            return ChatLiteLLM(
+                model=model_name,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                request_timeout=_LLM_TIMEOUT,
+                max_retries=_LLM_MAX_RETRIES
+            )
+        except ImportError:
+            logger.warning("LiteLLM model requested but langchain-litellm package not installed. "
+                           "Install with: pip install langchain-litellm")
+    
+    return ChatOpenAI(
+        model=model_name,
+        api_key=api_key,
+        temperature=temperature,
+        base_url=base_url,
+        max_tokens=max_tokens,
+        timeout=_LLM_TIMEOUT,
+        max_retries=_LLM_MAX_RETRIES
+    )
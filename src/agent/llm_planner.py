@@ -10,17 +10,89 @@ for the agent. It is responsible for:
 The LLM planner extends the RuleBasedPlanner with more sophisticated
 reasoning and contextual understanding.
 """
-from typing import List, Any, Dict, Optional
+from typing import List, Any, Dict, Optional, Tuple
+from collections import OrderedDict, deque
+import asyncio
+import copy
+import hashlib
 import os
 import json
-import time
-import requests
+import random
+import weakref
+import httpx
 from dotenv import load_dotenv
+from openai import APIStatusError, AsyncOpenAI, RateLimitError
 from .rule_based_planner import RuleBasedPlanner
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Maximum number of LLM requests in flight at once, shared by all planners
+_MAX_CONCURRENT_REQUESTS = int(os.environ.get("LLM_MAX_CONCURRENT_REQUESTS", "8"))
+
+# asyncio semaphores cannot be shared between event loops, so each loop
+# gets its own limiter
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_limiter() -> asyncio.Semaphore:
+    """
+    Get the request limiter for the running event loop.
+    
+    Returns:
+        The semaphore shared by all planners running on this loop
+    """
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = asyncio.Semaphore(_MAX_CONCURRENT_REQUESTS)
+    return limiter
+
+
+# The system prompt is byte-identical for every request so providers can
+# cache it as a prompt prefix
+_SYSTEM_PROMPT = """\
+You are an expert text adventure game player. Your task is to generate the next action
+for an AI agent playing Zork. You will be given:
+
+1. The current observation from the game
+2. A list of valid actions in the current state
+3. The agent's inventory
+4. Recent actions taken by the agent
+5. The agent's current location
+
+Your goal is to generate a single action that will help the agent make progress in the game.
+The action must be one of the valid actions provided. Focus on:
+
+- Exploration: Systematically exploring the game world
+- Object interaction: Taking, examining, and using objects appropriately
+- Puzzle solving: Identifying and solving puzzles
+- Goal tracking: Working toward game objectives
+
+Return ONLY the next action to take, with no additional explanation or commentary."""
+
+# Fields that change least often come first and the observation last, so
+# consecutive prompts share the longest possible prefix
+_PROMPT_TEMPLATE = """\
+Current Location:
+{location}
+
+Inventory:
+{inventory}
+
+Recent Actions:
+{recent_actions}
+
+Valid Actions:
+{valid_actions}
+
+Current Observation:
+{observation}
+
+Generate the next action:"""
+
 
 class LLMBasedPlanner(RuleBasedPlanner):
     """
@@ -30,23 +102,52 @@ class LLMBasedPlanner(RuleBasedPlanner):
     for more sophisticated action generation and planning.
     """
 
-    def __init__(self, model_name: str = "gpt-3.5-turbo", api_key: str = None):
+    def __init__(
+        self,
+        model_name: str = "gpt-3.5-turbo",
+        api_key: str = None,
+        use_cache: bool = True,
+        small_model: Optional[str] = "gpt-4o-mini"
+    ):
         """
         Initialize the LLM action planner.
         
         Args:
             model_name: The name of the LLM model to use
             api_key: The API key for the LLM provider (defaults to environment variable)
+            use_cache: Whether to reuse actions generated for identical game states
+            small_model: A cheaper model used for simple game states (None to
+                always use model_name)
         """
         super().__init__()
         self.model_name = model_name
+        self.small_model = small_model
         # Try to get API key from provided argument, then environment variable
         self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
-        self.context_window = []
         self.max_context_items = 10
+        self.context_window = deque(maxlen=self.max_context_items)
+        # Locations seen in earlier steps, used to route simple states
+        self._seen_locations = set()
+        # Lower-cased lookup for the most recently validated list of actions
+        self._valid_actions: Optional[List[str]] = None
+        self._valid_lookup: Dict[str, str] = {}
         self.system_prompt = self._create_system_prompt()
         self.max_retries = 3
         self.retry_delay = 2  # seconds
+        self.request_timeout = 30  # seconds
+        # Actions generated for previously seen game states, most recent last
+        self.use_cache = use_cache
+        self.max_cache_items = 256
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        # Created on first use, since the client requires an API key
+        self._aclient: Optional[AsyncOpenAI] = None
+        # Event loop used by the synchronous generate_action wrapper, kept so
+        # the async client's connection pool is reused across calls
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Planners holding the history of each batched episode, by its memory
+        self._episodes: "weakref.WeakKeyDictionary[Any, LLMBasedPlanner]" = (
+            weakref.WeakKeyDictionary()
+        )
         
     def _create_system_prompt(self) -> str:
         """
@@ -55,35 +156,79 @@ class LLMBasedPlanner(RuleBasedPlanner):
         Returns:
             The system prompt string
         """
-        return """
-        You are an expert text adventure game player. Your task is to generate the next action
-        for an AI agent playing Zork. You will be given:
+        return _SYSTEM_PROMPT
+    
+    def generate_action(
+        self, 
+        observation: str, 
+        valid_actions: List[str], 
+        memory: Any
+    ) -> str:
+        """
+        Generate the next action using the LLM.
         
-        1. The current observation from the game
-        2. A list of valid actions in the current state
-        3. The agent's inventory
-        4. Recent actions taken by the agent
-        5. The agent's current location
+        This is a synchronous wrapper around agenerate_action. It must not be
+        called from a running event loop; await agenerate_action instead.
         
-        Your goal is to generate a single action that will help the agent make progress in the game.
-        The action must be one of the valid actions provided. Focus on:
+        Args:
+            observation: The current observation from the environment
+            valid_actions: List of valid actions in the current state
+            memory: The agent's memory
+            
+        Returns:
+            The next action to take
+        """
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(
+            self.agenerate_action(observation, valid_actions, memory))
+    
+    def generate_actions_batch(
+        self,
+        states: List[Tuple[str, List[str], Any]]
+    ) -> List[str]:
+        """
+        Generate actions for several states, such as parallel episodes, concurrently.
         
-        - Exploration: Systematically exploring the game world
-        - Object interaction: Taking, examining, and using objects appropriately
-        - Puzzle solving: Identifying and solving puzzles
-        - Goal tracking: Working toward game objectives
+        This is a synchronous wrapper around agenerate_action_batch, so each
+        episode, identified by its memory, keeps its own action history
+        between calls. It must not be called from a running event loop; await
+        agenerate_action_batch instead.
         
-        Return ONLY the next action to take, with no additional explanation or commentary.
+        Args:
+            states: A list of (observation, valid_actions, memory) tuples
+            
+        Returns:
+            The next action for each state, in the same order
         """
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(self.agenerate_action_batch(states))
     
-    def generate_action(
+    def close(self) -> None:
+        """
+        Close the LLM client's connections and the synchronous wrapper's event loop.
+        
+        The planner can still be used afterwards; both are recreated on demand.
+        """
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        if self._aclient is not None:
+            self._loop.run_until_complete(self._aclient.close())
+            self._aclient = None
+        # Batched episodes share the closed client, so start them afresh
+        self._episodes.clear()
+        self._loop.close()
+        self._loop = None
+    
+    async def agenerate_action(
         self, 
         observation: str, 
         valid_actions: List[str], 
         memory: Any
     ) -> str:
         """
-        Generate the next action using the LLM.
+        Generate the next action using the LLM without blocking the event loop.
         
         Args:
             observation: The current observation from the environment
@@ -97,25 +242,216 @@ class LLMBasedPlanner(RuleBasedPlanner):
         if not valid_actions:
             return super().generate_action(observation, valid_actions, memory)
         
+        # Choose the model before the current location is marked as seen
+        model_name = self._route(observation, valid_actions, memory)
+        
         # Update context with current state
         self._update_context(observation, valid_actions, memory)
         
+        # Reuse the action generated for an identical game state if possible
+        key = self._cache_key(observation, valid_actions, memory)
+        if self.use_cache and key in self._cache:
+            self._cache.move_to_end(key)
+            action = self._cache[key]
+            print(f"Using cached action: {action}")
+            self.action_history.append(action)
+            return action
+        
         # Generate action using LLM
-        action = self._generate_llm_action(observation, valid_actions, memory)
+        action = await self._generate_llm_action(observation, valid_actions, memory, model_name)
         
-        # Validate the action
+        # Validate the action, using the matching valid action if there is one
         is_valid, corrected_action = self.validate_action(action, valid_actions)
-        
-        # Use the corrected action if the original was invalid
         if not is_valid:
             print(f"Invalid action '{action}' corrected to '{corrected_action}'")
-            action = corrected_action
+        elif self.use_cache:
+            # Only valid actions are cached
+            self._cache[key] = corrected_action
+            if len(self._cache) > self.max_cache_items:
+                self._cache.popitem(last=False)
+        action = corrected_action
         
         # Add the action to history
         self.action_history.append(action)
         
         return action
     
+    async def agenerate_action_batch(
+        self,
+        states: List[Tuple[str, List[str], Any]]
+    ) -> List[str]:
+        """
+        Generate actions for several states concurrently.
+        
+        Each state belongs to a separate episode, identified by its memory.
+        Every episode keeps its own action history and seen locations across
+        calls, while the LLM client and the action cache are shared. The
+        requests are sent together and limited by the shared request limiter.
+        A state whose generation fails falls back to the rule-based planner
+        without affecting the others.
+        
+        Args:
+            states: A list of (observation, valid_actions, memory) tuples
+            
+        Returns:
+            The next action for each state, in the same order
+        """
+        planners = [self._episode_planner(memory) for _, _, memory in states]
+        results = await asyncio.gather(*[
+            planner.agenerate_action(observation, valid_actions, memory)
+            for planner, (observation, valid_actions, memory) in zip(planners, states)
+        ], return_exceptions=True)
+        
+        actions = []
+        for planner, (observation, valid_actions, memory), result in zip(planners, states, results):
+            if isinstance(result, Exception):
+                print(f"Error generating action: {result}")
+                result = RuleBasedPlanner.generate_action(planner, observation, valid_actions, memory)
+            actions.append(result)
+        return actions
+    
+    def _episode_planner(self, memory: Any) -> "LLMBasedPlanner":
+        """
+        Get the planner holding the state of a batched episode.
+        
+        The episode planner is a copy of this planner with its own action
+        history, context window and seen locations. It shares the LLM client
+        and the action cache. A state without memory cannot be matched to an
+        episode and gets a fresh planner.
+        
+        Args:
+            memory: The memory of the episode
+            
+        Returns:
+            The planner for the episode
+        """
+        planner = self._episodes.get(memory) if memory is not None else None
+        if planner is None:
+            # Create the client first so every episode shares its connections
+            self._get_client()
+            planner = copy.copy(self)
+            planner.action_history = []
+            planner.explored_locations = set()
+            planner.current_goal = None
+            planner.context_window = deque(maxlen=self.max_context_items)
+            planner._seen_locations = set()
+            planner._episodes = weakref.WeakKeyDictionary()
+            if memory is not None:
+                self._episodes[memory] = planner
+        return planner
+    
+    def _get_client(self) -> Optional[AsyncOpenAI]:
+        """
+        Get the async OpenAI client, creating it on first use.
+        
+        Retries are handled by the caller. The client's connections are kept
+        alive and reused by later requests.
+        
+        Returns:
+            The client, or None if no API key is available
+        """
+        if self._aclient is None and self.api_key:
+            self._aclient = AsyncOpenAI(
+                api_key=self.api_key,
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    timeout=self.request_timeout,
+                    limits=httpx.Limits(
+                        max_connections=_MAX_CONCURRENT_REQUESTS,
+                        max_keepalive_connections=_MAX_CONCURRENT_REQUESTS
+                    )
+                )
+            )
+        return self._aclient
+    
+    def validate_action(self, action: str, valid_actions: List[str]) -> Tuple[bool, str]:
+        """
+        Validate an action against the list of valid actions.
+        
+        Exact and case-insensitive matches are found with a dictionary lookup,
+        built once per list of valid actions. Other actions fall back to the
+        rule-based planner's partial matching.
+        
+        Args:
+            action: The action to validate
+            valid_actions: List of valid actions in the current state
+            
+        Returns:
+            A tuple of (is_valid, corrected_action)
+        """
+        if valid_actions is not self._valid_actions:
+            self._valid_actions = valid_actions
+            self._valid_lookup = {}
+            for valid_action in valid_actions:
+                self._valid_lookup.setdefault(valid_action.lower(), valid_action)
+        
+        match = self._valid_lookup.get(action.strip().lower())
+        if match is not None:
+            return True, match
+        return super().validate_action(action, valid_actions)
+    
+    def _cache_key(
+        self,
+        observation: str,
+        valid_actions: List[str],
+        memory: Any
+    ) -> str:
+        """
+        Create the cache key for a game state.
+        
+        The key covers everything the LLM prompt depends on, so a cached
+        action is only reused for a prompt that would be identical.
+        
+        Args:
+            observation: The current observation from the environment
+            valid_actions: List of valid actions in the current state
+            memory: The agent's memory
+            
+        Returns:
+            A SHA-1 hex digest identifying the game state
+        """
+        location = memory.current_location if memory else "unknown"
+        inventory = memory.get_inventory() if memory else []
+        parts = [
+            str(location),
+            observation,
+            "|".join(sorted(valid_actions)),
+            "|".join(map(str, inventory)),
+            "|".join(self.action_history[-5:])
+        ]
+        return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+    
+    def _route(
+        self,
+        observation: str,
+        valid_actions: List[str],
+        memory: Any
+    ) -> str:
+        """
+        Choose the model to generate the action for a game state.
+        
+        States with few valid actions, an empty inventory and a location that
+        has been seen before are sent to the small model; anything else goes
+        to the configured model.
+        
+        Args:
+            observation: The current observation from the environment
+            valid_actions: List of valid actions in the current state
+            memory: The agent's memory
+            
+        Returns:
+            The name of the model to use
+        """
+        if (
+            self.small_model
+            and memory
+            and len(valid_actions) < 6
+            and memory.current_location in self._seen_locations
+            and not memory.get_inventory()
+        ):
+            return self.small_model
+        return self.model_name
+    
     def _update_context(
         self, 
         observation: str, 
@@ -133,24 +469,23 @@ class LLMBasedPlanner(RuleBasedPlanner):
         # Create a context item with the current state
         context_item = {
             "observation": observation,
-            "valid_actions": valid_actions[:20],  # Limit to 20 actions to save context space
+            "valid_actions": valid_actions,
             "inventory": memory.get_inventory() if memory else [],
             "location": memory.current_location if memory else "unknown",
             "recent_actions": self.action_history[-5:] if self.action_history else []
         }
         
-        # Add to context window
+        # Add to context window, which drops the oldest item when full
         self.context_window.append(context_item)
-        
-        # Maintain maximum context window size
-        if len(self.context_window) > self.max_context_items:
-            self.context_window.pop(0)
+        if memory and memory.current_location:
+            self._seen_locations.add(memory.current_location)
     
-    def _generate_llm_action(
+    async def _generate_llm_action(
         self, 
         observation: str, 
         valid_actions: List[str], 
-        memory: Any
+        memory: Any,
+        model_name: Optional[str] = None
     ) -> str:
         """
         Generate an action using the LLM.
@@ -159,6 +494,7 @@ class LLMBasedPlanner(RuleBasedPlanner):
             observation: The current observation from the environment
             valid_actions: List of valid actions in the current state
             memory: The agent's memory
+            model_name: The model to use (defaults to self.model_name)
             
         Returns:
             The generated action
@@ -169,69 +505,167 @@ class LLMBasedPlanner(RuleBasedPlanner):
             print("Falling back to rule-based planner.")
             return super().generate_action(observation, valid_actions, memory)
         
+        # Create the async client on first use; retries are handled below
+        self._get_client()
+        
         # Create the prompt for the LLM
         prompt = self._create_llm_prompt(observation, valid_actions, memory)
         
-        # Prepare the API request
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        data = {
-            "model": self.model_name,
-            "messages": [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 50,
-            "top_p": 1.0,
-            "frequency_penalty": 0.0,
-            "presence_penalty": 0.0
-        }
-        
         # Make the API request with retries
         for attempt in range(self.max_retries):
             try:
-                response = requests.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers=headers,
-                    json=data,
-                    timeout=30
-                )
+                async with _get_limiter():
+                    action = await self._request_action(prompt, valid_actions, model_name)
+                # An empty action would match any valid action, so it is
+                # treated as a failed call
+                if not action:
+                    raise ValueError("No action in LLM response")
+                print(f"LLM generated action: {action}")
+                return action
                 
-                # Check if the request was successful
-                if response.status_code == 200:
-                    result = response.json()
-                    action = result["choices"][0]["message"]["content"].strip()
-                    print(f"LLM generated action: {action}")
-                    return action
-                
-                # Handle rate limiting
-                if response.status_code == 429:
+            except RateLimitError as e:
+                # Handle rate limiting, waiting as long as the server asks if it
+                # says, with jitter so concurrent planners do not retry in lockstep
+                if attempt == self.max_retries - 1:
+                    break
+                retry_after = e.response.headers.get("retry-after")
+                try:
+                    wait_time = float(retry_after)
+                except (TypeError, ValueError):
                     wait_time = self.retry_delay * (2 ** attempt)
-                    print(f"Rate limited. Waiting {wait_time} seconds...")
-                    time.sleep(wait_time)
-                    continue
+                wait_time += random.uniform(0, 0.25)
+                print(f"Rate limited. Waiting {wait_time:.2f} seconds...")
+                await asyncio.sleep(wait_time)
                 
+            except APIStatusError as e:
                 # Handle other errors
-                print(f"API error: {response.status_code} - {response.text}")
+                print(f"API error: {e.status_code} - {e.message}")
                 break
                 
             except Exception as e:
+                # Network errors are retried straight away; backoff is only
+                # for rate limiting
                 print(f"Error calling LLM API: {str(e)}")
-                if attempt < self.max_retries - 1:
-                    wait_time = self.retry_delay * (2 ** attempt)
-                    print(f"Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                else:
+                if attempt == self.max_retries - 1:
                     break
+                print("Retrying...")
         
         # Fall back to rule-based planner if API call fails
         print("LLM API call failed. Falling back to rule-based planner.")
         return super().generate_action(observation, valid_actions, memory)
     
+    async def _request_action(
+        self,
+        prompt: str,
+        valid_actions: List[str],
+        model_name: Optional[str] = None
+    ) -> str:
+        """
+        Request an action from the LLM.
+        
+        Args:
+            prompt: The prompt for the LLM
+            valid_actions: List of valid actions in the current state
+            model_name: The model to use (defaults to self.model_name)
+            
+        Returns:
+            The generated action
+        """
+        stream = await self._aclient.chat.completions.create(
+            model=model_name or self.model_name,
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            tools=[self._create_action_tool(valid_actions)],
+            tool_choice={"type": "function", "function": {"name": "take_action"}},
+            temperature=0.7,
+            max_tokens=24,
+            top_p=1.0,
+            frequency_penalty=0.0,
+            presence_penalty=0.0,
+            timeout=self.request_timeout,
+            stream=True
+        )
+        try:
+            action = await self._read_action(stream)
+        finally:
+            # Release the server-side slot if we stopped reading early
+            await stream.close()
+        return action
+    
+    def _create_action_tool(self, valid_actions: List[str]) -> Dict[str, Any]:
+        """
+        Create the function the LLM is forced to call with its action.
+        
+        The action parameter is an enum of the valid actions, which keeps the
+        response to a few tokens and avoids correcting free-form text.
+        
+        Args:
+            valid_actions: List of valid actions in the current state
+            
+        Returns:
+            The tool definition for the chat completions API
+        """
+        return {
+            "type": "function",
+            "function": {
+                "name": "take_action",
+                "description": "Take the next action in the game",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "action": {"type": "string", "enum": valid_actions[:50]}
+                    },
+                    "required": ["action"]
+                }
+            }
+        }
+    
+    async def _read_action(self, stream: Any) -> str:
+        """
+        Read the action from a streamed LLM response.
+        
+        Reading stops as soon as the function arguments form a complete JSON
+        object, or at the first line break for models that answered without
+        calling the function, so the rest of the response is not waited for.
+        
+        Args:
+            stream: The streamed response from the chat completions API
+            
+        Returns:
+            The action, or the first line of the response text
+        """
+        decoder = json.JSONDecoder()
+        arguments = ""
+        content = ""
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.tool_calls:
+                piece = delta.tool_calls[0].function.arguments or ""
+                arguments += piece
+                # The arguments can only have been completed by a closing brace
+                if "}" not in piece:
+                    continue
+                try:
+                    parsed, _ = decoder.raw_decode(arguments.lstrip())
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(parsed, dict) and "action" in parsed:
+                    return str(parsed["action"]).strip()
+                break
+            elif delta.content:
+                content += delta.content
+                text = content.lstrip()
+                if "\n" in text:
+                    return text.split("\n", 1)[0].strip()
+        
+        if arguments:
+            print(f"Could not parse action from: {arguments}")
+        return content.strip()
+    
     def _create_llm_prompt(
         self, 
         observation: str, 
@@ -249,27 +683,11 @@ class LLMBasedPlanner(RuleBasedPlanner):
         Returns:
             The prompt string
         """
-        inventory_str = str(memory.get_inventory()) if memory else "[]"
-        location_str = memory.current_location if memory else "unknown"
-        recent_actions_str = str(self.action_history[-5:]) if self.action_history else "[]"
-        
-        prompt = f"""
-        Current Observation:
-        {observation}
-        
-        Valid Actions:
-        {', '.join(valid_actions[:20])}
-        
-        Inventory:
-        {inventory_str}
-        
-        Current Location:
-        {location_str}
-        
-        Recent Actions:
-        {recent_actions_str}
-        
-        Generate the next action:
-        """
-        
-        return prompt
+        inventory = memory.get_inventory() if memory else []
+        return _PROMPT_TEMPLATE.format_map({
+            "location": memory.current_location if memory else "unknown",
+            "inventory": ", ".join(map(str, inventory)) or "nothing",
+            "recent_actions": ", ".join(self.action_history[-5:]) or "none",
+            "valid_actions": ", ".join(valid_actions[:20]),
+            "observation": observation
+        })
@@ -0,0 +1,47 @@
+"""
+Definitions shared by the MCP agents.
+
+These describe the default Zork tools that the agents fall back to when the
+MCP server does not report any tools.
+"""
+
+# Required arguments of each default tool
+DEFAULT_REQUIRED_ARGS = {
+    "navigate": ("direction",),
+    "examine": ("object",),
+    "take": ("object",),
+    "drop": ("object",),
+    "inventory": (),
+    "read": ("object",),
+    "look": (),
+    "open": ("object",),
+    "close": ("object",),
+    "put": ("object", "container"),
+}
+
+DEFAULT_TOOL_DESCRIPTIONS = """\
+- navigate: Move in a specified direction (north, south, east, west, up, down)
+- examine: Examine an object in the environment
+- take: Take an object
+- drop: Drop an object from your inventory
+- inventory: Check your inventory
+- read: Read an object with text
+- look: Look around to get a description of your surroundings
+- open: Open a container or door
+- close: Close a container or door
+- put: Put an object into a container
+"""
+
+# Compact JSON, like the examples built for discovered tools, to save prompt tokens
+DEFAULT_TOOL_EXAMPLES = """\
+Example for navigate: {"tool":"navigate","args":{"direction":"north"}}
+Example for examine: {"tool":"examine","args":{"object":"mailbox"}}
+Example for take: {"tool":"take","args":{"object":"leaflet"}}
+Example for drop: {"tool":"drop","args":{"object":"sword"}}
+Example for inventory: {"tool":"inventory","args":{}}
+Example for read: {"tool":"read","args":{"object":"leaflet"}}
+Example for look: {"tool":"look","args":{}}
+Example for open: {"tool":"open","args":{"object":"mailbox"}}
+Example for close: {"tool":"close","args":{"object":"mailbox"}}
+Example for put: {"tool":"put","args":{"object":"leaflet","container":"mailbox"}}
+"""
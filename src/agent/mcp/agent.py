@@ -2,27 +2,141 @@
 MCP Zork Agent.
 
 This module implements a direct MCP agent that uses MCP tools directly to play Zork.
-The agent follows a deliberative process: first thinking about what to do,
-then selecting a tool and parameters based on that thought.
+The agent follows a deliberative process: it thinks about what to do and
+selects a tool and parameters based on that thought in a single LLM call.
 """
 import os
+import re
 import time
 import json
-from typing import Any, Dict, Tuple
+import hashlib
+import logging
+import shelve
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, MutableMapping, Optional, Tuple
+import httpx
 from dotenv import load_dotenv
 from openai import OpenAI
 
-from src.mcp.client import use_mcp_tool, get_mcp_tools
+from src.mcp.client import use_mcp_tool, use_mcp_tools, get_mcp_tools
+from src.agent.mcp._common import DEFAULT_REQUIRED_ARGS, DEFAULT_TOOL_DESCRIPTIONS
+
+# Use orjson for faster JSON parsing if available; its decode error
+# subclasses json.JSONDecodeError
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # MCP server name for Zork tools
 MCP_SERVER_NAME = "zork-tools"
 
+# Deterministic, bounded decoding for the decision call: room for a one
+# sentence thought plus the tool arguments, a fixed seed for
+# reproducible runs, and a timeout so a stalled request does not hang the
+# episode
+_TEMPERATURE = 0.0
+_SEED = 0
+_MAX_TOKENS = 96
+_REQUEST_TIMEOUT = 15  # seconds
+
+# When the greedy decision is invalid and the thought does not state a
+# command, a few candidates are sampled at a higher temperature, since
+# greedy decoding would only repeat the same mistake; the first valid one
+# is used instead of falling back to "look"
+_RETRY_TEMPERATURE = 0.7
+_RETRY_CANDIDATES = 2
+
+# How long decisions in the on-disk cache are replayed for
+_DISK_CACHE_TTL = 24 * 60 * 60  # seconds
+
+# Maximum number of decisions kept in memory for revisited game states
+_DECISION_CACHE_SIZE = 512
+
+# Commands stated in text, such as "go north" or "put the leaflet in the mailbox"
+_IMPERATIVE_RE = re.compile(
+    r"\b(go|take|drop|examine|read|open|close|put)\s+(?:(?:the|a|an)\s+)?([a-z]+)"
+    r"(?:\s+in(?:to)?\s+(?:(?:the|a|an)\s+)?([a-z]+))?",
+    re.IGNORECASE
+)
+
+# Directions accepted by the navigate tool
+_DIRECTIONS = frozenset({"north", "south", "east", "west", "northeast", "northwest",
+                         "southeast", "southwest", "up", "down", "in", "out"})
+
+# Game state fields that tool results update
+_RESULT_KEYS = ("observation", "score", "inventory", "location")
+
+# Observations that end the game
+_GAME_OVER_RE = re.compile(r"you have died|game over", re.IGNORECASE)
+
+# Pause between steps in debug mode, short enough not to dominate a step
+_DEBUG_STEP_DELAY = 0.2  # seconds
+
+# Idle connections kept open so that later requests skip the TCP/TLS handshake
+_MAX_KEEPALIVE_CONNECTIONS = 20
+
+# OpenAI clients shared between runs, keyed by API key and base URL
+_clients: Dict[Tuple[Optional[str], Optional[str]], OpenAI] = {}
+
+
+def _get_client(api_key: Optional[str]) -> OpenAI:
+    """
+    Get a shared OpenAI client, creating it on first use.
+    
+    Reusing one client per API key and endpoint keeps its connection pool
+    warm across runs instead of reconnecting for each new agent.
+    
+    Args:
+        api_key: The API key for the LLM provider
+        
+    Returns:
+        The shared OpenAI client
+    """
+    # LLM_BASE_URL points the agent at an OpenAI-compatible server such as vLLM
+    base_url = os.environ.get("LLM_BASE_URL")
+    client = _clients.get((api_key, base_url))
+    if client is None:
+        client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=httpx.Client(
+                timeout=_REQUEST_TIMEOUT,
+                limits=httpx.Limits(max_keepalive_connections=_MAX_KEEPALIVE_CONNECTIONS)
+            )
+        )
+        _clients[(api_key, base_url)] = client
+    return client
+
+
+def _state_key(game_state: Dict[str, Any]) -> Tuple[Any, ...]:
+    """
+    Create a hashable key identifying a game state for the decision cache.
+    
+    The score and move count are left out so that revisiting a room with
+    the same observation and inventory reuses the earlier decision.
+    
+    Args:
+        game_state: The current game state
+        
+    Returns:
+        A tuple of (location, observation_digest, inventory)
+    """
+    inventory = game_state["inventory"]
+    if isinstance(inventory, list):
+        inventory = tuple(sorted(map(str, inventory)))
+    observation_digest = hashlib.blake2b(game_state["observation"].encode()).digest()
+    return (game_state["location"], observation_digest, inventory)
+
 
 def run_agent(model_name: str = "gpt-3.5-turbo", api_key: str = None,
-              max_steps: int = 20, debug: bool = False):
+              max_steps: int = 20, debug: bool = False,
+              cache_path: Optional[str] = None):
     """
     Run the agent.
     
@@ -30,21 +144,27 @@ def run_agent(model_name: str = "gpt-3.5-turbo", api_key: str = None,
         model_name: The name of the LLM model to use
         api_key: The API key for the LLM provider
         max_steps: Maximum number of steps to run
-        debug: Whether to print debug information
+        debug: Whether to pause between steps to make the output easier to
+            follow; the game state before each step is logged at DEBUG level
+        cache_path: Optional file to cache decisions in, so that replays of
+            the same game states do not call the LLM again
     """
     # Initialize the LLM
     if api_key is None:
         api_key = os.environ.get("OPENAI_API_KEY")
+    client = _get_client(api_key)
     
-    client = OpenAI(api_key=api_key)
-    
-    print("\n" + "="*60)
-    print("MCP ZORK AGENT")
-    print("="*60)
-    print(f"This agent uses {model_name} to play Zork.")
-    print("It follows a deliberative process: first thinking, then selecting a tool.")
-    print("Press Ctrl+C to stop the agent.")
+    logger.info(
+        "\n%s\nMCP ZORK AGENT\n%s\nThis agent uses %s to play Zork.\n"
+        "It follows a deliberative process: thinking, then selecting a tool.\n"
+        "Press Ctrl+C to stop the agent.",
+        "="*60, "="*60, model_name
+    )
     
+    cache = shelve.open(cache_path) if cache_path else None
+    # Decisions for game states seen earlier in this run, most recent last
+    decision_cache: "OrderedDict[Tuple[Any, ...], Tuple[str, str, Dict[str, Any]]]" = OrderedDict()
+    use_decision_cache = _TEMPERATURE == 0.0
     try:
         # Initialize the game state
         game_state = {
@@ -56,314 +176,631 @@ def run_agent(model_name: str = "gpt-3.5-turbo", api_key: str = None,
             "done": False
         }
         
-        # Reset the game by calling the look tool
-        result = use_mcp_tool(MCP_SERVER_NAME, "look", {})
+        # Reset the game by calling the look tool, and get the initial
+        # inventory in the same round trip
+        result, inv_result = use_mcp_tools(
+            MCP_SERVER_NAME, [("look", {}), ("inventory", {})])
         game_state["observation"] = result["observation"]
         game_state["location"] = result.get("location", "")
-        
-        # Get initial inventory
-        inv_result = use_mcp_tool(MCP_SERVER_NAME, "inventory", {})
         game_state["inventory"] = inv_result.get("inventory", [])
         
         # Main loop
         for step in range(max_steps):
-            # Print the current state
-            print("\n" + "="*60)
-            print(f"STEP {step+1}")
-            print("="*60)
-            print(f"Location: {game_state['location']}")
-            print(f"Observation: {game_state['observation']}")
-            print(f"Inventory: {game_state['inventory']}")
-            print(f"Score: {game_state['score']}")
-            print(f"Moves: {game_state['moves']}")
-            
-            # Generate a thought using the LLM
-            thought = generate_thought(client, model_name, game_state)
-            print(f"\nThought: {thought}")
+            # Log the current state
+            logger.debug(
+                "\n%s\nSTEP %s\n%s\nLocation: %s\nObservation: %s\nInventory: %s\n"
+                "Score: %s\nMoves: %s",
+                "="*60, step + 1, "="*60, game_state["location"], game_state["observation"],
+                game_state["inventory"], game_state["score"], game_state["moves"]
+            )
             
-            # Select a tool and parameters using the LLM
-            tool_name, tool_args = select_tool(client, model_name, game_state, thought)
-            print(f"\nTool: {tool_name}")
-            print(f"Args: {tool_args}")
+            # Generate a thought and select a tool and parameters using the LLM,
+            # reusing the decision for a revisited game state if possible
+            key = _state_key(game_state)
+            if use_decision_cache and key in decision_cache:
+                decision_cache.move_to_end(key)
+                thought, tool_name, tool_args = decision_cache[key]
+                logger.debug("Using cached thought and tool selection")
+            else:
+                thought, tool_name, tool_args = decide(client, model_name, game_state, cache)
+                if use_decision_cache:
+                    decision_cache[key] = (thought, tool_name, tool_args)
+                    if len(decision_cache) > _DECISION_CACHE_SIZE:
+                        decision_cache.popitem(last=False)
+            logger.info("\nThought: %s\n\nTool: %s\nArgs: %s", thought, tool_name, tool_args)
             
             # Execute the tool
             try:
                 result = use_mcp_tool(MCP_SERVER_NAME, tool_name, tool_args)
                 
-                # Update the game state
-                game_state["observation"] = result["observation"]
-                game_state["score"] = result.get("score", game_state["score"])
+                # Update the game state with the fields the tool returned
+                game_state["previous_location"] = game_state["location"]
+                game_state.update({key: result[key] for key in _RESULT_KEYS if key in result})
                 game_state["moves"] += 1
-                game_state["inventory"] = result.get("inventory", game_state["inventory"])
-                game_state["location"] = result.get("location", game_state["location"])
                 
                 # Check for game completion
-                if "you have died" in game_state["observation"].lower() or "game over" in game_state["observation"].lower():
+                if _GAME_OVER_RE.search(game_state["observation"]):
                     game_state["done"] = True
             except Exception as e:
-                print(f"Error executing tool {tool_name}: {e}")
+                logger.warning("Error executing tool %s: %s", tool_name, e)
                 game_state["observation"] = f"Error executing tool {tool_name}: {e}"
             
             # Check if the game is done
             if game_state["done"]:
                 break
             
-            # Add a small delay to make the output more readable
-            time.sleep(1)
+            # Add a small delay to make debug output easier to follow
+            if debug:
+                time.sleep(_DEBUG_STEP_DELAY)
         
-        # Print final stats
-        print("\n" + "="*60)
-        print("FINAL STATS")
-        print("="*60)
-        print(f"Steps: {game_state['moves']}")
-        print(f"Score: {game_state['score']}")
-        print(f"Inventory: {game_state['inventory']}")
+        # Log final stats
+        logger.info(
+            "\n%s\nFINAL STATS\n%s\nSteps: %s\nScore: %s\nInventory: %s",
+            "="*60, "="*60, game_state["moves"], game_state["score"], game_state["inventory"]
+        )
     
     except KeyboardInterrupt:
-        print("\nAgent stopped by user.")
+        logger.info("\nAgent stopped by user.")
     
     except Exception as e:
-        print(f"\nError running agent: {e}")
+        logger.error("\nError running agent: %s", e)
+    
+    finally:
+        if cache is not None:
+            cache.close()
 
 
-def generate_thought(client: OpenAI, model_name: str, game_state: Dict[str, Any]) -> str:
+def _build_tool_catalog(tools: List[Dict[str, Any]]) -> Tuple[str, List[str]]:
     """
-    Generate a thought about what to do next.
+    Build the tool descriptions shown to the LLM.
+    
+    The arguments of each tool are given by its function definition, so the
+    prompt does not repeat them as examples.
     
     Args:
-        client: The OpenAI client
-        model_name: The name of the LLM model to use
-        game_state: The current game state
+        tools: The tool definitions reported by the MCP server
         
     Returns:
-        A thought about what to do next
+        A tuple of (tool_descriptions, valid_tool_names)
     """
-    prompt = f"""
-    You are an expert text adventure game player. You are playing Zork.
-    
-    Current Observation:
-    {game_state["observation"]}
+    # If no tools were found, use default tools
+    if not tools:
+        return DEFAULT_TOOL_DESCRIPTIONS, list(DEFAULT_REQUIRED_ARGS)
     
-    Current Location:
-    {game_state["location"]}
+    description_parts = []
+    valid_tool_names = []
     
-    Inventory:
-    {game_state["inventory"]}
+    for tool in tools:
+        # Add the tool description
+        tool_name = tool.get("name", "")
+        if not tool_name:
+            continue
+            
+        valid_tool_names.append(tool_name)
+        description = tool.get("description", "")
+        description_parts.append(f"- {tool_name}: {description}\n")
     
-    Score: {game_state["score"]}
-    Moves: {game_state["moves"]}
+    return "".join(description_parts), valid_tool_names
+
+
+_SYSTEM_MESSAGE = {"role": "system", "content": "You are an expert text adventure game player."}
+
+_DECISION_PROMPT_TEMPLATE = """\
+You are an expert text adventure game player. You are playing Zork.
+
+{game_state}
+
+Available Tools:
+{tool_descriptions}
+Call the most appropriate tool. In its "thought" argument, state what to
+do next and why in one short sentence, then provide the tool's other
+arguments."""
+
+_GAME_STATE_TEMPLATE = """\
+Current Observation:
+{observation}
+
+Current Location:
+{location}
+
+Inventory:
+{inventory}
+
+Score: {score}
+Moves: {moves}"""
+
+# Tool catalogs discovered from each MCP server, which do not change during a run
+_tool_catalogs: Dict[str, Dict[str, Any]] = {}
+
+
+def _get_tool_catalog(server_name: str) -> Dict[str, Any]:
+    """
+    Get the tool catalog for an MCP server, discovering it on first use.
     
-    Think step by step about what to do next. Consider:
-    1. What is happening in the game?
-    2. What are your goals?
-    3. What actions can you take?
-    4. What would be the best action to take?
+    Only successful discoveries are cached, so a server that reported no
+    tools is asked again on the next step.
     
-    Your thought process:
+    Args:
+        server_name: The name of the MCP server
+        
+    Returns:
+        A dictionary with the server's tools, their descriptions for the
+        prompt, the valid tool names as a list and a set, each
+        tool's definition by name, and the function definitions for the LLM
     """
+    catalog = _tool_catalogs.get(server_name)
+    if catalog is not None:
+        return catalog
+    
+    tools = get_mcp_tools(server_name)
+    tool_descriptions, valid_tool_names = _build_tool_catalog(tools)
+    definitions = tools or _default_tools()
+    catalog = {
+        "tools": tools,
+        "descriptions": tool_descriptions,
+        "tool_names": valid_tool_names,
+        "valid_tool_names": frozenset(valid_tool_names),
+        "definitions": {tool.get("name"): tool for tool in definitions},
+        "tool_specs": _create_tool_specs(definitions)
+    }
+    if tools:
+        _tool_catalogs[server_name] = catalog
+    return catalog
+
+
+def _default_tools() -> List[Dict[str, Any]]:
+    """
+    Create MCP-style definitions of the default tools.
     
-    response = client.chat.completions.create(
-        model=model_name,
-        messages=[
-            {"role": "system", "content": "You are an expert text adventure game player."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    
-    return response.choices[0].message.content
+    Returns:
+        A list of tool definitions with names, descriptions and input schemas
+    """
+    tools = []
+    for line in DEFAULT_TOOL_DESCRIPTIONS.splitlines():
+        name, description = line[2:].split(": ", 1)
+        required = list(DEFAULT_REQUIRED_ARGS.get(name, ()))
+        tools.append({
+            "name": name,
+            "description": description,
+            "inputSchema": {
+                "type": "object",
+                "properties": {arg: {"type": "string"} for arg in required},
+                "required": required
+            }
+        })
+    return tools
 
 
-def select_tool(client: OpenAI, model_name: str, game_state: Dict[str, Any],
-                thought: str) -> Tuple[str, Dict[str, Any]]:
+def _create_tool_specs(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
-    Select a tool and parameters based on the thought.
+    Create a function definition for each MCP tool for the LLM to call.
+    
+    Each function takes the tool's own input schema plus a leading "thought"
+    argument, so the LLM reasons about the step before filling in the
+    arguments, all in the same call.
     
     Args:
-        client: The OpenAI client
-        model_name: The name of the LLM model to use
-        game_state: The current game state
-        thought: The thought about what to do next
+        tools: The MCP tool definitions
         
     Returns:
-        A tuple of (tool_name, tool_args)
+        The tool definitions for the chat completions API
     """
-    # Get the available tools from the MCP server
-    tools = get_mcp_tools(MCP_SERVER_NAME)
-    
-    # Build the tool descriptions
-    tool_descriptions = ""
-    tool_examples = ""
-    valid_tool_names = []
-    
+    specs = []
     for tool in tools:
-        # Add the tool description
         tool_name = tool.get("name", "")
         if not tool_name:
             continue
-            
-        valid_tool_names.append(tool_name)
-        description = tool.get("description", "")
-        tool_descriptions += f"- {tool_name}: {description}\n"
-        
-        # Get examples from the tool definition if available
-        examples = tool.get("examples", [])
-        if examples:
-            for example in examples:
-                # Add the example to the prompt
-                example_json = {
-                    "tool": tool_name,
-                    "args": example.get("args", {})
+        input_schema = tool.get("inputSchema") or {}
+        properties = {
+            "thought": {
+                "type": "string",
+                "description": "What to do next and why, in one short sentence"
+            }
+        }
+        properties.update(input_schema.get("properties", {}))
+        specs.append({
+            "type": "function",
+            "function": {
+                "name": tool_name,
+                "description": tool.get("description", ""),
+                "parameters": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": ["thought", *input_schema.get("required", [])]
                 }
-                example_name = example.get("name", f"Example for {tool_name}")
-                tool_examples += f"{example_name}: {json.dumps(example_json)}\n"
-        else:
-            # If no examples are provided, generate one based on the schema
-            input_schema = tool.get("inputSchema", {})
-            properties = input_schema.get("properties", {})
-            required = input_schema.get("required", [])
-            
-            # Build the example arguments
-            example_args = {}
-            for param_name, param_schema in properties.items():
-                if param_name in required:
-                    # Use an example value based on the parameter name
-                    if param_name == "direction":
-                        example_args[param_name] = "north"
-                    elif param_name == "object":
-                        example_args[param_name] = "mailbox"
-                    elif param_name == "container":
-                        example_args[param_name] = "mailbox"
-                    else:
-                        example_args[param_name] = "example"
-            
-            # Add the example to the prompt
-            example = {
-                "tool": tool_name,
-                "args": example_args
             }
-            tool_examples += f"Example for {tool_name}: {json.dumps(example)}\n"
+        })
+    return specs
+
+
+def _decode_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Find the first JSON object in a response.
     
-    # If no tools were found, use default tools
-    if not tools:
-        tool_descriptions = """
-        - navigate: Move in a specified direction (north, south, east, west, up, down)
-        - examine: Examine an object in the environment
-        - take: Take an object
-        - drop: Drop an object from your inventory
-        - inventory: Check your inventory
-        - read: Read an object with text
-        - look: Look around to get a description of your surroundings
-        - open: Open a container or door
-        - close: Close a container or door
-        - put: Put an object into a container
-        """
-        
-        tool_examples = """
-        Example for navigate: {"tool": "navigate", "args": {"direction": "north"}}
-        Example for examine: {"tool": "examine", "args": {"object": "mailbox"}}
-        Example for take: {"tool": "take", "args": {"object": "leaflet"}}
-        Example for drop: {"tool": "drop", "args": {"object": "sword"}}
-        Example for inventory: {"tool": "inventory", "args": {}}
-        Example for read: {"tool": "read", "args": {"object": "leaflet"}}
-        Example for look: {"tool": "look", "args": {}}
-        Example for open: {"tool": "open", "args": {"object": "mailbox"}}
-        Example for close: {"tool": "close", "args": {"object": "mailbox"}}
-        Example for put: {"tool": "put", "args": {"object": "leaflet", "container": "mailbox"}}
-        """
-        
-        valid_tool_names = ["navigate", "examine", "take", "drop", "inventory", "read", "look", "open", "close", "put"]
+    The object may be surrounded by code fences or other text, and any text
+    after it is ignored.
     
-    prompt = f"""
-    You are an expert text adventure game player. You are playing Zork.
+    Args:
+        text: The response text
+        
+    Returns:
+        The decoded object, or None if the text does not contain one
+    """
+    decoder = json.JSONDecoder()
+    start = text.find("{")
+    while start != -1:
+        try:
+            parsed, _ = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            parsed = None
+        if isinstance(parsed, dict):
+            return parsed
+        start = text.find("{", start + 1)
+    return None
+
+
+def _read_decision(stream: Any,
+                   is_valid: Optional[Callable[[Dict[str, Any]], bool]] = None
+                   ) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Read the decision from a streamed LLM response.
     
-    Current Observation:
-    {game_state["observation"]}
+    The response may hold several candidate choices. Reading stops as soon
+    as one of them contains a complete, valid JSON object, so trailing
+    tokens and the remaining candidates are not waited for.
     
-    Current Location:
-    {game_state["location"]}
+    Args:
+        stream: The streamed response from the chat completions API
+        is_valid: Optional check a decision must pass to be returned early
+        
+    Returns:
+        A tuple of (response_text, decision), where the decision has
+        "thought", "tool" and "args" fields, or is None if no JSON object
+        could be found in the response. If no candidate passes the check,
+        the first candidate is returned.
+    """
+    decoder = json.JSONDecoder()
+    tool_names: Dict[int, str] = {}
+    parts: Dict[int, List[str]] = {}
+    decisions: Dict[int, Dict[str, Any]] = {}
+    for chunk in stream:
+        for choice in chunk.choices:
+            index = choice.index
+            if index in decisions:
+                continue
+            delta = choice.delta
+            if delta.tool_calls:
+                function = delta.tool_calls[0].function
+                # The name of the called tool arrives with its first chunk
+                if function.name:
+                    tool_names[index] = function.name
+                piece = function.arguments or ""
+            else:
+                piece = delta.content or ""
+            parts.setdefault(index, []).append(piece)
+            # An object can only have been completed by a closing brace
+            if "}" not in piece:
+                continue
+            # Only the outermost object can be complete while streaming;
+            # nested objects would decode too early
+            content = "".join(parts[index])
+            start = content.find("{")
+            if start == -1:
+                continue
+            try:
+                parsed = json_loads(content[start:])
+            except json.JSONDecodeError:
+                # Text may follow the object in a plain text response
+                try:
+                    parsed, _ = decoder.raw_decode(content, start)
+                except json.JSONDecodeError:
+                    continue
+            if isinstance(parsed, dict):
+                decision = _to_decision(tool_names.get(index), parsed)
+                if is_valid is None or is_valid(decision):
+                    return content, decision
+                decisions[index] = decision
+    
+    # The stream ended, so decode what the unfinished candidates produced
+    for index in sorted(parts):
+        if index not in decisions:
+            decision = _to_decision(tool_names.get(index),
+                                    _decode_object("".join(parts[index])))
+            if decision is not None and (is_valid is None or is_valid(decision)):
+                return "".join(parts[index]), decision
+            decisions[index] = decision
+    if not parts:
+        return "", None
+    first = min(parts)
+    return "".join(parts[first]), decisions[first]
+
+
+def _to_decision(tool_name: Optional[str],
+                 parsed: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Convert a parsed response to a decision.
     
-    Inventory:
-    {game_state["inventory"]}
+    Args:
+        tool_name: The name of the tool the LLM called, or None if it
+            answered in text
+        parsed: The function arguments, or the decision object from a text
+            response
+        
+    Returns:
+        The decision with "thought", "tool" and "args" fields, or None
+    """
+    if parsed is None or tool_name is None:
+        return parsed
+    args = dict(parsed)
+    thought = args.pop("thought", "")
+    return {"thought": thought, "tool": tool_name, "args": args}
+
+
+def _format_game_state(game_state: Dict[str, Any]) -> str:
+    """
+    Format the game state compactly for the LLM prompt.
     
-    Your Thought:
-    {thought}
+    The inventory is comma-separated rather than a Python list, and when the
+    agent has not changed location only the last paragraph of the
+    observation is kept, since the rest repeats the room description.
     
-    Available Tools:
-    {tool_descriptions}
+    Args:
+        game_state: The current game state
+        
+    Returns:
+        The formatted game state
+    """
+    observation = game_state["observation"]
+    if game_state.get("previous_location") == game_state["location"]:
+        observation = observation.rsplit("\n\n", 1)[-1]
+    
+    inventory = game_state["inventory"]
+    if isinstance(inventory, (list, tuple)):
+        inventory = ", ".join(map(str, inventory))
+    
+    return _GAME_STATE_TEMPLATE.format_map({
+        "observation": observation,
+        "location": game_state["location"],
+        "inventory": inventory or "empty",
+        "score": game_state["score"],
+        "moves": game_state["moves"]
+    })
+
+
+def _decision_cache_key(model_name: str, game_state: Dict[str, Any],
+                        tools: List[Dict[str, Any]]) -> str:
+    """
+    Create the disk cache key for a decision.
     
-    Select the most appropriate tool and provide its parameters in JSON format.
+    Args:
+        model_name: The name of the LLM model to use
+        game_state: The current game state
+        tools: The tool definitions reported by the MCP server
+        
+    Returns:
+        A SHA-1 hex digest of everything the decision prompt depends on
+    """
+    data = json.dumps(
+        {"model": model_name, "state": game_state, "tools": tools},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def decide(client: OpenAI, model_name: str, game_state: Dict[str, Any],
+           cache: Optional[MutableMapping[str, Any]] = None) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Think about what to do next and select a tool in a single LLM call.
     
-    {tool_examples}
+    Args:
+        client: The OpenAI client
+        model_name: The name of the LLM model to use
+        game_state: The current game state
+        cache: An optional persistent mapping, such as a shelve, of earlier
+            decisions; used only while decoding is deterministic
+        
+    Returns:
+        A tuple of (thought, tool_name, tool_args)
+    """
+    # Get the available tools from the MCP server
+    catalog = _get_tool_catalog(MCP_SERVER_NAME)
+    
+    # Replay a decision made for the same state within the cache TTL
+    key = None
+    if cache is not None and _TEMPERATURE == 0.0:
+        key = _decision_cache_key(model_name, game_state, catalog["tools"])
+        entry = cache.get(key)
+        if entry is not None and time.time() - entry["time"] < _DISK_CACHE_TTL:
+            return entry["decision"]
+    
+    decision = _request_decision(client, model_name, game_state, catalog)
+    if key is not None:
+        cache[key] = {"time": time.time(), "decision": decision}
+    return decision
+
+
+def _request_decision(client: OpenAI, model_name: str, game_state: Dict[str, Any],
+                      catalog: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Request a decision from the LLM.
     
-    Your response must be valid JSON with a "tool" field and an "args" object containing the required parameters.
+    Args:
+        client: The OpenAI client
+        model_name: The name of the LLM model to use
+        game_state: The current game state
+        catalog: The tool catalog of the MCP server
+        
+    Returns:
+        A tuple of (thought, tool_name, tool_args)
+    """
     
-    Your tool selection (JSON format):
+    prompt = _DECISION_PROMPT_TEMPLATE.format_map({
+        "game_state": _format_game_state(game_state),
+        "tool_descriptions": catalog["descriptions"]
+    })
+    messages = [_SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
+    
+    decision, error = _interpret_decision(
+        *_stream_decision(client, model_name, messages, catalog), catalog)
+    if error is None:
+        return decision
+    
+    # Sample alternatives rather than repeating the greedy mistake
+    retry, retry_error = _interpret_decision(
+        *_stream_decision(client, model_name, messages, catalog,
+                          temperature=_RETRY_TEMPERATURE, n=_RETRY_CANDIDATES),
+        catalog)
+    if retry_error is None:
+        return retry
+    
+    logger.warning("%s, defaulting to look", error)
+    return decision[0], "look", {}
+
+
+def _stream_decision(client: OpenAI, model_name: str, messages: List[Dict[str, Any]],
+                     catalog: Dict[str, Any], temperature: float = _TEMPERATURE,
+                     n: int = 1) -> Tuple[str, Optional[Dict[str, Any]]]:
     """
+    Stream a decision from the LLM, stopping at the first valid candidate.
     
-    response = client.chat.completions.create(
+    Args:
+        client: The OpenAI client
+        model_name: The name of the LLM model to use
+        messages: The chat messages
+        catalog: The tool catalog of the MCP server
+        temperature: The sampling temperature
+        n: The number of candidate decisions to sample
+        
+    Returns:
+        A tuple of (response_text, decision), as returned by _read_decision
+    """
+    stream = client.chat.completions.create(
         model=model_name,
-        messages=[
-            {"role": "system", "content": "You are an expert text adventure game player."},
-            {"role": "user", "content": prompt}
-        ]
+        messages=messages,
+        tools=catalog["tool_specs"],
+        tool_choice="required",
+        parallel_tool_calls=False,
+        temperature=temperature,
+        top_p=1.0,
+        max_tokens=_MAX_TOKENS,
+        seed=_SEED,
+        n=n,
+        timeout=_REQUEST_TIMEOUT,
+        stream=True
     )
+    try:
+        return _read_decision(
+            stream, lambda decision: _check_decision(decision, catalog)[1] is None)
+    finally:
+        # Release the server-side slot if we stopped reading early
+        stream.close()
+
+
+def _interpret_decision(content: str, parsed: Optional[Dict[str, Any]],
+                        catalog: Dict[str, Any]
+                        ) -> Tuple[Tuple[str, str, Dict[str, Any]], Optional[str]]:
+    """
+    Turn a streamed response into a tool call, recovering commands from text.
     
-    # Parse the tool selection
-    content = response.choices[0].message.content.strip()
+    Args:
+        content: The response text
+        parsed: The decision read from the response, or None
+        catalog: The tool catalog of the MCP server
+        
+    Returns:
+        A tuple of ((thought, tool_name, tool_args), error), where the error
+        is None if the tool call is valid
+    """
+    if parsed is None:
+        # The model may still have stated what it wants to do in prose
+        directive = _extract_directive(content, catalog)
+        if directive:
+            return (content.strip(),) + directive, None
+        return ("", "look", {}), "Failed to parse LLM response as JSON: %s%s" % (
+            content[:100], "..." if len(content) > 100 else "")
+    
+    (thought, tool_name, tool_args), error = _check_decision(parsed, catalog)
+    if error:
+        # Prefer the action the thought describes over falling back to look
+        directive = _extract_directive(thought, catalog)
+        if directive:
+            return (thought,) + directive, None
+    return (thought, tool_name, tool_args), error
+
+
+def _extract_directive(text: str, catalog: Dict[str, Any]
+                       ) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Recover a tool call from a command stated in text, such as "I should go
+    north" or "put the leaflet in the mailbox".
     
-    # If the response contains a code block, extract it
-    if "```json" in content:
-        content = content.split("```json")[1].split("```")[0].strip()
-    elif "```" in content:
-        content = content.split("```")[1].split("```")[0].strip()
+    Thoughts usually end with the action to take, so the last command that
+    maps to a valid tool call is used.
     
-    try:
-        # Try to parse the content as JSON
-        parsed = json.loads(content)
-        tool_name = parsed.get("tool", "look").lower()  # Default to look
-        tool_args = parsed.get("args", {})
+    Args:
+        text: The text to search, usually the LLM's thought
+        catalog: The tool catalog of the MCP server
         
-        # Validate the tool name
-        if tool_name not in valid_tool_names:
-            print(f"Invalid tool name: {tool_name}, defaulting to look")
-            tool_name = "look"
-            tool_args = {}
+    Returns:
+        A tuple of (tool_name, tool_args), or None if the text does not state
+        a valid command
+    """
+    for match in reversed(list(_IMPERATIVE_RE.finditer(text))):
+        verb, target, container = (group.lower() if group else group
+                                   for group in match.groups())
+        if verb == "go":
+            if target not in _DIRECTIONS:
+                continue
+            tool_name, tool_args = "navigate", {"direction": target}
+        elif verb == "put":
+            if not container:
+                continue
+            tool_name, tool_args = "put", {"object": target, "container": container}
+        else:
+            tool_name, tool_args = verb, {"object": target}
         
-        # Find the tool definition
-        tool_def = next((t for t in tools if t.get("name") == tool_name), None)
+        _, error = _check_decision({"tool": tool_name, "args": tool_args}, catalog)
+        if error is None:
+            return tool_name, tool_args
+    return None
+
+
+def _check_decision(decision: Dict[str, Any], catalog: Dict[str, Any]
+                    ) -> Tuple[Tuple[str, str, Dict[str, Any]], Optional[str]]:
+    """
+    Normalize a decision and check it against the tool catalog.
+    
+    Args:
+        decision: The decision with "thought", "tool" and "args" fields
+        catalog: The tool catalog of the MCP server
         
-        # Validate required arguments if we have a tool definition
-        if tool_def:
-            input_schema = tool_def.get("inputSchema", {})
-            required = input_schema.get("required", [])
-            
-            missing_args = [arg for arg in required if arg not in tool_args]
-            if missing_args:
-                print(f"Missing required arguments for {tool_name}: {missing_args}, defaulting to look")
-                tool_name = "look"
-                tool_args = {}
-        # Fall back to hardcoded validation if we don't have a tool definition
-        else:
-            if tool_name == "navigate" and "direction" not in tool_args:
-                print("Missing required argument 'direction' for navigate, defaulting to look")
-                tool_name = "look"
-                tool_args = {}
-            elif tool_name in ["examine", "take", "drop", "read", "open", "close"] and "object" not in tool_args:
-                print(f"Missing required argument 'object' for {tool_name}, defaulting to look")
-                tool_name = "look"
-                tool_args = {}
-            elif tool_name == "put" and ("object" not in tool_args or "container" not in tool_args):
-                print("Missing required arguments for put, defaulting to look")
-                tool_name = "look"
-                tool_args = {}
-    except json.JSONDecodeError:
-        print("\n" + "!"*80)
-        print("! ERROR: Failed to parse LLM response as JSON")
-        print("! Response: " + content[:100] + ("..." if len(content) > 100 else ""))
-        print("! This may indicate a problem with the LLM's response format.")
-        print("! The agent will fall back to the 'look' tool, which may not be optimal.")
-        print("!"*80 + "\n")
-        tool_name = "look"
+    Returns:
+        A tuple of ((thought, tool_name, tool_args), error), where the error
+        is None if the tool exists and all of its required arguments are set
+    """
+    thought = str(decision.get("thought", ""))
+    tool_name = str(decision.get("tool", "look")).lower()  # Default to look
+    tool_args = decision.get("args")
+    if not isinstance(tool_args, dict):
         tool_args = {}
     
-    return tool_name, tool_args
+    # Validate the tool name
+    if tool_name not in catalog["valid_tool_names"]:
+        return (thought, tool_name, tool_args), f"Invalid tool name: {tool_name}"
+    
+    # Find the tool definition
+    tool_def = catalog["definitions"].get(tool_name)
+    
+    # Validate required arguments, using the hardcoded ones if we don't have
+    # a tool definition
+    if tool_def:
+        required = tool_def.get("inputSchema", {}).get("required", [])
+    else:
+        required = DEFAULT_REQUIRED_ARGS.get(tool_name, ())
+    
+    missing_args = [arg for arg in required if arg not in tool_args]
+    if missing_args:
+        return ((thought, tool_name, tool_args),
+                f"Missing required arguments for {tool_name}: {missing_args}")
+    
+    return (thought, tool_name, tool_args), None
@@ -5,13 +5,34 @@ This module implements a LangGraph workflow for an agent that uses MCP tools
 to interact with the Zork environment. The agent explicitly selects tools and
 provides parameters, rather than generating text commands directly.
 """
-from typing import Any, Dict, List, TypedDict, Optional, Tuple, cast
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, TypedDict, Optional, Tuple, Type, cast
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import functools
+import logging
 import os
 import json
 import re
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import Runnable, RunnableLambda
 from langgraph.graph import StateGraph, END
+from pydantic import BaseModel, Field, create_model
+from src.agent.llm import make_llm
+from src.agent.mcp._common import (
+    DEFAULT_REQUIRED_ARGS, DEFAULT_TOOL_DESCRIPTIONS, DEFAULT_TOOL_EXAMPLES
+)
+
+# Check if we can use MCP tools directly
+try:
+    from src.mcp.client import get_mcp_tools, use_mcp_tool, use_mcp_tools
+    HAS_MCP = True
+except ImportError:
+    HAS_MCP = False
+    print("MCP client not available, falling back to direct environment calls")
+
+logger = logging.getLogger(__name__)
 
 
 class AgentState(TypedDict):
@@ -32,14 +53,321 @@ class AgentState(TypedDict):
     valid_actions: List[str]  # Valid actions in the current state
     tool_name: Optional[str]  # Name of the selected tool
     tool_args: Optional[Dict[str, Any]]  # Arguments for the selected tool
+    tool_calls: Optional[List[Dict[str, Any]]]  # All tool calls for this step
     tool_result: Optional[str]  # Result of the tool execution
 
 
+class ToolCall(BaseModel):
+    """
+    A single tool call selected by the LLM.
+    """
+    tool: str = Field(description="Name of the tool to use")
+    args: Dict[str, str] = Field(
+        default_factory=dict,
+        description="Arguments for the tool, e.g. {\"object\": \"mailbox\"}"
+    )
+
+
+class ToolDecision(BaseModel):
+    """
+    Structured LLM response combining the agent's reasoning and tool choices.
+    """
+    thought: str = Field(description="Step-by-step reasoning about what to do next")
+    tool_calls: List[ToolCall] = Field(
+        description="Tool calls to execute in order during this step"
+    )
+
+
+# Default tools and their required arguments used when the MCP server is unavailable
+_DEFAULT_AVAILABLE_TOOLS: Mapping[str, Tuple[str, ...]] = MappingProxyType(DEFAULT_REQUIRED_ARGS)
+
+# Text command template for each tool, used for logging and direct
+# environment calls; missing arguments format as empty strings
+_TOOL_COMMANDS: Dict[str, str] = {
+    "navigate": "go {direction}",
+    "examine": "examine {object}",
+    "take": "take {object}",
+    "drop": "drop {object}",
+    "inventory": "inventory",
+    "read": "read {object}",
+    "look": "look",
+    "open": "open {object}",
+    "close": "close {object}",
+    "put": "put {object} in {container}",
+}
+
+# Tools that only read the game state; consecutive calls to these can be
+# sent to the MCP server in one round trip without changing their outcome
+_READ_ONLY_TOOLS = frozenset({"look", "inventory", "examine", "read"})
+
+# Objects and directions that missing tool arguments are inferred from
+_OBJECT_RE = re.compile(r"\b(mailbox|leaflet|sword|lamp|house|door|window|rug)\b")
+_DIRECTION_RE = re.compile(r"\b(north|south|east|west|up|down)\b")
+
+# Example argument values for tools discovered without examples
+_EXAMPLE_ARG_VALUES = {"direction": "north", "object": "mailbox", "container": "mailbox"}
+
+_SYSTEM_PROMPT_TEMPLATE = """\
+You are an expert text adventure game player. You are playing Zork.
+
+Each turn you are given the current observation, location, inventory,
+score and number of moves.
+
+Available Tools:
+{tool_descriptions}
+{tool_examples}
+Think step by step about what to do next. Consider:
+1. What is happening in the game?
+2. What are your goals?
+3. What actions can you take?
+4. What would be the best action to take?
+
+Put your reasoning in "thought", then list the tools to use in
+"tool_calls", each with its required parameters in "args". You may
+batch several independent calls (e.g. look, examine, inventory) into
+one response; they are executed in the order given.
+"""
+
+
+@functools.lru_cache(maxsize=8)
+def _create_decision_schema(tool_names: Tuple[str, ...]) -> Type[ToolDecision]:
+    """
+    Create a ToolDecision schema that offers the LLM only the given tool names.
+    
+    The names are listed as an enum in the JSON schema sent to the LLM, but
+    are not enforced when the response is parsed: a single call naming an
+    unknown tool would otherwise discard the whole decision, so such calls
+    are left to validate_tool_call and the other calls still run.
+    
+    Args:
+        tool_names: The names of the available tools
+        
+    Returns:
+        A ToolDecision subclass whose tool field lists the names as an enum
+    """
+    tool_call = create_model(
+        "ToolCall",
+        __base__=ToolCall,
+        tool=(str, Field(description="Name of the tool to use",
+                         json_schema_extra={"enum": list(tool_names)}))
+    )
+    return create_model(
+        "ToolDecision",
+        __base__=ToolDecision,
+        tool_calls=(List[tool_call], Field(
+            description="Tool calls to execute in order during this step"))
+    )
+
+
+# Maximum number of game states whose decisions are cached per workflow
+_DECISION_CACHE_SIZE = 256
+
+
+def _state_key(state: AgentState) -> Tuple[Any, ...]:
+    """
+    Create a hashable key identifying the game state shown to the LLM.
+    
+    Args:
+        state: The current state
+        
+    Returns:
+        A tuple of (observation, location, inventory)
+    """
+    inventory = state["inventory"]
+    if isinstance(inventory, list):
+        inventory = tuple(sorted(inventory))
+    return (state["observation"], state["location"], inventory)
+
+
+# Per-step game state sent after the constant system message
+_GAME_STATE_TEMPLATE = """\
+Current Observation:
+{observation}
+
+Current Location:
+{location}
+
+Inventory:
+{inventory}
+
+Score: {score}
+Moves: {moves}"""
+
+# Limits on the game state shown to the LLM; the state itself is kept in full
+_MAX_OBSERVATION_CHARS = 800
+_MAX_INVENTORY_ITEMS = 20
+
+
+def _truncate(text: str, limit: int = _MAX_OBSERVATION_CHARS) -> str:
+    """
+    Keep the end of a long text for the prompt.
+    
+    Args:
+        text: The text to truncate
+        limit: The maximum number of characters to keep
+        
+    Returns:
+        The text, or its last `limit` characters prefixed with "..."
+    """
+    if len(text) <= limit:
+        return text
+    return "..." + text[-limit:]
+
+
+def _format_inventory(inventory: Any, limit: int = _MAX_INVENTORY_ITEMS) -> str:
+    """
+    Format the inventory for the prompt, keeping the most recent items.
+    
+    Args:
+        inventory: The inventory items, or the inventory text from the environment
+        limit: The maximum number of items to show
+        
+    Returns:
+        The formatted inventory
+    """
+    if not isinstance(inventory, list):
+        return _truncate(str(inventory))
+    if len(inventory) <= limit:
+        return str(inventory)
+    return f"{inventory[-limit:]} ... (+{len(inventory) - limit} more)"
+
+
+def _build_tool_catalog(
+    tools: List[Dict[str, Any]]
+) -> Tuple[str, str, Mapping[str, Tuple[str, ...]]]:
+    """
+    Build the prompt catalog for the tools discovered on the MCP server.
+    
+    Args:
+        tools: The tool definitions returned by the MCP server
+        
+    Returns:
+        A tuple of (tool_descriptions, tool_examples, available_tools)
+    """
+    descriptions = []
+    examples = []
+    available_tools = {}
+    
+    for tool in tools:
+        tool_name = tool.get("name", "")
+        if not tool_name:
+            continue
+        
+        descriptions.append(f"- {tool_name}: {tool.get('description', '')}\n")
+        
+        # Add the tool to available_tools
+        input_schema = tool.get("inputSchema", {})
+        required = input_schema.get("required", [])
+        available_tools[tool_name] = tuple(required)
+        
+        # Use the examples from the tool definition if available, otherwise
+        # generate one from the required parameters in the schema
+        tool_examples = tool.get("examples", [])
+        if tool_examples:
+            for example in tool_examples:
+                example_json = {"tool": tool_name, "args": example.get("args", {})}
+                example_name = example.get("name", f"Example for {tool_name}")
+                examples.append(f"{example_name}: {json.dumps(example_json, separators=(',', ':'))}\n")
+        else:
+            example_args = {
+                param_name: _EXAMPLE_ARG_VALUES.get(param_name, "example")
+                for param_name in input_schema.get("properties", {})
+                if param_name in required
+            }
+            example = {"tool": tool_name, "args": example_args}
+            examples.append(f"Example for {tool_name}: {json.dumps(example, separators=(',', ':'))}\n")
+    
+    return "".join(descriptions), "".join(examples), available_tools
+
+
+@functools.lru_cache(maxsize=8)
+def _create_system_message(tool_descriptions: str, tool_examples: str) -> SystemMessage:
+    """
+    Create the system message for a given tool catalog.
+    
+    The message is cached so that every call for the same catalog sends a
+    byte-identical prefix, which lets providers reuse their prompt cache.
+    
+    Args:
+        tool_descriptions: The formatted tool descriptions
+        tool_examples: The formatted tool examples
+        
+    Returns:
+        The system message
+    """
+    return SystemMessage(content=_SYSTEM_PROMPT_TEMPLATE.format(
+        tool_descriptions=tool_descriptions,
+        tool_examples=tool_examples
+    ))
+
+
+# Output cap for a decision: a short thought plus a few tool calls, so a
+# rambling response cannot hold up the step
+_LLM_MAX_TOKENS = 256
+
+
+def _failed_result(observation: str, current: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Create the result of a tool call that failed.
+    
+    Args:
+        observation: The error message to report as the observation
+        current: The game state before the call, which is left unchanged
+        
+    Returns:
+        A step result counting the failed call as a move
+    """
+    return {
+        "observation": observation,
+        "score": current["score"],
+        "done": current["done"],
+        "moves": current["moves"] + 1,
+        "valid_actions": current["valid_actions"],
+        "inventory": current["inventory"],
+        "location": current["location"]
+    }
+
+
+@functools.lru_cache(maxsize=8)
+def _make_decider(
+    model_name: str,
+    api_key: Optional[str],
+    temperature: Optional[float],
+    base_url: Optional[str],
+    tool_names: Tuple[str, ...]
+) -> Runnable:
+    """
+    Create the structured-output LLM for a tool catalog.
+    
+    Responses are capped at _LLM_MAX_TOKENS tokens. The runnable is cached,
+    so episodes with the same settings and tools share it instead of binding
+    the decision schema to the model again.
+    
+    Args:
+        model_name: The name of the LLM model to use
+        api_key: The API key for the LLM provider
+        temperature: The sampling temperature
+        base_url: The base URL of an OpenAI-compatible server
+        tool_names: The names of the available tools
+        
+    Returns:
+        A runnable returning a ToolDecision, with the catalog's tool names
+        offered to the LLM
+    """
+    llm = make_llm(model_name, api_key, temperature, base_url=base_url,
+                   max_tokens=_LLM_MAX_TOKENS)
+    # Function calling keeps the structured output compatible with models
+    # that do not support JSON schema response formats (e.g. gpt-3.5-turbo)
+    return llm.with_structured_output(
+        _create_decision_schema(tool_names), method="function_calling")
+
+
 def create_agent_workflow(
     environment: Any,
     model_name: str = "gpt-3.5-turbo",
     api_key: Optional[str] = None,
-    max_steps: int = 20
+    max_steps: int = 20,
+    temperature: Optional[float] = None
 ) -> Tuple[StateGraph, Dict[str, Any]]:
     """
     Create a LangGraph workflow for the MCP Zork AI agent.
@@ -49,6 +377,9 @@ def create_agent_workflow(
         model_name: The name of the LLM model to use
         api_key: The API key for the LLM provider
         max_steps: Maximum number of steps to run
+        temperature: The sampling temperature (None uses the provider default).
+            With a temperature of 0, decisions for repeated game states are
+            reused from an in-process cache instead of calling the LLM.
         
     Returns:
         A tuple of (workflow, initial_state)
@@ -57,10 +388,82 @@ def create_agent_workflow(
     if api_key is None:
         api_key = os.environ.get("OPENAI_API_KEY")
     
-    llm = ChatOpenAI(model=model_name, api_key=api_key)
+    # Create the shared LLM up front so configuration errors surface before
+    # the episode starts
+    base_url = os.environ.get("LLM_BASE_URL")
+    make_llm(model_name, api_key, temperature, base_url=base_url,
+             max_tokens=_LLM_MAX_TOKENS)
+    
+    def get_decider(tool_names: Tuple[str, ...]) -> Runnable:
+        """
+        Get the structured-output LLM for a tool catalog.
+        
+        Args:
+            tool_names: The names of the available tools
+            
+        Returns:
+            A runnable returning a ToolDecision, with the catalog's tool
+            names offered to the LLM
+        """
+        return _make_decider(model_name, api_key, temperature, base_url, tool_names)
+    
+    # Cache of decisions for repeated game states, only used when responses
+    # are deterministic
+    decision_cache: "OrderedDict[Tuple[Any, ...], ToolDecision]" = OrderedDict()
+    use_decision_cache = temperature == 0
+    # Highest score seen so far; scoring means the game has moved on, so
+    # decisions made before it may block further progress
+    cache_score = 0
+    
+    def get_cached_decision(state: AgentState, key: Tuple[Any, ...]) -> Optional[ToolDecision]:
+        """
+        Get the cached decision for a repeated game state.
+        
+        The cache is cleared whenever the score rises above the highest
+        score seen so far.
+        
+        Args:
+            state: The current state
+            key: The key of the game state
+            
+        Returns:
+            The cached decision, or None if there is none
+        """
+        nonlocal cache_score
+        if not use_decision_cache:
+            return None
+        if state["score"] > cache_score:
+            cache_score = state["score"]
+            decision_cache.clear()
+            return None
+        decision = decision_cache.get(key)
+        if decision is not None:
+            logger.debug("Using cached thought and tool selection")
+            decision_cache.move_to_end(key)
+        return decision
+    
+    def cache_decision(key: Tuple[Any, ...], decision: Optional[ToolDecision]) -> None:
+        """
+        Cache the decision for a game state, evicting the oldest entry if full.
+        
+        Args:
+            key: The key of the game state
+            decision: The decision, or None if the LLM call failed
+        """
+        if use_decision_cache and decision is not None:
+            decision_cache[key] = decision
+            if len(decision_cache) > _DECISION_CACHE_SIZE:
+                decision_cache.popitem(last=False)
+    
+    # Tool calls started while the LLM response is still streaming; a single
+    # worker keeps them in order against the environment. The worker is only
+    # started for steps that prefetch, and act shuts it down again once their
+    # results are in, so no thread outlives the run.
+    tool_executor: Optional[ThreadPoolExecutor] = None
+    prefetched: List["Future[Tuple[str, Dict[str, Any]]]"] = []
     
     # Define the workflow nodes
-    def observe(state: AgentState) -> AgentState:
+    def observe(state: AgentState) -> Dict[str, Any]:
         """
         Get the current observation from the environment.
         
@@ -68,14 +471,15 @@ def create_agent_workflow(
             state: The current state
             
         Returns:
-            The updated state with the current observation
+            The state fields to update: the reset game state on the first
+            step, and nothing afterwards
         """
-        print("In observe node")
+        logger.debug("In observe node")
         # If this is the first step, reset the environment
         if state.get("observation") is None:
-            print("Resetting environment")
+            logger.debug("Resetting environment")
             env_state = environment.reset()
-            print(f"Environment reset: {env_state}")
+            logger.debug("Environment reset: %s", env_state)
             return {
                 "observation": env_state["observation"],
                 "score": env_state["score"],
@@ -88,465 +492,445 @@ def create_agent_workflow(
                 "action": "",
                 "tool_name": None,
                 "tool_args": None,
+                "tool_calls": None,
                 "tool_result": None
             }
         
-        # Otherwise, return the current state
-        print("Returning current state")
-        return state
+        # Otherwise, the state already holds the current observation
+        logger.debug("Keeping current state")
+        return {}
+    
+    # Tool catalog discovered from the MCP server, built on first use
+    tool_catalog: List[Tuple[str, str, Mapping[str, Tuple[str, ...]]]] = []
+    
+    def get_tool_catalog() -> Tuple[str, str, Mapping[str, Tuple[str, ...]]]:
+        """
+        Get the tool descriptions, examples and required arguments.
+        
+        Returns:
+            A tuple of (tool_descriptions, tool_examples, available_tools)
+        """
+        if tool_catalog:
+            return tool_catalog[0]
+        
+        # Try to get the available tools from the MCP server
+        tools = []
+        if HAS_MCP:
+            try:
+                # Get the server name from the environment if available
+                server_name = getattr(environment, 'server_name', "zork-tools")
+                
+                # Get the available tools from the MCP server
+                tools = get_mcp_tools(server_name)
+            except Exception as e:
+                # Fall back to default tools
+                logger.warning("Error getting MCP tools: %s", e)
+        
+        # If no tools were found, use default tools, descriptions and examples
+        if tools:
+            tool_catalog.append(_build_tool_catalog(tools))
+        else:
+            tool_catalog.append(
+                (DEFAULT_TOOL_DESCRIPTIONS, DEFAULT_TOOL_EXAMPLES, _DEFAULT_AVAILABLE_TOOLS))
+        return tool_catalog[0]
     
-    def think(state: AgentState) -> AgentState:
+    def build_messages(
+        state: AgentState
+    ) -> Tuple[List[BaseMessage], Mapping[str, Tuple[str, ...]]]:
         """
-        Generate a thought about what to do next.
+        Build the LLM messages for the think node.
         
         Args:
             state: The current state
             
         Returns:
-            The updated state with a thought
+            A tuple of (messages, available_tools)
         """
-        print("In think node")
-        # Create a prompt for the LLM
-        prompt = f"""
-        You are an expert text adventure game player. You are playing Zork.
+        tool_descriptions, tool_examples, available_tools = get_tool_catalog()
         
-        Current Observation:
-        {state["observation"]}
+        # The system message holds everything that is constant for the run so
+        # providers can cache the prompt prefix; only the game state varies,
+        # trimmed so the prompt does not grow as the episode goes on
+        prompt = _GAME_STATE_TEMPLATE.format(
+            observation=_truncate(state["observation"]),
+            location=state["location"],
+            inventory=_format_inventory(state["inventory"]),
+            score=state["score"],
+            moves=state["moves"]
+        )
         
-        Current Location:
-        {state["location"]}
+        messages = [
+            _create_system_message(tool_descriptions, tool_examples),
+            HumanMessage(content=prompt)
+        ]
+        return messages, available_tools
+    
+    def validate_tool_call(
+        call: ToolCall,
+        thought: str,
+        available_tools: Mapping[str, Tuple[str, ...]]
+    ) -> Dict[str, Any]:
+        """
+        Validate a single tool call chosen by the LLM.
         
-        Inventory:
-        {state["inventory"]}
+        Args:
+            call: The tool call to validate
+            thought: The thought that accompanied the call, used to infer missing arguments
+            available_tools: The available tools and their required arguments
+            
+        Returns:
+            A dictionary with the validated tool name and arguments
+        """
+        tool_name = call.tool.lower()  # Normalize to lowercase
+        tool_args = dict(call.args)
         
-        Score: {state["score"]}
-        Moves: {state["moves"]}
+        # Validate the tool name
+        if tool_name not in available_tools:
+            logger.warning("Invalid tool name: '%s', falling back to the 'look' tool", tool_name)
+            tool_name = "look"
+            tool_args = {}
         
-        Think step by step about what to do next. Consider:
-        1. What is happening in the game?
-        2. What are your goals?
-        3. What actions can you take?
-        4. What would be the best action to take?
+        # Validate required arguments
+        required_args = available_tools[tool_name]
+        missing_args = [arg for arg in required_args if arg not in tool_args]
         
-        Your thought process:
-        """
+        if missing_args:
+            logger.debug("Missing required arguments for %s: %s", tool_name, missing_args)
+            # If we're missing required arguments, try to infer them from the thought
+            thought_lower = thought.lower()
+            for arg in missing_args:
+                if arg == "object" and "object" in thought_lower:
+                    # Try to extract an object from the thought
+                    match = _OBJECT_RE.search(thought_lower)
+                    if match:
+                        tool_args["object"] = match.group(1)
+                        logger.debug("Inferred object from thought: %s", match.group(1))
+                elif arg == "direction":
+                    # Try to extract a direction from the thought
+                    match = _DIRECTION_RE.search(thought_lower)
+                    if match:
+                        tool_args["direction"] = match.group(1)
+                        logger.debug("Inferred direction from thought: %s", match.group(1))
         
-        # Generate a thought using the LLM
-        try:
-            print("Calling LLM for thought...")
-            messages = [
-                SystemMessage(content="You are an expert text adventure game player."),
-                HumanMessage(content=prompt)
-            ]
-            response = llm.invoke(messages)
-            print(f"LLM response for thought: {response.content[:100]}...")
-            
-            # Update the state with the thought
-            state["thought"] = response.content
-        except Exception as e:
-            print(f"Error generating thought: {e}")
-            state["thought"] = "I should look around to see what's here."
+        # If we still have missing required arguments, default to look
+        missing_args = [arg for arg in required_args if arg not in tool_args]
+        if missing_args:
+            logger.warning(
+                "Still missing required arguments for '%s': %s, falling back to the 'look' tool",
+                tool_name, missing_args
+            )
+            tool_name = "look"
+            tool_args = {}
         
-        return state
+        logger.debug("Selected tool: %s, args: %s", tool_name, tool_args)
+        return {"tool": tool_name, "args": tool_args}
     
-    def select_tool(state: AgentState) -> AgentState:
+    def apply_decision(
+        decision: Optional[ToolDecision],
+        available_tools: Mapping[str, Tuple[str, ...]],
+        validated: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
         """
-        Select a tool to use based on the thought.
+        Validate the LLM decision and turn it into state updates.
         
         Args:
-            state: The current state
+            decision: The structured LLM decision, or None if the call failed
+            available_tools: The available tools and their required arguments
+            validated: Tool calls at the start of the decision that were already validated
             
         Returns:
-            The updated state with a selected tool
+            The state fields to update: the thought and the selected tools
         """
-        print("In select_tool node")
-        
-        # Try to get the available tools from the MCP server
-        try:
-            from src.mcp.client import get_mcp_tools
-            
-            # Get the server name from the environment if available
-            server_name = getattr(environment, 'server_name', "zork-tools")
-            
-            # Get the available tools from the MCP server
-            tools = get_mcp_tools(server_name)
-            
-            # Build the tool descriptions and examples
-            tool_descriptions = ""
-            tool_examples = ""
-            available_tools = {}
-            
-            for tool in tools:
-                # Add the tool description
-                tool_name = tool.get("name", "")
-                if not tool_name:
-                    continue
-                    
-                description = tool.get("description", "")
-                tool_descriptions += f"- {tool_name}: {description}\n"
-                
-                # Add the tool to available_tools
-                input_schema = tool.get("inputSchema", {})
-                required = input_schema.get("required", [])
-                available_tools[tool_name] = {"required": required}
-                
-                # Get examples from the tool definition if available
-                examples = tool.get("examples", [])
-                if examples:
-                    for example in examples:
-                        # Add the example to the prompt
-                        example_json = {
-                            "tool": tool_name,
-                            "args": example.get("args", {})
-                        }
-                        example_name = example.get("name", f"Example for {tool_name}")
-                        tool_examples += f"{example_name}: {json.dumps(example_json)}\n"
-                else:
-                    # If no examples are provided, generate one based on the schema
-                    properties = input_schema.get("properties", {})
-                    
-                    # Build the example arguments
-                    example_args = {}
-                    for param_name, param_schema in properties.items():
-                        if param_name in required:
-                            # Use an example value based on the parameter name
-                            if param_name == "direction":
-                                example_args[param_name] = "north"
-                            elif param_name == "object":
-                                example_args[param_name] = "mailbox"
-                            elif param_name == "container":
-                                example_args[param_name] = "mailbox"
-                            else:
-                                example_args[param_name] = "example"
-                    
-                    # Add the example to the prompt
-                    example = {
-                        "tool": tool_name,
-                        "args": example_args
-                    }
-                    tool_examples += f"Example for {tool_name}: {json.dumps(example)}\n"
-        except (ImportError, Exception) as e:
-            print(f"Error getting MCP tools: {e}")
-            # Fall back to default tools
-            tools = []
-            tool_descriptions = ""
-            tool_examples = ""
-            available_tools = {
-                "navigate": {"required": ["direction"]},
-                "examine": {"required": ["object"]},
-                "take": {"required": ["object"]},
-                "drop": {"required": ["object"]},
-                "inventory": {"required": []},
-                "read": {"required": ["object"]},
-                "look": {"required": []},
-                "open": {"required": ["object"]},
-                "close": {"required": ["object"]},
-                "put": {"required": ["object", "container"]}
+        if decision is None:
+            return {
+                "thought": "I should look around to see what's here.",
+                "tool_calls": [{"tool": "look", "args": {}}],
+                "tool_name": "look",
+                "tool_args": {}
             }
         
-        # If no tools were found, use default descriptions and examples
-        if not tools:
-            tool_descriptions = """
-            - navigate: Move in a specified direction (north, south, east, west, up, down)
-            - examine: Examine an object in the environment
-            - take: Take an object
-            - drop: Drop an object from your inventory
-            - inventory: Check your inventory
-            - read: Read an object with text
-            - look: Look around to get a description of your surroundings
-            - open: Open a container or door
-            - close: Close a container or door
-            - put: Put an object into a container
-            """
-            
-            tool_examples = """
-            Example for navigate: {"tool": "navigate", "args": {"direction": "north"}}
-            Example for examine: {"tool": "examine", "args": {"object": "mailbox"}}
-            Example for take: {"tool": "take", "args": {"object": "leaflet"}}
-            Example for drop: {"tool": "drop", "args": {"object": "sword"}}
-            Example for inventory: {"tool": "inventory", "args": {}}
-            Example for read: {"tool": "read", "args": {"object": "leaflet"}}
-            Example for look: {"tool": "look", "args": {}}
-            Example for open: {"tool": "open", "args": {"object": "mailbox"}}
-            Example for close: {"tool": "close", "args": {"object": "mailbox"}}
-            Example for put: {"tool": "put", "args": {"object": "leaflet", "container": "mailbox"}}
-            """
-            
-            # List of valid tool names for validation
-            valid_tool_names = ["navigate", "examine", "take", "drop", "inventory", 
-                               "read", "look", "open", "close", "put"]
+        # Validate each remaining tool call, keeping the order chosen by the LLM
+        tool_calls = list(validated or [])
+        for call in (decision.tool_calls or [ToolCall(tool="look")])[len(tool_calls):]:
+            tool_calls.append(validate_tool_call(call, decision.thought, available_tools))
         
-        # Create a prompt for the LLM with more detailed instructions
-        prompt = f"""
-        You are an expert text adventure game player. You are playing Zork.
+        # tool_name/tool_args mirror the last call so loop detection sees
+        # the final action
+        return {
+            "thought": decision.thought,
+            "tool_calls": tool_calls,
+            "tool_name": tool_calls[-1]["tool"],
+            "tool_args": tool_calls[-1]["args"]
+        }
+    
+    def prefetch_calls(
+        partial: ToolDecision,
+        validated: List[Dict[str, Any]],
+        available_tools: Mapping[str, Tuple[str, ...]],
+        last_result: List[Dict[str, Any]]
+    ) -> None:
+        """
+        Start the completed tool calls of a partial decision in the background.
         
-        Current Observation:
-        {state["observation"]}
+        Every tool call except the last one in a partial response is complete,
+        so it is validated and started while the rest of the response decodes.
         
-        Current Location:
-        {state["location"]}
+        Args:
+            partial: The partial decision streamed so far
+            validated: Tool calls already validated and started, extended in place
+            available_tools: The available tools and their required arguments
+            last_result: A one-element list holding the latest game state
+        """
+        nonlocal tool_executor
         
-        Inventory:
-        {state["inventory"]}
+        def run_prefetched(call: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+            action, result = execute_tool(call["tool"], call["args"], last_result[0])
+            last_result[0] = result
+            return action, result
         
-        Your Thought:
-        {state["thought"]}
+        while len(partial.tool_calls) > len(validated) + 1:
+            call = validate_tool_call(
+                partial.tool_calls[len(validated)], partial.thought, available_tools)
+            validated.append(call)
+            if tool_executor is None:
+                tool_executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="tool-prefetch")
+            prefetched.append(tool_executor.submit(run_prefetched, call))
+    
+    def keep_prefetched(
+        decision: Optional[ToolDecision],
+        validated: List[Dict[str, Any]]
+    ) -> Optional[ToolDecision]:
+        """
+        Reduce an interrupted decision to the tool calls that are already running.
         
-        Available Tools:
-        {tool_descriptions}
+        Args:
+            decision: The last partial decision, or None if nothing was streamed
+            validated: Tool calls already validated and started
+            
+        Returns:
+            A decision with only the started tool calls, or None if there are none
+        """
+        if not validated:
+            return None
+        return ToolDecision(thought=decision.thought, tool_calls=decision.tool_calls[:len(validated)])
+    
+    def think(state: AgentState) -> Dict[str, Any]:
+        """
+        Generate a thought and select tools in a single streamed LLM call.
+        
+        Args:
+            state: The current state
+            
+        Returns:
+            The state fields to update: the thought and the selected tools
+        """
+        logger.debug("In think node")
+        prefetched.clear()
+        messages, available_tools = build_messages(state)
         
-        Select the most appropriate tool and provide its parameters in JSON format.
+        # Reuse the decision for a repeated game state if possible
+        key = _state_key(state)
+        cached = get_cached_decision(state, key)
+        if cached is not None:
+            return apply_decision(cached, available_tools)
         
-        {tool_examples}
+        # Stream the thought and tool selection from the LLM, starting each
+        # completed tool call while the rest of the response decodes
+        decision = None
+        validated = []
+        last_result = [state]
+        try:
+            logger.debug("Calling LLM for thought and tool selection...")
+            for partial in get_decider(tuple(available_tools)).stream(messages):
+                decision = partial
+                prefetch_calls(partial, validated, available_tools, last_result)
+            if decision is None:
+                raise ValueError("LLM returned no decision")
+            logger.debug("LLM thought: %.100s...", decision.thought)
+        except Exception as e:
+            logger.warning("Error generating thought and tool selection: %s", e)
+            # The partial or fallback decision is used for this step only, so
+            # a later visit to the same state asks the LLM again
+            return apply_decision(keep_prefetched(decision, validated), available_tools, validated)
         
-        Your response must be valid JSON with a "tool" field and an "args" object containing the required parameters.
+        cache_decision(key, decision)
         
-        Your tool selection (JSON format):
+        return apply_decision(decision, available_tools, validated)
+    
+    async def athink(state: AgentState) -> Dict[str, Any]:
         """
+        Async version of the think node, used when the workflow runs with ainvoke.
         
-        # Generate a tool selection using the LLM
-        try:
-            print("Calling LLM for tool selection...")
-            messages = [
-                SystemMessage(content="You are an expert text adventure game player."),
-                HumanMessage(content=prompt)
-            ]
-            response = llm.invoke(messages)
-            print(f"LLM response for tool selection: {response.content[:100]}...")
-        except Exception as e:
-            print(f"Error generating tool selection: {e}")
-            state["tool_name"] = "look"
-            state["tool_args"] = {}
-            return state
+        Args:
+            state: The current state
+            
+        Returns:
+            The state fields to update: the thought and the selected tools
+        """
+        logger.debug("In think node")
+        prefetched.clear()
+        messages, available_tools = build_messages(state)
+        
+        # Reuse the decision for a repeated game state if possible
+        key = _state_key(state)
+        cached = get_cached_decision(state, key)
+        if cached is not None:
+            return apply_decision(cached, available_tools)
         
-        # Parse the tool selection with improved error handling
+        # Stream the thought and tool selection from the LLM, starting each
+        # completed tool call while the rest of the response decodes
+        decision = None
+        validated = []
+        last_result = [state]
         try:
-            # Extract JSON from the response
-            content = response.content
-            
-            # If the response contains a code block, extract it
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            print(f"Original response: {content}")
-            
-            # Try to extract the tool name and args directly
-            tool_name = "look"  # Default
-            tool_args = {}
-            
-            # Try to parse as JSON first
-            try:
-                # Try to parse the content as JSON
-                parsed = json.loads(content)
-                if "tool" in parsed:
-                    tool_name = parsed["tool"].lower()  # Normalize to lowercase
-                if "args" in parsed and isinstance(parsed["args"], dict):
-                    tool_args = parsed["args"]
-            except json.JSONDecodeError:
-                print("\n" + "!"*80)
-                print("! WARNING: JSON parsing failed, falling back to regex extraction")
-                print("! Response: " + content[:100] + ("..." if len(content) > 100 else ""))
-                print("! This may indicate a problem with the LLM's response format.")
-                print("! The agent will attempt to extract the tool name and arguments using regex,")
-                print("! but this is less reliable than proper JSON parsing.")
-                print("!"*80 + "\n")
-                
-                # If that fails, use regex to extract the tool name and args with improved patterns
-                
-                # Extract tool name
-                tool_match = re.search(r'"tool"\s*:\s*"([^"]+)"', content)
-                if tool_match:
-                    tool_name = tool_match.group(1).lower()  # Normalize to lowercase
-                
-                # Extract all possible arguments using a more general pattern
-                arg_matches = re.findall(r'"([^"]+)"\s*:\s*"([^"]+)"', content)
-                for key, value in arg_matches:
-                    if key != "tool":  # Skip the tool name
-                        tool_args[key] = value
-            
-            # Validate the tool name
-            if tool_name not in available_tools:
-                print("\n" + "!"*80)
-                print(f"! WARNING: Invalid tool name: '{tool_name}'")
-                print("! This may indicate a problem with the LLM's understanding of available tools.")
-                print("! The agent will fall back to the 'look' tool, which may not be optimal.")
-                print("!"*80 + "\n")
-                tool_name = "look"
-                tool_args = {}
-            
-            # Validate required arguments
-            required_args = available_tools[tool_name]["required"]
-            missing_args = [arg for arg in required_args if arg not in tool_args]
-            
-            if missing_args:
-                print(f"Missing required arguments for {tool_name}: {missing_args}")
-                # If we're missing required arguments, try to infer them from the thought
-                for arg in missing_args:
-                    if arg == "object" and "object" in state["thought"].lower():
-                        # Try to extract an object from the thought
-                        objects = re.findall(r'\b(mailbox|leaflet|sword|lamp|house|door|window|rug)\b', state["thought"].lower())
-                        if objects:
-                            tool_args["object"] = objects[0]
-                            print(f"Inferred object from thought: {objects[0]}")
-                    elif arg == "direction" and any(dir in state["thought"].lower() for dir in ["north", "south", "east", "west", "up", "down"]):
-                        # Try to extract a direction from the thought
-                        directions = re.findall(r'\b(north|south|east|west|up|down)\b', state["thought"].lower())
-                        if directions:
-                            tool_args["direction"] = directions[0]
-                            print(f"Inferred direction from thought: {directions[0]}")
-            
-            # If we still have missing required arguments, default to look
-            missing_args = [arg for arg in required_args if arg not in tool_args]
-            if missing_args:
-                print("\n" + "!"*80)
-                print(f"! WARNING: Still missing required arguments for '{tool_name}': {missing_args}")
-                print("! This may indicate a problem with the LLM's understanding of tool parameters.")
-                print("! The agent will fall back to the 'look' tool, which may not be optimal.")
-                print("!"*80 + "\n")
-                tool_name = "look"
-                tool_args = {}
-            
-            print(f"Extracted tool: {tool_name}, args: {tool_args}")
-            
-            # Create the tool selection
-            tool_selection = {"tool": tool_name, "args": tool_args}
-            
-            # Update the state with the selected tool
-            state["tool_name"] = tool_selection["tool"]
-            state["tool_args"] = tool_selection["args"]
+            logger.debug("Calling LLM for thought and tool selection...")
+            async for partial in get_decider(tuple(available_tools)).astream(messages):
+                decision = partial
+                prefetch_calls(partial, validated, available_tools, last_result)
+            if decision is None:
+                raise ValueError("LLM returned no decision")
+            logger.debug("LLM thought: %.100s...", decision.thought)
         except Exception as e:
-            # If there's an error, default to the look tool
-            print(f"Error parsing tool selection: {e}")
-            print(f"Response: {response.content}")
-            state["tool_name"] = "look"
-            state["tool_args"] = {}
+            logger.warning("Error generating thought and tool selection: %s", e)
+            # The partial or fallback decision is used for this step only, so
+            # a later visit to the same state asks the LLM again
+            return apply_decision(keep_prefetched(decision, validated), available_tools, validated)
         
-        return state
+        cache_decision(key, decision)
+        
+        return apply_decision(decision, available_tools, validated)
     
-    def act(state: AgentState) -> AgentState:
+    def execute_tool(
+        tool_name: str,
+        tool_args: Dict[str, Any],
+        current: Dict[str, Any]
+    ) -> Tuple[str, Dict[str, Any]]:
         """
-        Execute the selected tool.
+        Execute a single tool call against the environment.
         
         Args:
-            state: The current state
+            tool_name: The name of the tool to execute
+            tool_args: The arguments for the tool
+            current: The current game state, used if the tool call fails
             
         Returns:
-            The updated state with the action result
+            A tuple of (action, result)
         """
-        print("In act node")
-        # Get the selected tool and arguments
-        tool_name = state["tool_name"]
-        tool_args = state["tool_args"] or {}
-        
         # Create a descriptive action string for logging
-        if tool_name == "navigate":
-            action = f"go {tool_args.get('direction', '')}"
-        elif tool_name == "examine":
-            action = f"examine {tool_args.get('object', '')}"
-        elif tool_name == "take":
-            action = f"take {tool_args.get('object', '')}"
-        elif tool_name == "drop":
-            action = f"drop {tool_args.get('object', '')}"
-        elif tool_name == "inventory":
-            action = "inventory"
-        elif tool_name == "read":
-            action = f"read {tool_args.get('object', '')}"
-        elif tool_name == "look":
-            action = "look"
-        elif tool_name == "open":
-            action = f"open {tool_args.get('object', '')}"
-        elif tool_name == "close":
-            action = f"close {tool_args.get('object', '')}"
-        elif tool_name == "put":
-            action = f"put {tool_args.get('object', '')} in {tool_args.get('container', '')}"
-        else:
+        command = _TOOL_COMMANDS.get(tool_name)
+        if command is None:
             # Default to look if the tool is not recognized
-            print(f"Unrecognized tool: {tool_name}, defaulting to look")
+            logger.warning("Unrecognized tool: %s, defaulting to look", tool_name)
             tool_name = "look"
             tool_args = {}
-            action = "look"
+            command = _TOOL_COMMANDS["look"]
+        action = command.format_map(defaultdict(str, tool_args))
         
         try:
-            # Check if we can use MCP tools directly
-            HAS_MCP = True
-            try:
-                from src.mcp.client import use_mcp_tool
-            except ImportError:
-                HAS_MCP = False
-                print("MCP client not available, falling back to direct environment calls")
-            
             if hasattr(environment, 'server_name') and HAS_MCP:
                 # Execute the tool via MCP
-                print(f"Using MCP to execute tool: {tool_name}")
+                logger.debug("Using MCP to execute tool: %s", tool_name)
                 result = use_mcp_tool(environment.server_name, tool_name, tool_args)
             else:
                 # Fall back to the mock environment if MCP is not available
-                print("Falling back to direct environment calls")
-                
-                # Map the tools to environment commands
-                if tool_name == "navigate":
-                    direction = tool_args.get("direction", "")
-                    result = environment.step(f"go {direction}")
-                elif tool_name == "examine":
-                    obj = tool_args.get("object", "")
-                    result = environment.step(f"examine {obj}")
-                elif tool_name == "take":
-                    obj = tool_args.get("object", "")
-                    result = environment.step(f"take {obj}")
-                elif tool_name == "drop":
-                    obj = tool_args.get("object", "")
-                    result = environment.step(f"drop {obj}")
-                elif tool_name == "inventory":
-                    result = environment.step("inventory")
-                elif tool_name == "read":
-                    obj = tool_args.get("object", "")
-                    result = environment.step(f"read {obj}")
-                elif tool_name == "look":
-                    result = environment.step("look")
-                elif tool_name == "open":
-                    obj = tool_args.get("object", "")
-                    result = environment.step(f"open {obj}")
-                elif tool_name == "close":
-                    obj = tool_args.get("object", "")
-                    result = environment.step(f"close {obj}")
-                elif tool_name == "put":
-                    obj = tool_args.get("object", "")
-                    container = tool_args.get("container", "")
-                    result = environment.step(f"put {obj} in {container}")
-                else:
-                    # Default to look if the tool is not recognized
-                    print(f"Unrecognized tool: {tool_name}, defaulting to look")
-                    result = environment.step("look")
+                logger.debug("Falling back to direct environment calls")
+                result = environment.step(action)
         except Exception as e:
             # Handle any errors that occur during tool execution
-            print(f"Error executing tool {tool_name}: {e}")
-            result = {
-                "observation": f"Error executing tool {tool_name}: {e}",
-                "score": state["score"],
-                "done": state["done"],
-                "moves": state["moves"] + 1,
-                "valid_actions": state["valid_actions"],
-                "inventory": state["inventory"],
-                "location": state["location"]
-            }
+            logger.warning("Error executing tool %s: %s", tool_name, e)
+            result = _failed_result(f"Error executing tool {tool_name}: {e}", current)
         
-        # Update the state with the action result
-        state["action"] = action
-        state["observation"] = result["observation"]
-        state["score"] = result["score"]
-        state["done"] = result["done"]
-        state["moves"] = result["moves"]
-        state["valid_actions"] = result["valid_actions"]
-        state["inventory"] = result["inventory"]
-        state["location"] = result["location"]
-        state["tool_result"] = result["observation"]
+        return action, result
+    
+    def execute_read_only_batch(
+        tool_calls: List[Dict[str, Any]],
+        current: Dict[str, Any]
+    ) -> Optional[List[Tuple[str, Dict[str, Any]]]]:
+        """
+        Execute several read-only tool calls in a single MCP round trip.
+        
+        Args:
+            tool_calls: The tool calls to execute
+            current: The current game state, used if the batch fails
+            
+        Returns:
+            A list of (action, result) tuples in call order, a single
+            (action, result) tuple for the whole batch if it failed, or None
+            if the calls cannot be batched and should be executed one at a time
+        """
+        if (len(tool_calls) < 2 or not HAS_MCP or not hasattr(environment, 'server_name')
+                or any(call["tool"] not in _READ_ONLY_TOOLS for call in tool_calls)):
+            return None
+        
+        calls = [(call["tool"], call["args"] or {}) for call in tool_calls]
+        actions = [_TOOL_COMMANDS[name].format_map(defaultdict(str, args)) for name, args in calls]
+        try:
+            logger.debug("Using MCP to execute tools in one batch: %s", [name for name, _ in calls])
+            results = use_mcp_tools(environment.server_name, calls)
+        except Exception as e:
+            # A failed batch stops the MCP client, so running the calls one at
+            # a time would start a new game rather than repeat them; report
+            # the failure for this step instead
+            logger.warning("Error executing tool batch: %s", e)
+            return [("; ".join(actions), _failed_result(f"Error executing tool batch: {e}", current))]
         
-        return state
+        return list(zip(actions, results))
+    
+    def act(state: AgentState) -> Dict[str, Any]:
+        """
+        Execute the selected tools.
+        
+        Args:
+            state: The current state
+            
+        Returns:
+            The state fields to update: the action and the new game state
+        """
+        nonlocal tool_executor
+        logger.debug("In act node")
+        # Get the selected tool calls, falling back to the single selected tool
+        tool_calls = state.get("tool_calls") or [
+            {"tool": state["tool_name"], "args": state["tool_args"] or {}}
+        ]
+        
+        # Wait for the calls already started while the LLM response was streaming
+        executed = [future.result() for future in prefetched]
+        prefetched.clear()
+        if tool_executor is not None:
+            tool_executor.shutdown()
+            tool_executor = None
+        
+        # Execute the rest in order, batching them if they are all read-only
+        remaining = tool_calls[len(executed):]
+        result = executed[-1][1] if executed else state
+        batch = execute_read_only_batch(remaining, result)
+        if batch is not None:
+            executed.extend(batch)
+        else:
+            for call in remaining:
+                action, result = execute_tool(call["tool"], call["args"] or {}, result)
+                executed.append((action, result))
+        result = executed[-1][1]
+        
+        # Only the action result and game state change; the decision fields
+        # from think are left as they are
+        observation = "\n\n".join(result["observation"] for _, result in executed)
+        return {
+            "action": "; ".join(action for action, _ in executed),
+            "observation": observation,
+            "score": result["score"],
+            "done": result["done"],
+            "moves": result["moves"],
+            "valid_actions": result["valid_actions"],
+            "inventory": result["inventory"],
+            "location": result["location"],
+            "tool_result": observation
+        }
     
-    # Keep track of action history to detect loops
-    action_history = []
+    # The last action and how many times in a row it was selected, to detect loops
+    last_action: Optional[Tuple[Any, str]] = None
+    repeat_count = 0
     
     def should_continue(state: AgentState) -> str:
         """
@@ -558,28 +942,28 @@ def create_agent_workflow(
         Returns:
             "continue" or "end"
         """
+        nonlocal last_action, repeat_count
         # End if the game is over or we've reached the maximum number of steps
-        print(f"Checking if should continue: done={state['done']}, moves={state['moves']}, max_steps={max_steps}")
+        logger.debug("Checking if should continue: done=%s, moves=%s, max_steps=%s",
+                     state["done"], state["moves"], max_steps)
         if state["done"] or state["moves"] >= max_steps:
-            print("Ending workflow")
+            logger.debug("Ending workflow")
             return "end"
         
-        # Check for action loops (always enabled)
-        nonlocal action_history
-        current_action = (state["tool_name"], str(state["tool_args"]))
-        action_history.append(current_action)
-        
         # Check if the same action has been repeated 3 times in a row
-        if len(action_history) >= 3:
-            last_three = action_history[-3:]
-            if last_three.count(current_action) == 3:
-                print("Detected action loop, ending workflow")
-                return "end"
-        
-        # Limit action history to last 10 actions to save memory
-        action_history = action_history[-10:]
-        
-        print("Continuing workflow")
+        # (always enabled)
+        current_action = (state["tool_name"], str(state["tool_args"]))
+        repeat_count = repeat_count + 1 if current_action == last_action else 1
+        last_action = current_action
+        if repeat_count >= 3:
+            logger.info("Detected action loop, ending workflow")
+            return "end"
+        # Ask the LLM afresh after a repeat, rather than replaying a cached
+        # decision into the loop
+        if repeat_count >= 2:
+            decision_cache.pop(_state_key(state), None)
+
+        logger.debug("Continuing workflow")
         return "continue"
     
     # Create the workflow graph
@@ -587,19 +971,18 @@ def create_agent_workflow(
     
     # Add the nodes
     workflow.add_node("observe", observe)
-    workflow.add_node("think", think)
-    workflow.add_node("select_tool", select_tool)
+    workflow.add_node("think", RunnableLambda(think, afunc=athink))
     workflow.add_node("act", act)
     
-    # Add the edges
+    # Add the edges; observe only runs on entry, since act already stores
+    # the new observation in the state
     workflow.add_edge("observe", "think")
-    workflow.add_edge("think", "select_tool")
-    workflow.add_edge("select_tool", "act")
+    workflow.add_edge("think", "act")
     workflow.add_conditional_edges(
         "act",
         should_continue,
         {
-            "continue": "observe",
+            "continue": "think",
             "end": END
         }
     )
@@ -623,12 +1006,133 @@ def create_agent_workflow(
         "valid_actions": [],
         "tool_name": None,
         "tool_args": None,
+        "tool_calls": None,
         "tool_result": None
     })
     
     return workflow, initial_state
 
 
+def _append_jsonl(path: str, record: Dict[str, Any]) -> None:
+    """
+    Append a record to a JSONL results file and flush it to disk.
+    
+    Args:
+        path: The path of the JSONL file
+        record: The record to append
+    """
+    with open(path, "a") as fh:
+        fh.write(json.dumps(record, default=str) + "\n")
+        fh.flush()
+
+
+def _step_record(episode_id: int, attempt: int, state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Create the JSONL record for a completed step.
+    
+    Args:
+        episode_id: The episode the step belongs to
+        attempt: The attempt at the episode the step belongs to
+        state: The state after the act node
+        
+    Returns:
+        The step record
+    """
+    return {
+        "episode": episode_id,
+        "attempt": attempt,
+        "move": state["moves"],
+        "action": state["action"],
+        "observation": state["observation"],
+        "score": state["score"],
+        "done": state["done"]
+    }
+
+
+def _final_record(episode_id: int, attempt: int, state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Create the JSONL record marking an episode as complete.
+    
+    Args:
+        episode_id: The completed episode
+        attempt: The attempt that completed the episode
+        state: The final state of the episode
+        
+    Returns:
+        The final record
+    """
+    return {
+        "episode": episode_id,
+        "attempt": attempt,
+        "final": True,
+        "score": state["score"],
+        "moves": state["moves"],
+        "done": state["done"],
+        "inventory": state["inventory"],
+        "location": state["location"]
+    }
+
+
+def _read_jsonl(path: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Load the records of a JSONL results file.
+    
+    Args:
+        path: The path of the JSONL file, or None
+        
+    Returns:
+        The records, or an empty list if there is no file
+    """
+    records = []
+    if not path or not os.path.exists(path):
+        return records
+    
+    with open(path) as fh:
+        for line in fh:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Ignore a line truncated by an interrupted write
+                continue
+    return records
+
+
+def _completed_episodes(path: Optional[str]) -> Dict[int, Dict[str, Any]]:
+    """
+    Load the final records of the episodes already completed in a JSONL file.
+    
+    Args:
+        path: The path of the JSONL file, or None
+        
+    Returns:
+        A dictionary mapping episode ids to their final records
+    """
+    return {
+        record["episode"]: record for record in _read_jsonl(path) if record.get("final")
+    }
+
+
+def _next_attempt(path: Optional[str], episode_id: int) -> int:
+    """
+    Number the next attempt at an episode in a JSONL file.
+    
+    An interrupted episode leaves step records behind, so a rerun tags its
+    records with a new attempt number to keep the two runs apart.
+    
+    Args:
+        path: The path of the JSONL file, or None
+        episode_id: The id of the episode
+        
+    Returns:
+        1 for a new episode, otherwise one more than the last recorded attempt
+    """
+    return 1 + max(
+        (record.get("attempt", 1) for record in _read_jsonl(path)
+         if record.get("episode") == episode_id),
+        default=0
+    )
+
+
 def run_agent_workflow(
     environment: Any,
     model_name: str = "gpt-3.5-turbo",
@@ -636,7 +1140,10 @@ def run_agent_workflow(
     max_steps: int = 20,
     recursion_limit: int = 100,
     enable_langsmith: bool = False,
-    langsmith_project: Optional[str] = None
+    langsmith_project: Optional[str] = None,
+    temperature: Optional[float] = None,
+    output_jsonl: Optional[str] = None,
+    episode_id: int = 0
 ) -> None:
     """
     Run the agent workflow.
@@ -649,13 +1156,23 @@ def run_agent_workflow(
         recursion_limit: Maximum recursion depth for the LangGraph workflow
         enable_langsmith: Whether to enable LangSmith tracing
         langsmith_project: LangSmith project name
+        temperature: The sampling temperature (None uses the provider default)
+        output_jsonl: Path of a JSONL file each step and the final result are
+            appended to; an episode already completed in it is skipped
+        episode_id: The id of this episode in output_jsonl
     """
+    if episode_id in _completed_episodes(output_jsonl):
+        logger.info("Episode %s already completed in %s, skipping", episode_id, output_jsonl)
+        return
+    attempt = _next_attempt(output_jsonl, episode_id)
+    
     # Create the workflow
     workflow, initial_state = create_agent_workflow(
         environment=environment,
         model_name=model_name,
         api_key=api_key,
-        max_steps=max_steps
+        max_steps=max_steps,
+        temperature=temperature
     )
     
     # Set up LangSmith tracing if enabled
@@ -668,8 +1185,8 @@ def run_agent_workflow(
             # Get the LangSmith API key from environment variables
             langsmith_api_key = os.environ.get("LANGSMITH_API_KEY")
             if not langsmith_api_key:
-                print("Warning: LANGSMITH_API_KEY not found in environment variables.")
-                print("LangSmith tracing may not work correctly.")
+                logger.warning("LANGSMITH_API_KEY not found in environment variables; "
+                               "LangSmith tracing may not work correctly.")
             
             # Set up the LangSmith client
             client = Client(
@@ -681,60 +1198,171 @@ def run_agent_workflow(
             # Ensure LANGSMITH_TRACING is set
             os.environ["LANGSMITH_TRACING"] = "true"
             
-            print(f"LangSmith tracing enabled. Project: {langsmith_project or 'default'}")
+            logger.info("LangSmith tracing enabled. Project: %s", langsmith_project or "default")
         except ImportError:
-            print("Warning: LangSmith tracing requested but langsmith package not installed.")
-            print("Install with: pip install langsmith")
+            logger.warning("LangSmith tracing requested but langsmith package not installed. "
+                           "Install with: pip install langsmith")
         except Exception as e:
-            print(f"Warning: Failed to initialize LangSmith tracing: {e}")
-            print("Make sure LANGSMITH_API_KEY is set in your environment.")
+            logger.warning("Failed to initialize LangSmith tracing: %s. "
+                           "Make sure LANGSMITH_API_KEY is set in your environment.", e)
     
     # Run the workflow
-    print("Starting workflow...")
+    logger.info("Starting workflow...")
     # Create a config dictionary with the recursion limit and callbacks
     config = {
         "recursion_limit": recursion_limit,
         "callbacks": callbacks if callbacks else None
     }
-    for i, state in enumerate(workflow.stream(initial_state, config=config)):
-        node = state.get("__metadata__", {}).get("name", "")
-        print(f"Processing node: {node}")
+    # Nodes only return the fields they change, so merge their updates to
+    # track the full state; after the last act node it is the final state
+    state = dict(initial_state)
+    for event in workflow.stream(initial_state, config=config):
+        node, update = next(iter(event.items()))
+        logger.debug("Processing node: %s", node)
+        state.update(update)
         
         if node == "act":
-            # Print the step information
-            print("\n" + "="*60)
-            print(f"STEP {state['moves']}")
-            print("="*60)
-            
-            # Print the thought
-            print("Thought:", state["thought"])
-            
-            # Print the tool selection
-            print(f"Tool: {state['tool_name']}")
-            print(f"Args: {state['tool_args']}")
+            if output_jsonl:
+                _append_jsonl(output_jsonl, _step_record(episode_id, attempt, state))
             
-            # Print the action
-            print("Action:", state["action"])
-            
-            # Print the observation
-            print("Observation:", state["observation"])
-            
-            # Print the game state
-            print(f"Location: {state['location']}")
-            print(f"Score: {state['score']}")
-            print(f"Moves: {state['moves']}")
-            print(f"Inventory: {state['inventory']}")
-    
-    # Get the final state directly from the environment
-    env_state = environment.step("look")
-    
-    # Print the final stats
-    print("\n" + "="*60)
-    print("FINAL STATS")
-    print("="*60)
-    
-    # Use the environment's state for the final stats, but subtract 1 from moves
-    # because we added an extra "look" action to get the final state
-    print(f"Steps: {env_state['moves'] - 1}")
-    print(f"Score: {env_state['score']}")
-    print(f"Inventory: {env_state['inventory']}")
+            # Log the step information
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "\n%s\nSTEP %s\n%s\nThought: %s\nTool: %s\nArgs: %s\nAction: %s\n"
+                    "Observation: %s\nLocation: %s\nScore: %s\nMoves: %s\nInventory: %s",
+                    "="*60, state["moves"], "="*60, state["thought"],
+                    state["tool_name"], state["tool_args"], state["action"],
+                    state["observation"], state["location"], state["score"],
+                    state["moves"], state["inventory"]
+                )
+    
+    # Log the final stats from the last step's state
+    logger.info(
+        "\n%s\nFINAL STATS\n%s\nSteps: %s\nScore: %s\nInventory: %s",
+        "="*60, "="*60, state["moves"], state["score"], state["inventory"]
+    )
+    
+    if output_jsonl:
+        _append_jsonl(output_jsonl, _final_record(episode_id, attempt, state))
+
+
+async def arun_agent_workflow(
+    environment: Any,
+    model_name: str = "gpt-3.5-turbo",
+    api_key: Optional[str] = None,
+    max_steps: int = 20,
+    recursion_limit: int = 100,
+    temperature: Optional[float] = None,
+    output_jsonl: Optional[str] = None,
+    episode_id: int = 0
+) -> Dict[str, Any]:
+    """
+    Run the agent workflow asynchronously for a single episode.
+    
+    Args:
+        environment: The environment to interact with
+        model_name: The name of the LLM model to use
+        api_key: The API key for the LLM provider
+        max_steps: Maximum number of steps to run
+        recursion_limit: Maximum recursion depth for the LangGraph workflow
+        temperature: The sampling temperature (None uses the provider default)
+        output_jsonl: Path of a JSONL file each step and the final result are
+            appended to; an episode already completed in it is skipped
+        episode_id: The id of this episode in output_jsonl
+        
+    Returns:
+        The final state of the episode, or its final record from
+        output_jsonl if it was already completed
+    """
+    completed = _completed_episodes(output_jsonl)
+    if episode_id in completed:
+        logger.info("Episode %s already completed in %s, skipping", episode_id, output_jsonl)
+        return completed[episode_id]
+    
+    workflow, initial_state = create_agent_workflow(
+        environment=environment,
+        model_name=model_name,
+        api_key=api_key,
+        max_steps=max_steps,
+        temperature=temperature
+    )
+    config = {"recursion_limit": recursion_limit}
+    if not output_jsonl:
+        return await workflow.ainvoke(initial_state, config=config)
+    
+    # Stream the run so each step is on disk before the next one starts
+    attempt = _next_attempt(output_jsonl, episode_id)
+    state = initial_state
+    async for mode, chunk in workflow.astream(
+        initial_state, config=config, stream_mode=["updates", "values"]
+    ):
+        if mode == "values":
+            state = chunk
+        elif "act" in chunk:
+            _append_jsonl(output_jsonl, _step_record(episode_id, attempt, chunk["act"]))
+    
+    _append_jsonl(output_jsonl, _final_record(episode_id, attempt, state))
+    return state
+
+
+async def run_batch(
+    envs: List[Any],
+    model_name: str = "gpt-3.5-turbo",
+    api_key: Optional[str] = None,
+    max_steps: int = 20,
+    recursion_limit: int = 100,
+    max_concurrency: int = 4,
+    temperature: Optional[float] = None,
+    output_jsonl: Optional[str] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Run one episode per environment concurrently.
+    
+    The environments must be independent of each other (e.g. separate
+    MockZorkEnvironment instances); the MCP client shares a single game.
+    A failed episode is recorded as None without stopping the others.
+    
+    Args:
+        envs: The environments to run the agent in
+        model_name: The name of the LLM model to use
+        api_key: The API key for the LLM provider
+        max_steps: Maximum number of steps to run per episode
+        recursion_limit: Maximum recursion depth for the LangGraph workflow
+        max_concurrency: Maximum number of episodes in flight at once, to
+            respect the provider's rate limits
+        temperature: The sampling temperature (None uses the provider default)
+        output_jsonl: Path of a JSONL file each step and final result are
+            appended to; episodes already completed in it are not rerun, so
+            an interrupted batch resumes where it stopped
+        
+    Returns:
+        The final state of each episode, in the same order as envs, or
+        None for episodes that failed; resumed episodes return their
+        final record from output_jsonl
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    completed = _completed_episodes(output_jsonl)
+    if completed:
+        logger.info("Resuming batch: %s episodes already completed", len(completed))
+    
+    async def run_one(episode_id: int, environment: Any) -> Optional[Dict[str, Any]]:
+        if episode_id in completed:
+            return completed[episode_id]
+        
+        async with semaphore:
+            try:
+                return await arun_agent_workflow(
+                    environment,
+                    model_name=model_name,
+                    api_key=api_key,
+                    max_steps=max_steps,
+                    recursion_limit=recursion_limit,
+                    temperature=temperature,
+                    output_jsonl=output_jsonl,
+                    episode_id=episode_id
+                )
+            except Exception as e:
+                logger.warning("Error running episode %s: %s", episode_id, e)
+                return None
+    
+    return await asyncio.gather(*[run_one(i, env) for i, env in enumerate(envs)])
@@ -0,0 +1,45 @@
+"""
+Logging configuration for the Zork AI agent scripts.
+
+This module sets up console logging for the agent scripts. Interactive runs
+see each record as soon as it is logged; when stdout is redirected, per-step
+output is buffered so that the agent workflows do not block on writes.
+"""
+import logging
+import logging.handlers
+import sys
+
+
+def configure_logging(level: int = logging.INFO, capacity: int = 100) -> None:
+    """
+    Send log records to stdout, buffering them when stdout is not a terminal.
+    
+    On a terminal, records are written immediately so they appear with the
+    step they belong to and in order with printed output. Otherwise they are
+    written in batches of up to `capacity`, or immediately for warnings and
+    errors, and any buffered records are flushed at exit.
+    
+    Args:
+        level: The minimum level of records to log
+        capacity: The number of records buffered before they are written
+            when stdout is not a terminal
+    """
+    handler: logging.Handler = logging.StreamHandler(sys.stdout)
+    if not sys.stdout.isatty():
+        handler = logging.handlers.MemoryHandler(
+            capacity=capacity,
+            flushLevel=logging.WARNING,
+            target=handler
+        )
+    logging.basicConfig(level=level, format="%(message)s", handlers=[handler])
+
+
+def flush_logging() -> None:
+    """
+    Write out any buffered log records.
+    
+    Call this before printing directly to stdout, so the printed text comes
+    after the records logged before it.
+    """
+    for handler in logging.getLogger().handlers:
+        handler.flush()
@@ -8,7 +8,7 @@ import json
 import subprocess
 import threading
 import time
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 
 class MCPClient:
@@ -148,6 +148,73 @@ class MCPClient:
             print(f"Error calling tool {tool_name}: {e}")
             return None
     
+    def call_tools(self, calls: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Call several tools on the MCP server in one round trip.
+        
+        All requests are written before any response is read, so the server
+        can handle them back to back. Responses are matched to requests by ID.
+        
+        Args:
+            calls: A list of (tool_name, arguments) tuples
+            
+        Returns:
+            The result of each tool call in the same order, or None for calls
+            where an error occurred
+        """
+        if not self.process:
+            print("MCP server not started")
+            return [None] * len(calls)
+        
+        # Create the requests
+        requests = []
+        for tool_name, arguments in calls:
+            self.request_id += 1
+            requests.append({
+                "jsonrpc": "2.0",
+                "id": self.request_id,
+                "method": "tools/call",
+                "params": {
+                    "name": tool_name,
+                    "arguments": arguments or {}
+                }
+            })
+        
+        # Debug
+        if self.debug:
+            for request in requests:
+                print(f"Sending request: {json.dumps(request)}")
+        
+        results = {}
+        try:
+            # Send the requests
+            self.process.stdin.write("".join(json.dumps(request) + "\n" for request in requests))
+            self.process.stdin.flush()
+            
+            # Read the responses
+            for _ in requests:
+                response = self.process.stdout.readline()
+                
+                # Debug
+                if self.debug:
+                    print(f"Received response: {response}")
+                
+                # Parse the response
+                try:
+                    response_json = json.loads(response)
+                except json.JSONDecodeError:
+                    print(f"Error decoding response: {response}")
+                    continue
+                if "result" in response_json:
+                    results[response_json.get("id")] = response_json["result"]
+                else:
+                    error = response_json.get("error", {"code": -1, "message": "Unknown error"})
+                    print(f"Error calling tool: {error}")
+        except Exception as e:
+            print(f"Error calling tools: {e}")
+        
+        return [results.get(request["id"]) for request in requests]
+    
     def list_tools(self) -> Optional[List[Dict[str, Any]]]:
         """
         List the available tools on the MCP server.
@@ -243,10 +310,17 @@ def get_mcp_client(server_name: str = "zork-tools", debug: bool = False) -> MCPC
     
     return _mcp_client
 
+# Tool lists by server name, with the time they were fetched
+_TOOLS_CACHE_TTL = 60  # seconds
+_tools_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+
 def get_mcp_tools(server_name: str = "zork-tools", debug: bool = False) -> List[Dict[str, Any]]:
     """
     Get the available tools from the MCP server.
     
+    Successful results are cached for _TOOLS_CACHE_TTL seconds, so agents
+    created in the same process do not list the tools again.
+    
     Args:
         server_name: The name of the MCP server to use
         debug: Whether to print debug information
@@ -254,6 +328,11 @@ def get_mcp_tools(server_name: str = "zork-tools", debug: bool = False) -> List[
     Returns:
         A list of available tools with their descriptions and parameters
     """
+    # Reuse a recent tool list; the tools do not change while the server runs
+    cached = _tools_cache.get(server_name)
+    if cached is not None and time.monotonic() - cached[0] < _TOOLS_CACHE_TTL:
+        return cached[1]
+    
     try:
         client = get_mcp_client(server_name, debug)
         
@@ -266,6 +345,7 @@ def get_mcp_tools(server_name: str = "zork-tools", debug: bool = False) -> List[
             print("!"*80 + "\n")
             return []
         
+        _tools_cache[server_name] = (time.monotonic(), tools)
         return tools
     except Exception as e:
         print("\n" + "!"*80)
@@ -275,6 +355,40 @@ def get_mcp_tools(server_name: str = "zork-tools", debug: bool = False) -> List[
         print("!"*80 + "\n")
         return []
 
+def _to_step_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert an MCP tool result to the format expected by the agent.
+    
+    The agent expects a result with observation, score, done, moves, etc.
+    
+    Args:
+        result: The result of the MCP tool call
+        
+    Returns:
+        A result that matches the environment.step() return value
+    """
+    observation = ""
+    for content_item in result.get("content", []):
+        if content_item.get("type") == "text":
+            observation += content_item.get("text", "")
+    
+    # Extract structured data if available
+    structured_data = {}
+    for content_item in result.get("content", []):
+        if content_item.get("type") == "json":
+            structured_data = content_item.get("json", {})
+    
+    # Create a result object that matches the environment.step() return value
+    return {
+        "observation": observation,
+        "score": structured_data.get("score", 0),
+        "done": structured_data.get("done", False),
+        "moves": structured_data.get("moves", 0),
+        "valid_actions": structured_data.get("valid_actions", []),
+        "inventory": structured_data.get("inventory", []),
+        "location": structured_data.get("location", "")
+    }
+
 def use_mcp_tool(server_name: str, tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
     """
     Use an MCP tool directly.
@@ -314,28 +428,7 @@ def use_mcp_tool(server_name: str, tool_name: str, args: Dict[str, Any]) -> Dict
             raise Exception(f"Error calling tool {tool_name}: No result")
         
         # Convert the MCP result to the format expected by the agent
-        # The agent expects a result with observation, score, done, moves, etc.
-        observation = ""
-        for content_item in result.get("content", []):
-            if content_item.get("type") == "text":
-                observation += content_item.get("text", "")
-        
-        # Extract structured data if available
-        structured_data = {}
-        for content_item in result.get("content", []):
-            if content_item.get("type") == "json":
-                structured_data = content_item.get("json", {})
-        
-        # Create a result object that matches the environment.step() return value
-        return {
-            "observation": observation,
-            "score": structured_data.get("score", 0),
-            "done": structured_data.get("done", False),
-            "moves": structured_data.get("moves", 0),
-            "valid_actions": structured_data.get("valid_actions", []),
-            "inventory": structured_data.get("inventory", []),
-            "location": structured_data.get("location", "")
-        }
+        return _to_step_result(result)
     except Exception as e:
         # If there's an error, clean up the client and re-raise the exception
         print("\n" + "!"*80)
@@ -350,6 +443,42 @@ def use_mcp_tool(server_name: str, tool_name: str, args: Dict[str, Any]) -> Dict
         raise
 
 
+def use_mcp_tools(server_name: str,
+                  calls: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Use several independent MCP tools in one round trip.
+    
+    This is like use_mcp_tool, but sends all the calls to the server before
+    waiting for any result.
+    
+    Args:
+        server_name: The name of the MCP server to use
+        calls: A list of (tool_name, args) tuples
+        
+    Returns:
+        The result of each tool execution, in the same order
+    """
+    global _mcp_client
+    
+    client = get_mcp_client(server_name)
+    results = client.call_tools(calls)
+    
+    failed = [tool_name for (tool_name, _), result in zip(calls, results) if not result]
+    if failed:
+        print("\n" + "!"*80)
+        print(f"! ERROR: Failed to call tools {failed}: No result returned")
+        print("! This may indicate a problem with the server or the tool implementation.")
+        print("!"*80 + "\n")
+        
+        # Clean up the client, as use_mcp_tool does
+        if _mcp_client is not None:
+            _mcp_client.stop()
+            _mcp_client = None
+        raise Exception(f"Error calling tools {failed}: No result")
+    
+    return [_to_step_result(result) for result in results]
+
+
 def main():
     """
     Main function for testing the MCP client.
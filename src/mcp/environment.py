@@ -4,10 +4,14 @@ MCP Environment Wrapper for Zork.
 This module provides a wrapper for MCP tools to provide an environment-like interface
 that matches the MockZorkEnvironment interface.
 """
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import json
+import re
 
-from src.mcp.client import create_zork_client
+from src.mcp.client import MCPClient, create_zork_client
+
+# Observations that end the game
+_GAME_OVER_RE = re.compile(r"you have died|game over", re.IGNORECASE)
 
 
 class MCPEnvironmentWrapper:
@@ -46,8 +50,8 @@ class MCPEnvironmentWrapper:
         """
         # Call the look tool to get the initial state
         try:
-            # Call the look tool
-            result = self._use_mcp_tool("look", {})
+            # Call the look tool and get the inventory in one round trip
+            result, inv_result = self._use_mcp_tools([("look", {}), ("inventory", {})])
             
             # Extract the observation
             observation = ""
@@ -56,7 +60,6 @@ class MCPEnvironmentWrapper:
                     observation += content_item.get("text", "")
             
             # Get the inventory
-            inv_result = self._use_mcp_tool("inventory", {})
             inventory = []
             for content_item in inv_result.get("content", []):
                 if content_item.get("type") == "json" and "items" in content_item.get("json", {}):
@@ -122,7 +125,7 @@ class MCPEnvironmentWrapper:
             self._update_state(tool_name, result)
             
             # Check for game completion
-            if "you have died" in observation.lower() or "game over" in observation.lower():
+            if _GAME_OVER_RE.search(observation):
                 self.done = True
             
             return {
@@ -272,6 +275,37 @@ class MCPEnvironmentWrapper:
         
         return valid_actions
     
+    def _get_client(self) -> MCPClient:
+        """
+        Get the MCP client, creating and starting it if it doesn't exist.
+        
+        Returns:
+            The MCP client
+        """
+        if self._client is None:
+            self._client = create_zork_client(debug=self.debug)
+            if not self._client.start():
+                raise Exception(f"Failed to start MCP server: {self.server_name}")
+        return self._client
+    
+    def _use_mcp_tools(self, calls: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Use several independent MCP tools in one round trip.
+        
+        Args:
+            calls: A list of (tool_name, args) tuples
+            
+        Returns:
+            The result of each tool execution, in the same order
+        """
+        results = self._get_client().call_tools(calls)
+        
+        failed = [tool_name for (tool_name, _), result in zip(calls, results) if not result]
+        if failed:
+            raise Exception(f"Error calling tools {failed}: No result")
+        
+        return results
+    
     def _use_mcp_tool(self, tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
         """
         Use an MCP tool.
@@ -284,10 +318,7 @@ class MCPEnvironmentWrapper:
             The result of the tool execution
         """
         # Create the client if it doesn't exist
-        if self._client is None:
-            self._client = create_zork_client(debug=self.debug)
-            if not self._client.start():
-                raise Exception(f"Failed to start MCP server: {self.server_name}")
+        self._get_client()
         
         # Call the tool
         result = self._client.call_tool(tool_name, args)
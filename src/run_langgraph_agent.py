@@ -7,6 +7,7 @@ demonstrating a more sophisticated agent architecture with observe-think-act loo
 import argparse
 import os
 from dotenv import load_dotenv
+from src.logging_utils import configure_logging, flush_logging
 from src.mock_environment import MockZorkEnvironment
 from src.agent.langgraph.workflow import run_agent_workflow
 
@@ -54,6 +55,7 @@ def main():
         help="LangSmith project name (defaults to LANGSMITH_PROJECT env var)"
     )
     args = parser.parse_args()
+    configure_logging()
     
     print("\n" + "="*60)
     print("ZORK AI AGENT WITH LANGGRAPH WORKFLOW")
@@ -84,6 +86,7 @@ def main():
             langsmith_project=args.langsmith_project
         )
     except KeyboardInterrupt:
+        flush_logging()
         print("\nAgent stopped by user.")
 
 
@@ -6,6 +6,8 @@ The agent follows a deliberative process: first thinking about what to do,
 then selecting an action based on that thought.
 """
 import argparse
+import logging
+from src.logging_utils import configure_logging
 from src.agent.mcp.agent import run_agent
 
 
@@ -37,16 +39,23 @@ def main():
     parser.add_argument(
         "--debug",
         action="store_true",
-        help="Print debug information"
+        help="Print the game state before each step and pause between steps"
+    )
+    parser.add_argument(
+        "--cache-path",
+        type=str,
+        help="Cache decisions in this file so replays of the same game states skip the LLM"
     )
     args = parser.parse_args()
+    configure_logging(level=logging.DEBUG if args.debug else logging.INFO)
     
     # Run the agent
     run_agent(
         model_name=args.model,
         api_key=args.api_key,
         max_steps=args.max_steps,
-        debug=args.debug
+        debug=args.debug,
+        cache_path=args.cache_path
     )
 
 
@@ -9,6 +9,7 @@ fall back to the mock environment if needed.
 import argparse
 import os
 from dotenv import load_dotenv
+from src.logging_utils import configure_logging, flush_logging
 from src.mock_environment import MockZorkEnvironment
 from src.mcp.environment import create_environment
 from src.agent.mcp_langgraph.workflow import run_agent_workflow
@@ -78,7 +79,13 @@ def main():
         default=os.environ.get("LANGSMITH_PROJECT"),
         help="LangSmith project name (defaults to LANGSMITH_PROJECT env var)"
     )
+    parser.add_argument(
+        "--output-jsonl",
+        type=str,
+        help="Append each step and the final result to this JSONL file"
+    )
     args = parser.parse_args()
+    configure_logging()
     
     print("\n" + "="*60)
     print("ZORK AI AGENT WITH MCP LANGGRAPH WORKFLOW")
@@ -118,9 +125,11 @@ def main():
             max_steps=args.max_steps,
             recursion_limit=args.recursion_limit,
             enable_langsmith=args.enable_langsmith,
-            langsmith_project=args.langsmith_project
+            langsmith_project=args.langsmith_project,
+            output_jsonl=args.output_jsonl
         )
     except KeyboardInterrupt:
+        flush_logging()
         print("\nAgent stopped by user.")
 
 
@@ -6,6 +6,7 @@ LangGraph, MCP LangGraph, or Deliberative.
 """
 import argparse
 from dotenv import load_dotenv
+from src.logging_utils import configure_logging, flush_logging
 from src.mock_environment import MockZorkEnvironment
 from src.mcp.environment import create_environment
 from src.agent.langgraph.workflow import run_agent_workflow as run_langgraph_workflow
@@ -71,6 +72,7 @@ def main():
         help="Print debug information"
     )
     args = parser.parse_args()
+    configure_logging()
     
     # Handle the MCP agent separately since it manages its own environment
     if args.agent_type == "mcp":
@@ -130,6 +132,7 @@ def main():
                 max_steps=args.max_steps
             )
     except KeyboardInterrupt:
+        flush_logging()
         print("\nAgent stopped by user.")
 
 
@@ -9,7 +9,10 @@ import sys
 # Add the src directory to the path so we can import the modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.agent.langgraph.workflow import create_agent_workflow, AgentState, run_agent_workflow
+from src.agent.llm import make_llm
+from src.agent.langgraph import workflow as workflow_module
+from src.agent.langgraph.workflow import (
+    create_agent_workflow, AgentState, run_agent_workflow, run_agent_workflows_batched)
 
 
 class TestLangGraphWorkflow(unittest.TestCase):
@@ -17,6 +20,10 @@ class TestLangGraphWorkflow(unittest.TestCase):
 
     def setUp(self):
         """Set up test fixtures."""
+        # Clear the shared LLM and compiled workflow so each test sees its own mock
+        make_llm.cache_clear()
+        workflow_module._get_app.cache_clear()
+
         # Create a mock environment
         self.mock_env = MagicMock()
         self.mock_env.reset.return_value = {
@@ -38,14 +45,15 @@ class TestLangGraphWorkflow(unittest.TestCase):
             "done": False
         }
 
-        # Create a mock LLM
+        # Create a mock LLM that returns a thought and a constrained action
         self.mock_llm = MagicMock()
-        self.mock_llm.invoke.side_effect = [
-            MagicMock(content="I should examine the test object to learn more about it."),
-            MagicMock(content="examine test")
-        ]
+        self.mock_llm.invoke.return_value = MagicMock(
+            content="I should examine the test object to learn more about it.")
+        self.mock_chooser = self.mock_llm.with_structured_output.return_value
+        self.mock_chooser.batch.side_effect = lambda prompts, **kwargs: [
+            MagicMock(action="examine test")] * len(prompts)
 
-    @patch('src.agent.langgraph.workflow.ChatOpenAI')
+    @patch('src.agent.llm.ChatOpenAI')
     def test_create_workflow(self, mock_chat_openai):
         """Test creating the workflow."""
         # Set up the mock
@@ -64,7 +72,7 @@ class TestLangGraphWorkflow(unittest.TestCase):
         app = workflow.compile()
         self.assertIsNotNone(app)
 
-    @patch('src.agent.langgraph.workflow.ChatOpenAI')
+    @patch('src.agent.llm.ChatOpenAI')
     def test_observe_node(self, mock_chat_openai):
         """Test the observe node."""
         # Set up the mock
@@ -97,10 +105,91 @@ class TestLangGraphWorkflow(unittest.TestCase):
         self.assertIsNotNone(result.get("thought"))
         self.assertIsNotNone(result.get("action"))
         
-        # Assert that the LLM was called twice (once for thought, once for action)
-        self.assertEqual(self.mock_llm.invoke.call_count, 2)
+        # Assert that the LLM was called once for the thought and once for the action
+        self.assertEqual(self.mock_llm.invoke.call_count, 1)
+        self.assertEqual(self.mock_chooser.batch.call_count, 1)
+        
+        # Assert that the action schema only accepts the valid actions
+        schema = self.mock_llm.with_structured_output.call_args.args[0]
+        self.assertEqual(schema(action="go north").action, "go north")
+        self.assertEqual(schema(action=" Go North").action, "go north")
+        with self.assertRaises(ValueError):
+            schema(action="fly")
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_history_is_bounded(self, mock_chat_openai):
+        """Test that the observe node appends to a bounded history."""
+        # Set up the mock
+        mock_chat_openai.return_value = self.mock_llm
+
+        # Create a state whose history is already full
+        history = [{"observation": f"Turn {i}"} for i in range(32)]
+        state = AgentState(
+            observation="You are in a test room.",
+            valid_actions=["look", "go north", "examine test"],
+            inventory=[],
+            location="test_room",
+            thought=None,
+            action="go north",
+            history=history,
+            score=0,
+            moves=0,
+            done=False
+        )
+        
+        # Run the workflow
+        result = create_agent_workflow().compile().invoke(state)
+        
+        # Assert that the newest observation replaced the oldest one
+        self.assertEqual(len(result["history"]), 32)
+        self.assertEqual(result["history"][0]["observation"], "Turn 1")
+        self.assertEqual(result["history"][-1]["observation"], "You are in a test room.")
+        self.assertEqual(result["history"][-1]["action"], "go north")
+        
+        # Assert that the recent history is sent as compact JSON
+        prompt = self.mock_llm.invoke.call_args.args[0]
+        self.assertIn('{"observation":"Turn 31"}', prompt)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_repeated_observation_is_referenced(self, mock_chat_openai):
+        """Test that repeated observations only refer to moves shown in the prompt."""
+        # Set up the mock
+        mock_chat_openai.return_value = self.mock_llm
+        app = create_agent_workflow().compile()
+
+        # Observe the same room for several moves
+        state = AgentState(
+            observation="You are in a test room.",
+            valid_actions=["look", "go north", "examine test"],
+            inventory=[],
+            location="test_room",
+            thought=None,
+            action=None,
+            history=[],
+            score=0,
+            moves=0,
+            done=False
+        )
+        for moves in range(4):
+            state["moves"] = moves
+            state = app.invoke(state)
+        
+        # Assert that the history keeps the full text
+        self.assertEqual(
+            [item["observation"] for item in state["history"]],
+            ["You are in a test room."] * 4)
+        
+        # Assert that the prompt refers back to the oldest move it shows,
+        # not to move 0, which has left the prompt window
+        prompt = next(
+            call.args[0] for call in reversed(self.mock_llm.invoke.call_args_list)
+            if "Recent History" in call.args[0])
+        self.assertIn('"observation":"You are in a test room.","location":"test_room",'
+                      '"inventory":[],"score":0,"moves":1', prompt)
+        self.assertEqual(prompt.count('"observation":"<same as move 1>"'), 2)
+        self.assertNotIn("<same as move 0>", prompt)
 
-    @patch('src.agent.langgraph.workflow.ChatOpenAI')
+    @patch('src.agent.llm.ChatOpenAI')
     def test_run_workflow(self, mock_chat_openai):
         """Test running the workflow."""
         # Set up the mock
@@ -125,8 +214,77 @@ class TestLangGraphWorkflow(unittest.TestCase):
         self.assertEqual(result["score"], 1)
         self.assertEqual(result["moves"], 1)
         
-        # Assert that the LLM was called twice (once for thought, once for action)
-        self.assertEqual(self.mock_llm.invoke.call_count, 2)
+        # Assert that the LLM was called once for the thought and once for the action
+        self.assertEqual(self.mock_llm.invoke.call_count, 1)
+        self.assertEqual(self.mock_chooser.batch.call_count, 1)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_run_workflow_reuses_app(self, mock_chat_openai):
+        """Test that episodes with the same settings share the LLM and app."""
+        # Set up the mock
+        mock_chat_openai.return_value = self.mock_llm
+
+        # Run two episodes
+        for _ in range(2):
+            run_agent_workflow(
+                environment=self.mock_env,
+                model_name="test-model",
+                api_key="test-key",
+                max_steps=1
+            )
+        
+        # Assert that the LLM client was only created once
+        mock_chat_openai.assert_called_once()
+        self.assertEqual(self.mock_env.step.call_count, 2)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_run_workflow_follows_base_url(self, mock_chat_openai):
+        """Test that changing LLM_BASE_URL does not reuse the app for the old endpoint."""
+        # Set up the mock
+        mock_chat_openai.return_value = self.mock_llm
+
+        # Run an episode against each endpoint
+        for base_url in ("http://localhost:8000/v1", "http://localhost:8001/v1"):
+            with patch.dict(os.environ, {"LLM_BASE_URL": base_url}):
+                run_agent_workflow(
+                    environment=self.mock_env,
+                    model_name="test-model",
+                    api_key="test-key",
+                    max_steps=1
+                )
+
+        # Assert that a client was created for each endpoint
+        self.assertEqual(
+            [call.kwargs["base_url"] for call in mock_chat_openai.call_args_list],
+            ["http://localhost:8000/v1", "http://localhost:8001/v1"])
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_run_workflows_batched(self, mock_chat_openai):
+        """Test running several environments with batched LLM calls."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        self.mock_llm.batch.return_value = [
+            MagicMock(content="I should examine the test object.")] * 2
+        envs = [MagicMock(), MagicMock()]
+        for env in envs:
+            env.reset.return_value = dict(self.mock_env.reset.return_value)
+            env.step.return_value = dict(self.mock_env.step.return_value)
+        
+        # Run the environments in lockstep
+        results = run_agent_workflows_batched(
+            envs, model_name="test-model", api_key="test-key", max_steps=1)
+        
+        # Assert that one batch was sent for thoughts and one for actions
+        self.assertEqual(self.mock_llm.batch.call_count, 1)
+        self.assertEqual(len(self.mock_llm.batch.call_args.args[0]), 2)
+        self.assertEqual(self.mock_chooser.batch.call_count, 1)
+        self.assertEqual(len(self.mock_chooser.batch.call_args.args[0]), 2)
+        self.mock_llm.invoke.assert_not_called()
+        
+        # Assert that each environment was stepped with its action
+        for env, result in zip(envs, results):
+            env.step.assert_called_once_with("examine test")
+            self.assertEqual(result["score"], 1)
 
 
 if __name__ == '__main__':
@@ -4,9 +4,32 @@ Test the LLM-based planner for the Zork AI agent.
 This module tests the LLM-based planner's ability to generate actions
 based on observations and memory.
 """
+import asyncio
 import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+import httpx
+from openai import RateLimitError
 from src.agent.memory import AgentMemory
-from src.agent.llm_planner import LLMBasedPlanner
+from src.agent.llm_planner import LLMBasedPlanner, _get_limiter
+
+
+def _stream(arguments=None, content=None):
+    """Create a mock streamed response yielding the text in small chunks."""
+    text = arguments if arguments is not None else content
+    chunks = []
+    for i in range(0, len(text), 4):
+        delta = MagicMock(content=None, tool_calls=None)
+        if arguments is not None:
+            delta.tool_calls = [MagicMock()]
+            delta.tool_calls[0].function.arguments = text[i:i + 4]
+        else:
+            delta.content = text[i:i + 4]
+        chunks.append(MagicMock(choices=[MagicMock(delta=delta)]))
+    
+    stream = MagicMock()
+    stream.__aiter__.return_value = chunks
+    stream.close = AsyncMock()
+    return stream
 
 
 class TestLLMPlanner(unittest.TestCase):
@@ -84,6 +107,226 @@ class TestLLMPlanner(unittest.TestCase):
         # Check that action was added to history
         self.assertIn(action, self.planner.action_history)
 
+    def test_generate_action_with_async_client(self):
+        """Test that actions are generated through the async OpenAI client."""
+        # Mock the async client
+        planner = LLMBasedPlanner(api_key="test-key")
+        planner._aclient = MagicMock()
+        planner._aclient.chat.completions.create = AsyncMock(
+            side_effect=lambda **kwargs: _stream(arguments='{"action": "go north"}'))
+        
+        # Generate actions through the sync wrapper and the async batch
+        action = planner.generate_action("You are in a forest.", ["go north", "look"], self.memory)
+        actions = asyncio.run(planner.agenerate_action_batch([
+            ("You are in a forest.", ["go north", "look"], AgentMemory()),
+            ("You are in a clearing.", ["go north", "look"], AgentMemory())
+        ]))
+        
+        # Check that the LLM actions were used; the first batched episode has
+        # no recent actions yet, so it reuses the cached action for the forest
+        self.assertEqual(action, "go north")
+        self.assertEqual(actions, ["go north", "go north"])
+        self.assertEqual(planner._aclient.chat.completions.create.await_count, 2)
+        
+        # Check that the action was constrained to the valid actions
+        tools = planner._aclient.chat.completions.create.call_args.kwargs["tools"]
+        self.assertEqual(
+            tools[0]["function"]["parameters"]["properties"]["action"]["enum"],
+            ["go north", "look"]
+        )
+
+    def test_batch_episodes_keep_separate_history(self):
+        """Test that batched episodes do not see each other's actions."""
+        # Mock the async client to answer each episode by its location
+        planner = LLMBasedPlanner(api_key="test-key")
+        planner._aclient = MagicMock()
+        
+        def create(**kwargs):
+            prompt = kwargs["messages"][1]["content"]
+            action = "go north" if "forest" in prompt else "open door"
+            return _stream(arguments='{"action": "%s"}' % action)
+        
+        planner._aclient.chat.completions.create = AsyncMock(side_effect=create)
+        forest, house = AgentMemory(), AgentMemory()
+        forest.current_location = "forest"
+        house.current_location = "house"
+        
+        # Run two steps of two diverging episodes
+        with patch("builtins.print"):  # Suppress print output
+            for _ in range(2):
+                actions = asyncio.run(planner.agenerate_action_batch([
+                    ("You are in a forest.", ["go north", "look"], forest),
+                    ("You are in a house.", ["open door", "look"], house)
+                ]))
+        
+        # Check that each episode only remembers its own actions
+        self.assertEqual(actions, ["go north", "open door"])
+        self.assertEqual(planner._episodes[forest].action_history, ["go north", "go north"])
+        self.assertEqual(planner._episodes[house].action_history, ["open door", "open door"])
+        self.assertEqual(planner.action_history, [])
+        for call in planner._aclient.chat.completions.create.call_args_list:
+            prompt = call.kwargs["messages"][1]["content"]
+            recent_actions = prompt.split("Recent Actions:")[1].split("Valid Actions:")[0]
+            self.assertNotIn("open door" if "forest" in prompt else "go north", recent_actions)
+
+    def test_generate_actions_batch_isolates_failures(self):
+        """Test that a failed state in a batch falls back without affecting the others."""
+        planner = LLMBasedPlanner(api_key="test-key", use_cache=False)
+        planner.agenerate_action = AsyncMock(side_effect=["go north", ValueError("boom")])
+        
+        with patch("builtins.print"):  # Suppress print output
+            actions = planner.generate_actions_batch([
+                ("You are in a forest.", ["go north", "look"], AgentMemory()),
+                ("You are in a clearing.", ["look"], AgentMemory())
+            ])
+        
+        self.assertEqual(actions, ["go north", "look"])
+
+    def test_generate_actions_batch_lockstep_history(self):
+        """Test that lockstep batches keep each episode's history separate."""
+        planner = LLMBasedPlanner(use_cache=False)  # No API key: rule-based actions
+        first, second = AgentMemory(), AgentMemory()
+        
+        # Step both episodes twice; the first moves on after looking, while
+        # the second only has "look" available
+        with patch("builtins.print"):  # Suppress print output
+            for _ in range(2):
+                planner.generate_actions_batch([
+                    ("You are in a forest.", ["go north", "look"], first),
+                    ("You are in a clearing.", ["look"], second)
+                ])
+        
+        # Each episode's history only holds its own actions
+        self.assertEqual(planner._episodes[first].action_history[-1], "go north")
+        self.assertEqual(set(planner._episodes[second].action_history), {"look"})
+        self.assertEqual(planner.action_history, [])
+        planner.close()
+
+    def test_generate_action_cache(self):
+        """Test that identical game states reuse the cached action."""
+        # Mock the async client
+        planner = LLMBasedPlanner(api_key="test-key")
+        planner._aclient = MagicMock()
+        planner._aclient.chat.completions.create = AsyncMock(
+            side_effect=lambda **kwargs: _stream(content="go north"))
+        
+        # Generate an action twice for the same state and recent actions
+        for _ in range(2):
+            action = planner.generate_action("You are in a forest.", ["go north", "look"], self.memory)
+            planner.action_history.clear()
+        
+        # Check that the LLM was only called once
+        self.assertEqual(action, "go north")
+        self.assertEqual(planner._aclient.chat.completions.create.await_count, 1)
+
+    def test_generate_action_rejects_empty_action(self):
+        """Test that an empty action is retried and the canonical action is cached."""
+        # Mock the async client to call the function without an action first
+        planner = LLMBasedPlanner(api_key="test-key")
+        planner._aclient = MagicMock()
+        planner._aclient.chat.completions.create = AsyncMock(side_effect=[
+            _stream(arguments='{"direction": "north"}'),
+            _stream(content="North\n")
+        ])
+
+        # Generate an action
+        action = planner.generate_action("You are in a forest.", ["look", "go north"], self.memory)
+
+        # Check that the call was retried and the matching valid action used
+        self.assertEqual(action, "go north")
+        self.assertEqual(planner._aclient.chat.completions.create.await_count, 2)
+        self.assertEqual(list(planner._cache.values()), ["go north"])
+
+    def test_generate_action_stops_reading_stream(self):
+        """Test that reading stops once the action is complete."""
+        # Mock the async client with responses that continue past the action
+        planner = LLMBasedPlanner(api_key="test-key", use_cache=False)
+        planner._aclient = MagicMock()
+        streams = [
+            _stream(arguments='{"action": "go north"}  '),
+            _stream(content="look\nI looked around to see more.")
+        ]
+        planner._aclient.chat.completions.create = AsyncMock(side_effect=streams)
+        
+        # Generate an action from a function call and from plain text
+        actions = [
+            planner.generate_action("You are in a forest.", ["go north", "look"], self.memory)
+            for _ in streams
+        ]
+        
+        # Check that the actions were read and the streams closed
+        self.assertEqual(actions, ["go north", "look"])
+        self.assertTrue(planner._aclient.chat.completions.create.call_args.kwargs["stream"])
+        for stream in streams:
+            stream.close.assert_awaited_once()
+
+    @patch("src.agent.llm_planner.random.uniform", return_value=0.1)
+    @patch("src.agent.llm_planner.asyncio.sleep", new_callable=AsyncMock)
+    def test_generate_action_honors_retry_after(self, mock_sleep, mock_uniform):
+        """Test that rate limited requests wait for the Retry-After time."""
+        # Mock the async client to be rate limited once
+        planner = LLMBasedPlanner(api_key="test-key")
+        planner._aclient = MagicMock()
+        response = httpx.Response(
+            429, headers={"retry-after": "1.5"},
+            request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        planner._aclient.chat.completions.create = AsyncMock(side_effect=[
+            RateLimitError("Rate limited", response=response, body=None),
+            _stream(arguments='{"action": "go north"}')
+        ])
+        
+        # Generate an action
+        action = planner.generate_action("You are in a forest.", ["go north", "look"], self.memory)
+        
+        # Check that the planner waited as asked, with jitter, and retried
+        self.assertEqual(action, "go north")
+        mock_sleep.assert_awaited_once_with(1.6)
+
+    def test_close(self):
+        """Test that closing the planner releases its client and event loop."""
+        planner = LLMBasedPlanner(api_key="test-key")
+        planner._aclient = MagicMock()
+        planner._aclient.chat.completions.create = AsyncMock(
+            side_effect=lambda **kwargs: _stream(arguments='{"action": "go north"}'))
+        planner._aclient.close = AsyncMock()
+        client = planner._aclient
+        planner.generate_action("You are in a forest.", ["go north", "look"], self.memory)
+        loop = planner._loop
+        
+        planner.close()
+        
+        client.close.assert_awaited_once()
+        self.assertTrue(loop.is_closed())
+        self.assertIsNone(planner._aclient)
+
+    def test_limiter_is_shared(self):
+        """Test that all planners on an event loop share one limiter."""
+        async def get_limiters():
+            return _get_limiter(), _get_limiter()
+        
+        first, second = asyncio.run(get_limiters())
+        self.assertIs(first, second)
+
+    def test_route(self):
+        """Test that simple states in known locations use the small model."""
+        valid_actions = ["go north", "look"]
+        self.memory.current_location = "Forest"
+        
+        # A new location goes to the configured model
+        self.assertEqual(self.planner._route("", valid_actions, self.memory), "gpt-3.5-turbo")
+        self.planner._update_context("", valid_actions, self.memory)
+        
+        # A seen location with few actions and no inventory goes to the small model
+        self.assertEqual(self.planner._route("", valid_actions, self.memory), "gpt-4o-mini")
+        
+        # Many valid actions escalate to the configured model
+        many_actions = valid_actions + ["go south", "go east", "go west", "open door"]
+        self.assertEqual(self.planner._route("", many_actions, self.memory), "gpt-3.5-turbo")
+        
+        # Routing can be disabled
+        self.planner.small_model = None
+        self.assertEqual(self.planner._route("", valid_actions, self.memory), "gpt-3.5-turbo")
+
     def test_validate_action(self):
         """Test that actions are validated correctly."""
         valid_actions = ["go north", "go south", "look"]
@@ -101,6 +344,11 @@ class TestLLMPlanner(unittest.TestCase):
         is_valid, action = self.planner.validate_action("north", valid_actions)
         self.assertTrue(is_valid)
         self.assertEqual(action, "go north")
+        
+        # Test case-insensitive match
+        is_valid, action = self.planner.validate_action(" Go North ", valid_actions)
+        self.assertTrue(is_valid)
+        self.assertEqual(action, "go north")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,69 @@
+"""
+Unit tests for the logging configuration.
+"""
+import logging
+import logging.handlers
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Add the src directory to the path
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+from src.logging_utils import configure_logging, flush_logging  # noqa: E402
+
+
+class TestConfigureLogging(unittest.TestCase):
+    """Test cases for configure_logging."""
+
+    def setUp(self):
+        """Remove the root handlers so basicConfig applies each time."""
+        root = logging.getLogger()
+        self.saved_handlers = root.handlers[:]
+        self.saved_level = root.level
+        root.handlers = []
+
+    def tearDown(self):
+        """Restore the root handlers."""
+        root = logging.getLogger()
+        root.handlers = self.saved_handlers
+        root.setLevel(self.saved_level)
+
+    @patch("sys.stdout")
+    def test_terminal_is_not_buffered(self, mock_stdout):
+        """Test that records are written immediately on a terminal."""
+        mock_stdout.isatty.return_value = True
+        configure_logging()
+        
+        handler, = logging.getLogger().handlers
+        self.assertNotIsInstance(handler, logging.handlers.MemoryHandler)
+        self.assertIs(handler.stream, mock_stdout)
+
+    @patch("sys.stdout")
+    def test_redirected_output_is_buffered(self, mock_stdout):
+        """Test that records are buffered when stdout is not a terminal."""
+        mock_stdout.isatty.return_value = False
+        configure_logging(capacity=10)
+        
+        handler, = logging.getLogger().handlers
+        self.assertIsInstance(handler, logging.handlers.MemoryHandler)
+        self.assertEqual(handler.capacity, 10)
+        self.assertIs(handler.target.stream, mock_stdout)
+
+    @patch("sys.stdout")
+    def test_flush_logging_writes_buffered_records(self, mock_stdout):
+        """Test that buffered records are written before direct output."""
+        mock_stdout.isatty.return_value = False
+        configure_logging()
+        logging.getLogger(__name__).info("Step done")
+        mock_stdout.write.assert_not_called()
+        
+        flush_logging()
+        
+        mock_stdout.write.assert_any_call("Step done\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,9 @@ Unit tests for the MCP agent.
 """
 import os
 import sys
+import tempfile
 import unittest
+from itertools import zip_longest
 from unittest.mock import MagicMock, patch
 
 # Add the src directory to the path
@@ -11,7 +13,8 @@ sys.path.append(os.path.abspath(
     os.path.join(os.path.dirname(__file__), '..')))
 
 # Import the agent modules
-from src.agent.mcp.agent import run_agent, generate_thought, select_action
+from src.agent.mcp import agent as agent_module
+from src.agent.mcp.agent import run_agent, decide, _format_game_state
 
 
 class TestMcpAgent(unittest.TestCase):
@@ -19,96 +22,304 @@ class TestMcpAgent(unittest.TestCase):
 
     def setUp(self):
         """Set up test fixtures."""
-        # Create a mock environment
-        self.mock_env = MagicMock()
-        self.mock_env.reset.return_value = {
+        agent_module._tool_catalogs.clear()
+        agent_module._clients.clear()
+        self.game_state = {
             "observation": "You are in a test room.",
-            "valid_actions": ["look", "go north", "examine test"],
-            "inventory": "You are not carrying anything.",
             "location": "test_room",
+            "inventory": [],
             "score": 0,
-            "moves": 0,
-            "done": False
+            "moves": 0
         }
-        self.mock_env.step.return_value = {
+        self.tool_result = {
             "observation": "You examined the test object.",
-            "valid_actions": ["look", "go north", "take test"],
-            "inventory": "You are not carrying anything.",
             "location": "test_room",
-            "score": 1,
-            "moves": 1,
-            "done": False
+            "inventory": [],
+            "score": 1
         }
 
-        # Create a mock LLM
+        # Create a mock LLM that streams a call to the examine tool
+        self.tool_name = "examine"
+        self.arguments = '{"thought": "I should examine the test object.", "object": "test"}'
         self.mock_client = MagicMock()
-        self.mock_response = MagicMock()
-        self.mock_response.choices = [MagicMock()]
-        self.mock_response.choices[0].message = MagicMock()
-        self.mock_response.choices[0].message.content = "examine test"
-        self.mock_client.chat.completions.create.return_value = self.mock_response
+        self.mock_client.chat.completions.create.side_effect = (
+            lambda **kwargs: self._stream(self.arguments, self.tool_name))
+
+    def _stream(self, arguments, tool_name=None):
+        """
+        Create a mock stream that yields the arguments in small chunks, as a
+        call to the named tool or as text if no tool name is given.
+        """
+        return self._stream_chunks(self._chunks(arguments, tool_name))
+
+    def _chunks(self, arguments, tool_name=None, index=0):
+        """Split the arguments into mock chunks for the choice with the given index."""
+        chunks = []
+        for i in range(0, len(arguments), 8):
+            choice = MagicMock()
+            choice.index = index
+            if tool_name is None:
+                choice.delta.tool_calls = None
+                choice.delta.content = arguments[i:i + 8]
+            else:
+                function = choice.delta.tool_calls[0].function
+                function.name = tool_name if i == 0 else None
+                function.arguments = arguments[i:i + 8]
+            chunk = MagicMock()
+            chunk.choices = [choice]
+            chunks.append(chunk)
+        return chunks
+
+    def _stream_chunks(self, chunks):
+        """Create a mock stream that yields the given chunks."""
+        stream = MagicMock()
+        stream.__iter__.return_value = iter(chunks)
+        return stream
 
-    @patch('src.agent.mcp.agent.create_environment')
+    @patch.dict(os.environ, {}, clear=False)
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    @patch('src.agent.mcp.agent.use_mcp_tools')
+    @patch('src.agent.mcp.agent.use_mcp_tool')
     @patch('src.agent.mcp.agent.OpenAI')
-    def test_run_agent(self, mock_openai, mock_create_environment):
+    def test_run_agent(self, mock_openai, mock_use_mcp_tool, mock_use_mcp_tools,
+                       mock_get_mcp_tools):
         """Test running the agent."""
+        os.environ.pop("LLM_BASE_URL", None)
+
         # Set up the mocks
         mock_openai.return_value = self.mock_client
-        mock_create_environment.return_value = self.mock_env
+        mock_use_mcp_tool.return_value = self.tool_result
+        mock_use_mcp_tools.return_value = [self.tool_result, self.tool_result]
 
         # Run the agent with a max of 1 step
         with patch('builtins.print'):  # Suppress print output
-            with patch('time.sleep'):  # Skip sleep delay
+            with patch('time.sleep') as mock_sleep:
                 run_agent(max_steps=1)
 
-        # Assert that the environment was reset
-        self.mock_env.reset.assert_called_once()
-        
-        # Assert that the environment step was called
-        self.mock_env.step.assert_called_once()
-        
-        # Assert that the LLM was called twice (once for thought, once for action)
-        self.assertEqual(self.mock_client.chat.completions.create.call_count, 2)
+        # Assert that steps are not paused outside debug mode
+        mock_sleep.assert_not_called()
 
-    def test_generate_thought(self):
-        """Test generating a thought."""
-        game_state = {
-            "observation": "You are in a test room.",
-            "location": "test_room",
-            "inventory": "You are not carrying anything.",
-            "score": 0,
-            "moves": 0
-        }
-        
-        # Generate a thought
-        thought = generate_thought(self.mock_client, "test-model", game_state)
-        
-        # Assert that the LLM was called
-        self.mock_client.chat.completions.create.assert_called_once()
-        
-        # Assert that the thought is the expected value
-        self.assertEqual(thought, "examine test")
+        # Assert that look and inventory were requested together, then the
+        # tool selected by the LLM was executed
+        mock_use_mcp_tools.assert_called_once_with(
+            "zork-tools", [("look", {}), ("inventory", {})])
+        mock_use_mcp_tool.assert_called_once_with("zork-tools", "examine", {"object": "test"})
 
-    def test_select_action(self):
-        """Test selecting an action."""
-        game_state = {
-            "observation": "You are in a test room.",
-            "location": "test_room",
-            "inventory": "You are not carrying anything.",
-            "score": 0,
-            "moves": 0
-        }
-        thought = "I should examine the test object."
-        
-        # Select an action
-        action = select_action(self.mock_client, "test-model", game_state, thought)
-        
-        # Assert that the LLM was called
+        # Assert that the client uses the default API endpoint
+        mock_openai.assert_called_once_with(api_key=unittest.mock.ANY, base_url=None,
+                                            http_client=unittest.mock.ANY)
+
+        # Assert that the LLM was called once per step
+        self.assertEqual(self.mock_client.chat.completions.create.call_count, 1)
+
+        # Assert that a second run reuses the client and its connections
+        with patch('builtins.print'):
+            run_agent(max_steps=1)
+        mock_openai.assert_called_once()
+
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    def test_decide(self, mock_get_mcp_tools):
+        """Test thinking and selecting a tool in one call."""
+        thought, tool_name, tool_args = decide(self.mock_client, "test-model", self.game_state)
+
+        # Assert that the LLM was called once and required to call a tool
         self.mock_client.chat.completions.create.assert_called_once()
-        
-        # Assert that the action is the expected value
-        self.assertEqual(action, "examine test")
+        kwargs = self.mock_client.chat.completions.create.call_args.kwargs
+        self.assertEqual(kwargs["tool_choice"], "required")
+        self.assertTrue(kwargs["stream"])
+        self.assertEqual(kwargs["temperature"], 0.0)
+        self.assertEqual(kwargs["max_tokens"], 96)
+        self.assertEqual(kwargs["seed"], 0)
+        self.assertEqual(kwargs["n"], 1)
+        self.assertEqual(kwargs["timeout"], 15)
+        # Assert that each tool is offered with its own schema and a thought
+        functions = {spec["function"]["name"]: spec["function"] for spec in kwargs["tools"]}
+        self.assertIn("navigate", functions)
+        self.assertEqual(functions["put"]["parameters"]["required"],
+                         ["thought", "object", "container"])
+
+        self.assertIn("one short sentence",
+                      functions["put"]["parameters"]["properties"]["thought"]["description"])
+
+        # Assert that the observation is only sent once, and that the
+        # arguments are left to the function schemas rather than examples
+        prompt = kwargs["messages"][1]["content"]
+        self.assertEqual(prompt.count("You are in a test room."), 1)
+        self.assertNotIn('"tool"', prompt)
+
+        # Assert that the decision is the expected value
+        self.assertEqual(thought, "I should examine the test object.")
+        self.assertEqual(tool_name, "examine")
+        self.assertEqual(tool_args, {"object": "test"})
+
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    def test_decide_stops_reading_stream(self, mock_get_mcp_tools):
+        """Test that the stream is closed once the decision is complete."""
+        stream = self._stream(self.arguments + '{"ignored": true}', self.tool_name)
+        self.mock_client.chat.completions.create.side_effect = None
+        self.mock_client.chat.completions.create.return_value = stream
+
+        thought, tool_name, tool_args = decide(self.mock_client, "test-model", self.game_state)
+
+        self.assertEqual(tool_name, "examine")
+        self.assertEqual(tool_args, {"object": "test"})
+        stream.close.assert_called_once()
+
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    def test_decide_text_response(self, mock_get_mcp_tools):
+        """Test that a decision in a code fence with surrounding text is parsed."""
+        decision = ('{"thought": "I should examine the test object.", '
+                    '"tool": "examine", "args": {"object": "test"}}')
+        self.mock_client.chat.completions.create.side_effect = lambda **kwargs: self._stream(
+            "Here is my decision:\n```json\n" + decision + "\n```\nGood luck!")
+
+        thought, tool_name, tool_args = decide(self.mock_client, "test-model", self.game_state)
+
+        self.assertEqual(thought, "I should examine the test object.")
+        self.assertEqual(tool_name, "examine")
+        self.assertEqual(tool_args, {"object": "test"})
+
+    @patch.dict(os.environ, {}, clear=False)
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    @patch('src.agent.mcp.agent.use_mcp_tools')
+    @patch('src.agent.mcp.agent.use_mcp_tool')
+    @patch('src.agent.mcp.agent.OpenAI')
+    def test_run_agent_replays_cached_decisions(self, mock_openai, mock_use_mcp_tool,
+                                                mock_use_mcp_tools, mock_get_mcp_tools):
+        """Test that a replay of the same game states reuses cached decisions."""
+        mock_openai.return_value = self.mock_client
+        mock_use_mcp_tool.return_value = self.tool_result
+        mock_use_mcp_tools.return_value = [
+            dict(self.tool_result, observation="You are in a test room."), self.tool_result]
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, "decisions")
+            with patch('builtins.print'):  # Suppress print output
+                run_agent(max_steps=2, cache_path=cache_path)
+                run_agent(max_steps=2, cache_path=cache_path)
+
+        # Assert that only the first run called the LLM
+        self.assertEqual(self.mock_client.chat.completions.create.call_count, 2)
+        mock_use_mcp_tool.assert_called_with("zork-tools", "examine", {"object": "test"})
+
+    @patch('src.agent.mcp.agent.get_mcp_tools')
+    def test_decide_discovers_tools_once(self, mock_get_mcp_tools):
+        """Test that the tool catalog is discovered once and reused."""
+        mock_get_mcp_tools.return_value = [{
+            "name": "examine",
+            "description": "Examine an object",
+            "inputSchema": {"properties": {"object": {"type": "string"}}, "required": ["object"]}
+        }]
+
+        for _ in range(2):
+            thought, tool_name, tool_args = decide(self.mock_client, "test-model", self.game_state)
+
+        mock_get_mcp_tools.assert_called_once()
+        self.assertEqual(tool_name, "examine")
+        prompt = self.mock_client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+        self.assertIn("- examine: Examine an object", prompt)
+
+    @patch.dict(os.environ, {}, clear=False)
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    @patch('src.agent.mcp.agent.use_mcp_tools')
+    @patch('src.agent.mcp.agent.use_mcp_tool')
+    @patch('src.agent.mcp.agent.OpenAI')
+    def test_run_agent_reuses_decisions_for_revisited_states(
+            self, mock_openai, mock_use_mcp_tool, mock_use_mcp_tools, mock_get_mcp_tools):
+        """Test that a game state seen earlier in the run reuses its decision."""
+        mock_openai.return_value = self.mock_client
+        mock_use_mcp_tool.return_value = self.tool_result
+        mock_use_mcp_tools.return_value = [
+            dict(self.tool_result, observation="You are in a test room."), self.tool_result]
+
+        with patch('builtins.print'):  # Suppress print output
+            run_agent(max_steps=4)
+
+        # Assert that the LLM was only called for the two distinct states
+        self.assertEqual(self.mock_client.chat.completions.create.call_count, 2)
+        self.assertEqual(mock_use_mcp_tool.call_count, 4)
+
+    def test_format_game_state(self):
+        """Test that the game state is formatted compactly."""
+        self.game_state.update({
+            "observation": "West of House\nYou are in an open field.\n\nOpened.",
+            "inventory": ["lamp", "sword"],
+            "previous_location": "test_room"
+        })
+
+        formatted = _format_game_state(self.game_state)
+
+        # Assert that the repeated room description is dropped in the same location
+        self.assertIn("Current Observation:\nOpened.\n", formatted)
+        self.assertNotIn("open field", formatted)
+        self.assertIn("Inventory:\nlamp, sword\n", formatted)
+
+        # Assert that the full observation is kept after moving
+        self.game_state["previous_location"] = "other_room"
+        self.game_state["inventory"] = []
+        formatted = _format_game_state(self.game_state)
+        self.assertIn("open field", formatted)
+        self.assertIn("Inventory:\nempty\n", formatted)
+
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    def test_decide_missing_args(self, mock_get_mcp_tools):
+        """Test that a tool without its required arguments falls back to look."""
+        self.tool_name = "take"
+        self.arguments = '{"thought": "Something here looks useful."}'
+
+        with self.assertLogs(agent_module.logger, "WARNING"):
+            thought, tool_name, tool_args = decide(self.mock_client, "test-model", self.game_state)
+
+        self.assertEqual(thought, "Something here looks useful.")
+        self.assertEqual(tool_name, "look")
+        self.assertEqual(tool_args, {})
+
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    def test_decide_recovers_directive_from_thought(self, mock_get_mcp_tools):
+        """Test that a command in the thought is used when the tool call is incomplete."""
+        self.tool_name = "take"
+        self.arguments = '{"thought": "The lamp will help in the dark. I should take the lamp."}'
+
+        thought, tool_name, tool_args = decide(self.mock_client, "test-model", self.game_state)
+
+        self.assertEqual(tool_name, "take")
+        self.assertEqual(tool_args, {"object": "lamp"})
+
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    def test_decide_recovers_directive_from_text(self, mock_get_mcp_tools):
+        """Test that a command stated in a text response is used instead of look."""
+        self.mock_client.chat.completions.create.side_effect = lambda **kwargs: self._stream(
+            "The path north looks promising, so I will go north.")
+
+        thought, tool_name, tool_args = decide(self.mock_client, "test-model", self.game_state)
+
+        self.assertEqual(tool_name, "navigate")
+        self.assertEqual(tool_args, {"direction": "north"})
+
+    @patch('src.agent.mcp.agent.get_mcp_tools', return_value=[])
+    def test_decide_samples_candidates_after_invalid_decision(self, mock_get_mcp_tools):
+        """Test that a sampled candidate replaces an invalid greedy decision."""
+        invalid = self._chunks('{"thought": "Something here looks useful."}', "take", index=0)
+        valid = self._chunks(self.arguments, self.tool_name, index=1)
+        # Interleave the sampled candidates as the API does
+        sampled = [chunk for pair in zip_longest(
+            self._chunks('{"thought": "Something here looks useful."}', "take", index=0), valid
+        ) for chunk in pair if chunk]
+        streams = iter([self._stream_chunks(invalid), self._stream_chunks(sampled)])
+        self.mock_client.chat.completions.create.side_effect = lambda **kwargs: next(streams)
+
+        thought, tool_name, tool_args = decide(self.mock_client, "test-model", self.game_state)
 
+        # Assert that one greedy decision was requested, then several sampled ones
+        greedy, retry = self.mock_client.chat.completions.create.call_args_list
+        self.assertEqual(greedy.kwargs["n"], 1)
+        self.assertEqual(greedy.kwargs["temperature"], 0.0)
+        self.assertGreater(retry.kwargs["n"], 1)
+        self.assertGreater(retry.kwargs["temperature"], 0.0)
+        # Assert that the valid second candidate was used
+        self.assertEqual(thought, "I should examine the test object.")
+        self.assertEqual(tool_name, "examine")
+        self.assertEqual(tool_args, {"object": "test"})
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,79 @@
+"""
+Unit tests for the MCP client.
+"""
+import io
+import json
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add the src directory to the path
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+from src.mcp import client as client_module
+from src.mcp.client import MCPClient, get_mcp_tools
+
+
+class TestMcpClient(unittest.TestCase):
+    """Test cases for the MCP client."""
+
+    def setUp(self):
+        """Set up a client with a mock server process."""
+        self.client = MCPClient("node", ["index.js"])
+        self.client.process = MagicMock()
+        self.client.process.stdin = io.StringIO()
+
+    def _respond(self, *responses):
+        """Queue the server's responses, one JSON-RPC message per line."""
+        self.client.process.stdout = io.StringIO(
+            "".join(json.dumps(response) + "\n" for response in responses))
+
+    def test_call_tools(self):
+        """Test that several tool calls are sent before any response is read."""
+        # The server answers the second request first
+        self._respond(
+            {"jsonrpc": "2.0", "id": 2, "result": {"content": [{"type": "text", "text": "Empty"}]}},
+            {"jsonrpc": "2.0", "id": 1, "result": {"content": [{"type": "text", "text": "A room"}]}}
+        )
+
+        results = self.client.call_tools([("look", {}), ("inventory", None)])
+
+        # Assert that both requests were written and the results matched by ID
+        requests = [json.loads(line) for line in self.client.process.stdin.getvalue().splitlines()]
+        self.assertEqual([request["params"]["name"] for request in requests], ["look", "inventory"])
+        self.assertEqual(results[0]["content"][0]["text"], "A room")
+        self.assertEqual(results[1]["content"][0]["text"], "Empty")
+
+    def test_call_tools_error(self):
+        """Test that a failed call returns None without affecting the others."""
+        self._respond(
+            {"jsonrpc": "2.0", "id": 1, "error": {"code": -1, "message": "Unknown tool"}},
+            {"jsonrpc": "2.0", "id": 2, "result": {"content": []}}
+        )
+
+        with unittest.mock.patch('builtins.print'):  # Suppress print output
+            results = self.client.call_tools([("fly", {}), ("look", {})])
+
+        self.assertEqual(results, [None, {"content": []}])
+
+    @patch('src.mcp.client.get_mcp_client')
+    def test_get_mcp_tools_cached(self, mock_get_mcp_client):
+        """Test that the tool list is fetched once and reused until it expires."""
+        client_module._tools_cache.clear()
+        mock_get_mcp_client.return_value.list_tools.return_value = [{"name": "look"}]
+
+        self.assertEqual(get_mcp_tools("zork-tools"), [{"name": "look"}])
+        self.assertEqual(get_mcp_tools("zork-tools"), [{"name": "look"}])
+        mock_get_mcp_client.return_value.list_tools.assert_called_once()
+
+        # Assert that an expired entry is fetched again
+        with patch('time.monotonic', return_value=float("inf")):
+            get_mcp_tools("zork-tools")
+        self.assertEqual(mock_get_mcp_client.return_value.list_tools.call_count, 2)
+        client_module._tools_cache.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
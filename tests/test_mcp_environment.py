@@ -0,0 +1,37 @@
+"""
+Unit tests for the MCP environment wrapper.
+"""
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock
+
+# Add the src directory to the path
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+from src.mcp.environment import MCPEnvironmentWrapper
+
+
+class TestMcpEnvironment(unittest.TestCase):
+    """Test cases for the MCP environment wrapper."""
+
+    def test_reset(self):
+        """Test that reset requests look and inventory in one round trip."""
+        env = MCPEnvironmentWrapper("zork-tools")
+        env._client = MagicMock()
+        env._client.call_tools.return_value = [
+            {"content": [{"type": "text", "text": "West of House"}]},
+            {"content": [{"type": "json", "json": {"items": ["lamp"]}}]}
+        ]
+
+        state = env.reset()
+
+        env._client.call_tools.assert_called_once_with([("look", {}), ("inventory", {})])
+        env._client.call_tool.assert_not_called()
+        self.assertEqual(state["observation"], "West of House")
+        self.assertEqual(state["inventory"], ["lamp"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
 """
 Unit tests for the MCP LangGraph workflow.
 """
+import asyncio
+import json
 import os
 import sys
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import MagicMock, patch
 
@@ -11,8 +16,17 @@ sys.path.append(os.path.abspath(
     os.path.join(os.path.dirname(__file__), '..')))
 
 # Import the workflow modules
+from src.agent.llm import make_llm  # noqa: E402
+from src.agent.mcp_langgraph import workflow as workflow_module  # noqa: E402
 from src.agent.mcp_langgraph.workflow import (  # noqa: E402
-    create_agent_workflow, run_agent_workflow)
+    ToolCall, ToolDecision, arun_agent_workflow, create_agent_workflow,
+    run_agent_workflow, run_batch)
+
+
+async def _astream(decisions):
+    """Yield partial decisions like an async structured-output stream."""
+    for decision in decisions:
+        yield decision
 
 
 class TestMcpLangGraphWorkflow(unittest.TestCase):
@@ -20,6 +34,10 @@ class TestMcpLangGraphWorkflow(unittest.TestCase):
 
     def setUp(self):
         """Set up test fixtures."""
+        # Clear the shared LLM so each test sees its own mock
+        make_llm.cache_clear()
+        workflow_module._make_decider.cache_clear()
+
         # Create a mock environment
         self.mock_env = MagicMock()
         self.mock_env.reset.return_value = {
@@ -41,16 +59,16 @@ class TestMcpLangGraphWorkflow(unittest.TestCase):
             "done": False
         }
 
-        # Create a mock LLM
+        # Create a mock LLM that returns a structured decision
         self.mock_llm = MagicMock()
-        self.mock_llm.invoke.side_effect = [
-            MagicMock(
-                content="I should examine the test object to learn more about it."),
-            MagicMock(
-                content='{"tool": "examine", "args": {"object": "test"}}')
-        ]
+        self.mock_decider = self.mock_llm.with_structured_output.return_value
+        self.decision = ToolDecision(
+            thought="I should examine the test object to learn more about it.",
+            tool_calls=[ToolCall(tool="examine", args={"object": "test"})]
+        )
+        self.mock_decider.stream.return_value = [self.decision]
 
-    @patch('src.agent.mcp_langgraph.workflow.ChatOpenAI')
+    @patch('src.agent.llm.ChatOpenAI')
     def test_create_workflow(self, mock_chat_openai):
         """Test creating the workflow."""
         # Set up the mock
@@ -68,7 +86,9 @@ class TestMcpLangGraphWorkflow(unittest.TestCase):
         self.assertIsNotNone(workflow)
         
         # Assert that the ChatOpenAI was called with the correct arguments
-        mock_chat_openai.assert_called_once_with(model="test-model", api_key="test-key")
+        mock_chat_openai.assert_called_once_with(
+            model="test-model", api_key="test-key", temperature=None,
+            base_url=None, max_tokens=256, timeout=30, max_retries=5)
         
         # Assert that the initial state has the expected structure
         self.assertIsNone(initial_state["observation"])
@@ -84,7 +104,28 @@ class TestMcpLangGraphWorkflow(unittest.TestCase):
         self.assertIsNone(initial_state["tool_args"])
         self.assertIsNone(initial_state["tool_result"])
 
-    @patch('src.agent.mcp_langgraph.workflow.ChatOpenAI')
+    @patch.dict(os.environ, {"LLM_BASE_URL": "http://localhost:8000/v1"})
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_llm_base_url(self, mock_chat_openai):
+        """Test pointing the workflow at an OpenAI-compatible server."""
+        # Set up the mock
+        mock_chat_openai.return_value = self.mock_llm
+
+        # Create the workflow with a served model name
+        create_agent_workflow(
+            environment=self.mock_env,
+            model_name="meta-llama/Llama-3.1-8B-Instruct",
+            api_key="test-key",
+            max_steps=1
+        )
+
+        # Assert that the base URL is used instead of routing through LiteLLM
+        mock_chat_openai.assert_called_once_with(
+            model="meta-llama/Llama-3.1-8B-Instruct", api_key="test-key",
+            temperature=None, base_url="http://localhost:8000/v1",
+            max_tokens=256, timeout=30, max_retries=5)
+
+    @patch('src.agent.llm.ChatOpenAI')
     def test_observe_node(self, mock_chat_openai):
         """Test the observe node."""
         # Set up the mock
@@ -108,10 +149,497 @@ class TestMcpLangGraphWorkflow(unittest.TestCase):
         self.assertIsNotNone(result.get("tool_name"))
         self.assertIsNotNone(result.get("tool_args"))
         
-        # Assert that the LLM was called twice (once for thought, once for tool selection)
-        self.assertEqual(self.mock_llm.invoke.call_count, 2)
+        # Assert that the LLM was called once for both thought and tool selection
+        self.assertEqual(self.mock_decider.stream.call_count, 1)
+        self.assertEqual(result["tool_name"], "examine")
+        self.assertEqual(result["tool_args"], {"object": "test"})
+        
+        # Assert that the tool catalog is in the system message, not the turn message
+        system_message, turn_message = self.mock_decider.stream.call_args.args[0]
+        self.assertIn("Available Tools", system_message.content)
+        self.assertNotIn("Available Tools", turn_message.content)
+        self.assertIn("You are in a test room.", turn_message.content)
+        
+        # Assert that the structured output schema offers the tool names, but
+        # an unknown tool in one call does not reject the other calls
+        schema = self.mock_llm.with_structured_output.call_args.args[0]
+        tool_schema = schema.model_json_schema()["$defs"]["ToolCall"]["properties"]["tool"]
+        self.assertIn("examine", tool_schema["enum"])
+        self.assertNotIn("fly", tool_schema["enum"])
+        decision = schema(thought="", tool_calls=[
+            {"tool": "examine", "args": {"object": "test"}}, {"tool": "fly"}])
+        self.assertEqual([call.tool for call in decision.tool_calls], ["examine", "fly"])
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_unknown_tool_call_keeps_other_calls(self, mock_chat_openai):
+        """Test that a call naming an unknown tool does not drop the valid calls."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+        self.mock_decider.stream.return_value = [ToolDecision(
+            thought="I should examine the test object, then fly.",
+            tool_calls=[ToolCall(tool="examine", args={"object": "test"}), ToolCall(tool="fly")]
+        )]
+
+        # Run one step
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=1
+        )
+        result = workflow.invoke(initial_state)
+
+        # Assert that the valid call ran and the unknown one became look
+        self.assertEqual(
+            [call.args[0] for call in self.mock_env.step.call_args_list],
+            ["examine test", "look"])
+        self.assertEqual(result["action"], "examine test; look")
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_observe_keeps_existing_state(self, mock_chat_openai):
+        """Test that observe leaves a state that already has an observation alone."""
+        # Set up the mock
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+
+        # Start the workflow from an existing game state
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=1
+        )
+        initial_state.update(self.mock_env.reset.return_value)
+        workflow.invoke(initial_state)
+
+        # Assert that the environment was not reset and the state was used as is
+        self.mock_env.reset.assert_not_called()
+        turn_message = self.mock_decider.stream.call_args.args[0][1]
+        self.assertIn("You are in a test room.", turn_message.content)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_decider_shared_across_workflows(self, mock_chat_openai):
+        """Test that episodes with the same settings share the structured-output LLM."""
+        # Set up the mock
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+
+        # Run two episodes with the same settings
+        for _ in range(2):
+            workflow, initial_state = create_agent_workflow(
+                environment=self.mock_env,
+                model_name="test-model",
+                api_key="test-key",
+                max_steps=1
+            )
+            workflow.invoke(initial_state)
+
+        # Assert that the decision schema was bound to the model only once
+        self.assertEqual(self.mock_llm.with_structured_output.call_count, 1)
+        self.assertEqual(self.mock_decider.stream.call_count, 2)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_multiple_tool_calls(self, mock_chat_openai):
+        """Test executing several tool calls selected in one LLM response."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        self.mock_decider.stream.return_value = [ToolDecision(
+            thought="I should look around and check my inventory.",
+            tool_calls=[ToolCall(tool="look"), ToolCall(tool="inventory")]
+        )]
+        del self.mock_env.server_name  # Use direct environment calls
+        
+        # Create and run the workflow for one step
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=1
+        )
+        result = workflow.invoke(initial_state)
+        
+        # Assert that both tools were executed in order with a single LLM call
+        self.assertEqual(self.mock_decider.stream.call_count, 1)
+        self.assertEqual(
+            [c.args[0] for c in self.mock_env.step.call_args_list],
+            ["look", "inventory"]
+        )
+        self.assertEqual(result["action"], "look; inventory")
+        self.assertEqual(len(result["tool_calls"]), 2)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_infer_missing_direction(self, mock_chat_openai):
+        """Test that a missing direction is inferred from the thought."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        self.mock_decider.stream.return_value = [ToolDecision(
+            thought="The path leads north, so I should head that way.",
+            tool_calls=[ToolCall(tool="navigate")]
+        )]
+        del self.mock_env.server_name  # Use direct environment calls
+        
+        # Create and run the workflow for one step
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=1
+        )
+        with patch('builtins.print'):  # Suppress print output
+            result = workflow.invoke(initial_state)
+        
+        # Assert that the inferred direction was used
+        self.mock_env.step.assert_called_once_with("go north")
+        self.assertEqual(result["tool_args"], {"direction": "north"})
 
-    @patch('src.agent.mcp_langgraph.workflow.ChatOpenAI')
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_action_loop_ends_workflow(self, mock_chat_openai):
+        """Test that repeating the same action three times ends the workflow."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+        self.mock_env.step.side_effect = lambda action: dict(
+            self.mock_env.step.return_value, moves=self.mock_env.step.call_count)
+        
+        # Create and run the workflow with room for many more steps
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=10
+        )
+        result = workflow.invoke(initial_state)
+        
+        # Assert that the workflow stopped after the third identical action
+        self.assertEqual(self.mock_env.step.call_count, 3)
+        self.assertEqual(result["moves"], 3)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_streamed_tool_calls(self, mock_chat_openai):
+        """Test that completed tool calls start before the response finishes."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+        thought = "I should look around and check my inventory."
+        
+        def stream(messages):
+            yield ToolDecision(thought=thought, tool_calls=[ToolCall(tool="look")])
+            yield ToolDecision(thought=thought, tool_calls=[
+                ToolCall(tool="look"), ToolCall(tool="inv")])
+            # The first call is complete, so it runs while the rest streams
+            for _ in range(100):
+                if self.mock_env.step.called:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(self.mock_env.step.call_args.args[0], "look")
+            yield ToolDecision(thought=thought, tool_calls=[
+                ToolCall(tool="look"), ToolCall(tool="inventory")])
+        
+        self.mock_decider.stream.side_effect = stream
+        
+        # Create and run the workflow for one step
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=1
+        )
+        result = workflow.invoke(initial_state)
+        
+        # Assert that each tool was executed exactly once, in order
+        self.assertEqual(
+            [c.args[0] for c in self.mock_env.step.call_args_list],
+            ["look", "inventory"]
+        )
+        self.assertEqual(result["action"], "look; inventory")
+        
+        # Assert that the prefetch worker was shut down after the step
+        self.assertFalse([thread for thread in threading.enumerate()
+                          if thread.name.startswith("tool-prefetch")])
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_failed_decision_not_cached(self, mock_chat_openai):
+        """Test that a decision cut short by a streaming error is not reused."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+        thought = "I should look around and check my inventory."
+        
+        def stream(messages):
+            yield ToolDecision(thought=thought, tool_calls=[
+                ToolCall(tool="look"), ToolCall(tool="inv")])
+            raise RuntimeError("Connection reset")
+        
+        self.mock_decider.stream.side_effect = stream
+        
+        # Run two steps that see the same game state
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=2,
+            temperature=0
+        )
+        self.mock_env.step.side_effect = [
+            dict(self.mock_env.reset.return_value, moves=1),
+            dict(self.mock_env.reset.return_value, moves=2)
+        ]
+        result = workflow.invoke(initial_state)
+        
+        # Assert that the prefetched call ran and the LLM was asked again
+        self.assertEqual(result["action"], "look")
+        self.assertEqual(self.mock_decider.stream.call_count, 2)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_astreamed_tool_calls(self, mock_chat_openai):
+        """Test that the async think node also streams and prefetches tool calls."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+        thought = "I should look around and check my inventory."
+        self.mock_decider.astream.side_effect = lambda messages: _astream([
+            ToolDecision(thought=thought, tool_calls=[ToolCall(tool="look")]),
+            ToolDecision(thought=thought, tool_calls=[
+                ToolCall(tool="look"), ToolCall(tool="inventory")]),
+        ])
+        
+        # Create and run the workflow for one step
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=1
+        )
+        result = asyncio.run(workflow.ainvoke(initial_state))
+        
+        # Assert that each tool was executed exactly once, in order
+        self.mock_decider.ainvoke.assert_not_called()
+        self.assertEqual(
+            [c.args[0] for c in self.mock_env.step.call_args_list],
+            ["look", "inventory"]
+        )
+        self.assertEqual(result["action"], "look; inventory")
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_prompt_truncates_game_state(self, mock_chat_openai):
+        """Test that long observations and inventories are trimmed in the prompt."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        self.mock_env.reset.return_value["observation"] = "x" * 5000 + "The end."
+        self.mock_env.reset.return_value["inventory"] = [f"item{i}" for i in range(30)]
+        del self.mock_env.server_name  # Use direct environment calls
+        
+        # Create and run the workflow for one step
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=1
+        )
+        workflow.invoke(initial_state)
+        
+        # Assert that only the end of the observation and the last items are sent
+        prompt = self.mock_decider.stream.call_args.args[0][1].content
+        self.assertLess(len(prompt), 1500)
+        self.assertIn("The end.", prompt)
+        self.assertIn("item29", prompt)
+        self.assertNotIn("'item9'", prompt)
+        self.assertIn("(+10 more)", prompt)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_decision_cache(self, mock_chat_openai):
+        """Test that repeated game states reuse the decision at temperature 0."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+        
+        # Run two steps that see the same game state
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=2,
+            temperature=0
+        )
+        self.mock_env.step.side_effect = [
+            dict(self.mock_env.reset.return_value, moves=1),
+            dict(self.mock_env.reset.return_value, moves=2)
+        ]
+        workflow.invoke(initial_state)
+        
+        # Assert that the LLM was only called for the first step
+        self.assertEqual(self.mock_env.step.call_count, 2)
+        self.assertEqual(self.mock_decider.stream.call_count, 1)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_decision_cache_bypassed_on_repeat(self, mock_chat_openai):
+        """Test that a repeated action is decided afresh instead of replayed."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+        inventory = ToolDecision(
+            thought="I should check my inventory.",
+            tool_calls=[ToolCall(tool="inventory")]
+        )
+        self.mock_decider.stream.side_effect = [[self.decision], [inventory]]
+
+        # Run steps that all see the same game state
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=3,
+            temperature=0
+        )
+        self.mock_env.step.side_effect = lambda action: dict(
+            self.mock_env.reset.return_value, moves=self.mock_env.step.call_count)
+        result = workflow.invoke(initial_state)
+
+        # Assert that the LLM was asked again after the cached repeat, which
+        # broke the loop
+        self.assertEqual(self.mock_decider.stream.call_count, 2)
+        self.assertEqual(self.mock_env.step.call_count, 3)
+        self.assertEqual(result["tool_name"], "inventory")
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_decision_cache_cleared_on_score(self, mock_chat_openai):
+        """Test that cached decisions are not reused after the score rises."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        del self.mock_env.server_name  # Use direct environment calls
+        
+        # Run two steps that see the same game state, scoring in between
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=2,
+            temperature=0
+        )
+        self.mock_env.step.side_effect = [
+            dict(self.mock_env.reset.return_value, moves=1, score=5),
+            dict(self.mock_env.reset.return_value, moves=2, score=5)
+        ]
+        workflow.invoke(initial_state)
+        
+        # Assert that the LLM was called again after scoring
+        self.assertEqual(self.mock_decider.stream.call_count, 2)
+
+    @patch('src.agent.mcp_langgraph.workflow.use_mcp_tools')
+    @patch('src.agent.mcp_langgraph.workflow.use_mcp_tool')
+    @patch('src.agent.mcp_langgraph.workflow.get_mcp_tools')
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_read_only_calls_batched(self, mock_chat_openai, mock_get_mcp_tools,
+                                     mock_use_mcp_tool, mock_use_mcp_tools):
+        """Test that read-only calls that were not prefetched share one MCP round trip."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        mock_get_mcp_tools.return_value = []
+        self.mock_decider.stream.return_value = [ToolDecision(
+            thought="I should look around and check my inventory.",
+            tool_calls=[ToolCall(tool="look"), ToolCall(tool="inventory")]
+        )]
+        state = dict(self.mock_env.reset.return_value, observation="Room.\n\nNothing.")
+        self.mock_env.reset.return_value = state
+        look = dict(state, observation="Room.")
+        inventory = dict(state, observation="Nothing.")
+        mock_use_mcp_tool.side_effect = [dict(look, moves=1), dict(inventory, moves=2)]
+        mock_use_mcp_tools.return_value = [dict(look, moves=3), dict(inventory, moves=4)]
+        
+        # Run two steps that see the same game state; the second reuses the
+        # cached decision, so nothing is prefetched
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=4,
+            temperature=0
+        )
+        result = workflow.invoke(initial_state)
+        
+        # Assert that the cached calls were sent to the server together
+        self.assertEqual(self.mock_decider.stream.call_count, 1)
+        self.assertEqual(mock_use_mcp_tool.call_count, 2)
+        mock_use_mcp_tools.assert_called_once_with(
+            self.mock_env.server_name, [("look", {}), ("inventory", {})])
+        self.assertEqual(result["action"], "look; inventory")
+        self.assertEqual(result["moves"], 4)
+
+    @patch('src.agent.mcp_langgraph.workflow.use_mcp_tools')
+    @patch('src.agent.mcp_langgraph.workflow.use_mcp_tool')
+    @patch('src.agent.mcp_langgraph.workflow.get_mcp_tools')
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_failed_batch_not_repeated(self, mock_chat_openai, mock_get_mcp_tools,
+                                       mock_use_mcp_tool, mock_use_mcp_tools):
+        """Test that a failed batch is reported instead of rerun one call at a time."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        mock_get_mcp_tools.return_value = []
+        self.mock_decider.stream.return_value = [ToolDecision(
+            thought="I should look around and check my inventory.",
+            tool_calls=[ToolCall(tool="look"), ToolCall(tool="inventory")]
+        )]
+        state = dict(self.mock_env.reset.return_value, observation="Room.\n\nNothing.")
+        self.mock_env.reset.return_value = state
+        look = dict(state, observation="Room.")
+        inventory = dict(state, observation="Nothing.")
+        mock_use_mcp_tool.side_effect = [dict(look, moves=1), dict(inventory, moves=2)]
+        mock_use_mcp_tools.side_effect = Exception("No result")
+
+        # Run two steps; the second sends the cached calls as one batch
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=3,
+            temperature=0
+        )
+        result = workflow.invoke(initial_state)
+
+        # Assert that the failure was reported without calling the tools again
+        mock_use_mcp_tools.assert_called_once()
+        self.assertEqual(mock_use_mcp_tool.call_count, 2)
+        self.assertEqual(result["action"], "look; inventory")
+        self.assertEqual(result["observation"], "Error executing tool batch: No result")
+        self.assertEqual(result["moves"], 3)
+
+    @patch('src.agent.mcp_langgraph.workflow.get_mcp_tools')
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_tool_catalog_discovered_once(self, mock_chat_openai, mock_get_mcp_tools):
+        """Test that the MCP tool catalog is built once per workflow."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        mock_get_mcp_tools.return_value = [
+            {"name": "look", "description": "Look around"},
+            {"name": "examine", "description": "Examine an object",
+             "inputSchema": {"properties": {"object": {"type": "string"}},
+                             "required": ["object"]}}
+        ]
+        del self.mock_env.server_name  # Use direct environment calls
+        self.mock_env.step.side_effect = [
+            dict(self.mock_env.step.return_value, moves=1),
+            dict(self.mock_env.step.return_value, moves=2)
+        ]
+        
+        # Run two steps
+        workflow, initial_state = create_agent_workflow(
+            environment=self.mock_env,
+            model_name="test-model",
+            api_key="test-key",
+            max_steps=2
+        )
+        workflow.invoke(initial_state)
+        
+        # Assert that the tools were only listed once
+        self.assertEqual(self.mock_decider.stream.call_count, 2)
+        mock_get_mcp_tools.assert_called_once()
+        system_message = self.mock_decider.stream.call_args.args[0][0]
+        self.assertIn("- examine: Examine an object", system_message.content)
+        self.assertIn('{"tool":"examine","args":{"object":"mailbox"}}',
+                      system_message.content)
+
+    @patch('src.agent.llm.ChatOpenAI')
     def test_run_workflow(self, mock_chat_openai):
         """Test running the workflow."""
         # Set up the mock
@@ -127,6 +655,7 @@ class TestMcpLangGraphWorkflow(unittest.TestCase):
             "moves": 1,
             "done": False
         }
+        del self.mock_env.server_name  # Use direct environment calls
         
         # Run the workflow
         run_agent_workflow(
@@ -139,9 +668,123 @@ class TestMcpLangGraphWorkflow(unittest.TestCase):
         # Assert that the environment was reset
         self.mock_env.reset.assert_called_once()
         
-        # Assert that the environment step was called at least once
-        self.mock_env.step.assert_called()
+        # Assert that only the selected tool was executed, with no extra
+        # "look" to read the final state
+        self.mock_env.step.assert_called_once_with("examine test")
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_run_batch(self, mock_chat_openai):
+        """Test running several episodes concurrently."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        self.mock_decider.astream.side_effect = lambda messages: _astream([self.decision])
+        envs = [MagicMock(), MagicMock()]
+        for env in envs:
+            env.reset.return_value = self.mock_env.reset.return_value
+            env.step.return_value = self.mock_env.step.return_value
+            del env.server_name  # Use direct environment calls
+        
+        # Run both episodes
+        results = asyncio.run(run_batch(
+            envs, model_name="test-model", api_key="test-key", max_steps=1))
+        
+        # Assert that each environment ran its own episode via astream
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.mock_decider.astream.call_count, 2)
+        for env, result in zip(envs, results):
+            env.step.assert_called_once_with("examine test")
+            self.assertEqual(result["score"], 1)
+
 
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_run_batch_isolates_failures(self, mock_chat_openai):
+        """Test that a failed episode does not stop the rest of the batch."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        self.mock_decider.astream.side_effect = lambda messages: _astream([self.decision])
+        envs = [MagicMock(), MagicMock()]
+        for env in envs:
+            env.reset.return_value = self.mock_env.reset.return_value
+            env.step.return_value = self.mock_env.step.return_value
+            del env.server_name  # Use direct environment calls
+        envs[0].reset.side_effect = RuntimeError("Game crashed")
+        
+        # Run both episodes
+        results = asyncio.run(run_batch(
+            envs, model_name="test-model", api_key="test-key", max_steps=1))
+        
+        # Assert that the failed episode is recorded as None
+        self.assertIsNone(results[0])
+        self.assertEqual(results[1]["score"], 1)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_run_batch_resumes_from_jsonl(self, mock_chat_openai):
+        """Test that episodes completed in the JSONL file are not rerun."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        self.mock_decider.astream.side_effect = lambda messages: _astream([self.decision])
+        envs = [MagicMock(), MagicMock()]
+        for env in envs:
+            env.reset.return_value = self.mock_env.reset.return_value
+            env.step.return_value = self.mock_env.step.return_value
+            del env.server_name  # Use direct environment calls
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Record the first episode as already completed
+            path = os.path.join(tmp_dir, "results.jsonl")
+            with open(path, "w") as fh:
+                fh.write(json.dumps({"episode": 0, "final": True, "score": 5}) + "\n")
+            
+            results = asyncio.run(run_batch(
+                envs, model_name="test-model", api_key="test-key",
+                max_steps=1, output_jsonl=path))
+            
+            with open(path) as fh:
+                records = [json.loads(line) for line in fh]
+        
+        # Assert that only the second episode ran and was recorded
+        envs[0].reset.assert_not_called()
+        self.assertEqual(results[0]["score"], 5)
+        self.assertEqual(results[1]["score"], 1)
+        self.assertEqual(records[1], {
+            "episode": 1, "attempt": 1, "move": 1, "action": "examine test",
+            "observation": "You examined the test object.", "score": 1, "done": False
+        })
+        self.assertTrue(records[2]["final"])
+        self.assertEqual(records[2]["episode"], 1)
+
+    @patch('src.agent.llm.ChatOpenAI')
+    def test_arun_agent_workflow_resumes_from_jsonl(self, mock_chat_openai):
+        """Test that a completed episode is skipped and a rerun is a new attempt."""
+        # Set up the mocks
+        mock_chat_openai.return_value = self.mock_llm
+        self.mock_decider.astream.side_effect = lambda messages: _astream([self.decision])
+        del self.mock_env.server_name  # Use direct environment calls
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Record a completed episode and an interrupted one
+            path = os.path.join(tmp_dir, "results.jsonl")
+            with open(path, "w") as fh:
+                fh.write(json.dumps({"episode": 0, "final": True, "score": 5}) + "\n")
+                fh.write(json.dumps({"episode": 1, "move": 1, "score": 0}) + "\n")
+            
+            results = [
+                asyncio.run(arun_agent_workflow(
+                    self.mock_env, model_name="test-model", api_key="test-key",
+                    max_steps=1, output_jsonl=path, episode_id=episode_id))
+                for episode_id in (0, 1)
+            ]
+            
+            with open(path) as fh:
+                records = [json.loads(line) for line in fh]
+        
+        # Assert that only the interrupted episode ran, as its second attempt
+        self.mock_env.reset.assert_called_once()
+        self.assertEqual(results[0]["score"], 5)
+        self.assertEqual(results[1]["score"], 1)
+        self.assertEqual(len(records), 4)
+        self.assertEqual([record["attempt"] for record in records[2:]], [2, 2])
+        self.assertTrue(records[3]["final"])
 
 if __name__ == '__main__':
     unittest.main()